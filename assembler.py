@@ -0,0 +1,114 @@
+from array import array
+from utils import *
+from peephole import LABEL_OPERANDS
+
+###############################################################################
+# Assembler, run between code generation (and the peephole optimizer) and
+# VM.run
+#
+# The compiler's code is a list of tuples like ('JMPZ', 'LBL3'), with LABEL
+# instructions marking the jump targets. The assembler turns it into a Code
+# object that the VM runs directly:
+#
+#   - every opcode is a small integer, its index in OPCODES
+#   - LABEL instructions are removed, and each label operand becomes the
+#     absolute pc of the instruction after its label
+#   - the calls (JSR, TAIL_JSR, MEMO_JSR) keep the function name after the
+#     pc, since the VM names frames and memo caches after it
+#
+# What the labels and line numbers were is kept in a debug table, so the code
+# can be printed as the compiler made it (disassemble) and a pc traced back to
+# the source.
+###############################################################################
+OPCODES = (
+    'HALT', 'PUSH', 'POP',
+    'ADD', 'SUB', 'MUL', 'DIV', 'EXP', 'MOD', 'AND', 'OR', 'XOR', 'NEG', 'NOT',
+    'LT', 'GT', 'LE', 'GE', 'EQ', 'NE',
+    'PRINT', 'PRINTLN',
+    'JMP', 'JMPZ', 'JSR', 'TAIL_JSR', 'MEMO_JSR', 'RTS',
+    'LOAD_GLOBAL', 'STORE_GLOBAL', 'LOAD_LOCAL', 'STORE_LOCAL', 'TEE_GLOBAL', 'TEE_LOCAL', 'SET_SLOT',
+    'FOR_PREP', 'FOR_LOOP',
+)
+OPCODE = {name: number for number, name in enumerate(OPCODES)}
+
+CALLS = {'JSR', 'TAIL_JSR', 'MEMO_JSR'}
+
+
+class Code:
+    '''
+    Assembled code: the opcode numbers and the operands of each instruction,
+    and the debug table
+    '''
+    __slots__ = ('ops', 'args', 'labels', 'lines')
+
+    def __init__(self, ops, args, labels, lines):
+        self.ops = ops        # array of opcode numbers, by pc
+        self.args = args      # tuple of operands, by pc
+        self.labels = labels  # pc -> names of the labels that were right before it
+        self.lines = lines    # array of source lines, by pc (0 when unknown)
+
+    def __len__(self):
+        return len(self.ops)
+
+
+def assemble(code, lines=None):
+    '''
+    Assemble the compiler's code, with the source line of each instruction
+    from lines if given
+    '''
+    # The pc of each label: the number of real instructions before it
+    targets = {}
+    labels = {}
+    pc = 0
+    for instruction in code:
+        if instruction[0] == 'LABEL':
+            targets[instruction[1]] = pc
+            labels.setdefault(pc, []).append(instruction[1])
+        else:
+            pc += 1
+
+    ops = array('B')
+    args = []
+    line_table = array('i')
+    for index, instruction in enumerate(code):
+        opcode = instruction[0]
+        if opcode == 'LABEL':
+            continue
+        operands = instruction[1:]
+        label_index = LABEL_OPERANDS.get(opcode)
+        if label_index is not None:
+            label = operands[label_index]
+            target = targets.get(label)
+            if target is None:
+                compile_error(f'Jump to undefined label {label}.', lines[index] if lines else 0)
+            operands = operands[:label_index] + (target,) + operands[label_index + 1:]
+            if opcode in CALLS:
+                operands += (label,)
+        ops.append(OPCODE[opcode])
+        args.append(operands)
+        line_table.append(lines[index] if lines else 0)
+    return Code(ops, tuple(args), labels, line_table)
+
+
+def disassemble(code):
+    '''
+    The list of instruction tuples of a Code, with the labels back in place and
+    a label name instead of each jump target pc
+    '''
+    names = {pc: label_names[0] for pc, label_names in code.labels.items()}
+    instructions = []
+    for pc in range(len(code) + 1):
+        for label in code.labels.get(pc, ()):
+            instructions.append(('LABEL', label))
+        if pc == len(code):
+            break
+        opcode = OPCODES[code.ops[pc]]
+        operands = code.args[pc]
+        label_index = LABEL_OPERANDS.get(opcode)
+        if label_index is not None:
+            if opcode in CALLS:
+                operands = (operands[-1],)
+            else:
+                operands = operands[:label_index] + (names[operands[label_index]],) + operands[label_index + 1:]
+        instructions.append((opcode,) + operands)
+    return instructions
@@ -0,0 +1,896 @@
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from array import array
+from lexer import *
+from parser import *
+
+###############################################################################
+# Benchmarks for the Scripty front end and back ends
+#
+#   python bench.py              # run every benchmark
+#   python bench.py stream ...   # run only the named ones
+###############################################################################
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+
+def read_script(name):
+    with open(os.path.join(SCRIPTS_DIR, name)) as file:
+        return file.read()
+
+
+def measure(fn):
+    '''
+    Run fn once, returning (result, seconds, peak traced bytes)
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_stream():
+    '''
+    Peak memory of reading + lexing + parsing a file all at once versus
+    streaming tokens from the file and consuming statements one at a time
+    '''
+    body = read_script('dragon.scredu')
+    print(f"{'copies':>8} {'file KB':>8} {'list peak KB':>13} {'stream peak KB':>15}")
+    for copies in (10, 100, 1000):
+        with tempfile.NamedTemporaryFile('w', suffix='.scredu', delete=False) as file:
+            file.write(body * copies)
+            path = file.name
+        try:
+            def whole():
+                with open(path) as file:
+                    tokens = Lexer(file.read()).tokenize()
+                return sum(1 for stmt in Parser(tokens).iter_stmts())
+
+            def streamed():
+                with open(path) as file:
+                    return sum(1 for stmt in Parser(Lexer(file).iter_tokens()).iter_stmts())
+
+            _, _, whole_peak = measure(whole)
+            _, _, stream_peak = measure(streamed)
+            print(f"{copies:>8} {os.path.getsize(path) // 1024:>8} {whole_peak // 1024:>13} {stream_peak // 1024:>15}")
+        finally:
+            os.remove(path)
+
+
+class LegacyToken:
+    '''
+    The token representation before compact tokens: a plain object with a
+    __dict__ and a string token type
+    '''
+    def __init__(self, token_type, lexeme, line):
+        self.token_type = token_type
+        self.lexeme = lexeme
+        self.line = line
+
+
+class LegacyLexer(Lexer):
+    def add_span(self, token_type, start, end, line):
+        self.tokens.append(LegacyToken(token_names[token_type], self.source[start:end], line))
+
+
+def bench_tokens():
+    '''
+    Tokens/sec and bytes/token of the legacy token objects, slotted Tokens
+    with integer types and the columnar TokenArray, plus the cost of the
+    parser's token type comparisons with string and integer types
+    '''
+    source = read_script('dragon.scredu') * 400
+
+    print(f"{'representation':<28} {'tokens/sec':>12} {'bytes/token':>12}")
+    rows = [
+        ('legacy (scan, dict, str)', lambda: LegacyLexer(source, engine=ENGINE_SCAN).tokenize()),
+        ('Token list (regex)', lambda: Lexer(source).tokenize()),
+        ('TokenArray (regex)', lambda: Lexer(source).tokenize_array()),
+    ]
+    for label, build in rows:
+        start = time.perf_counter()
+        count = len(build())
+        elapsed = time.perf_counter() - start
+        tokens, _, peak = measure(build)
+        print(f"{label:<28} {count / elapsed:>12,.0f} {peak / count:>12.1f}")
+        del tokens
+
+    tokens = Lexer(source).tokenize()
+    legacy_tokens = LegacyLexer(source).tokenize()
+    for label, stream, expected in (('str token type compare', legacy_tokens, 'TOK_IDENTIFIER'),
+                                    ('int token type compare', tokens, TOK_IDENTIFIER)):
+        hits = 0
+        start = time.perf_counter()
+        for _ in range(10):
+            for token in stream:
+                if token.token_type == expected:
+                    hits += 1
+        elapsed = time.perf_counter() - start
+        print(f"{label:<28} {len(stream) * 10 / elapsed:>12,.0f} compares/sec")
+
+    for label, stream in (('parse Token list', tokens), ('parse TokenArray', Lexer(source).tokenize_array())):
+        start = time.perf_counter()
+        Parser(stream).parse()
+        elapsed = time.perf_counter() - start
+        print(f"{label:<28} {len(stream) / elapsed:>12,.0f} tokens/sec")
+
+
+def bench_incremental():
+    '''
+    Latency of a one-character edit and of a one-line insertion in the
+    middle of a growing file: full re-parse versus IncrementalParser
+    '''
+    from incremental import IncrementalParser
+    body = read_script('dragon.scredu')
+    print(f"{'copies':>8} {'full ms':>9} {'edit ms':>9} {'new line ms':>12}")
+    for copies in (10, 100, 1000):
+        source = body * copies
+        start = time.perf_counter()
+        Parser(Lexer(source).tokenize()).parse()
+        full = time.perf_counter() - start
+
+        incremental = IncrementalParser()
+        incremental.parse(source)
+        middle = source.index('3.141592', len(source) // 2)
+        start = time.perf_counter()
+        incremental.edit(middle, middle + 1, '4')
+        edit = time.perf_counter() - start
+        line_start = source.index('\n', middle) + 1
+        start = time.perf_counter()
+        incremental.edit(line_start, line_start, 'value := 0\n')
+        new_line = time.perf_counter() - start
+        print(f"{copies:>8} {full * 1000:>9.2f} {edit * 1000:>9.2f} {new_line * 1000:>12.2f}")
+
+
+def bench_interning():
+    '''
+    Memory held by the tokens and the AST of a large script, with and
+    without interning identifiers in the lexer
+    '''
+    from strings import StringTable
+    source = read_script('dragon.scredu') * 400
+
+    def front_end(strings):
+        tokens = Lexer(source, strings=strings).tokenize()
+        return tokens, Parser(tokens, strings).parse()
+
+    for label, strings in (('no lexer interning', None), ('lexer interning', StringTable())):
+        result, elapsed, peak = measure(lambda: front_end(strings))
+        print(f"{label:<20} {peak / 1024 / 1024:>8.1f} MB peak {elapsed:>7.2f} s")
+        del result
+
+
+def dict_node_class(cls):
+    '''
+    Stand-in for cls before slots: the same fields, assigned in __init__ and
+    stored in a per-instance __dict__
+    '''
+    def __init__(self, node):
+        for field in cls.__slots__:
+            setattr(self, field, getattr(node, field))
+    return type(cls.__name__, (), {'__init__': __init__})
+
+
+def bench_ast():
+    '''
+    Bytes per AST node with slots versus the same fields in a __dict__, and
+    parse throughput with the debug verifier off and on
+    '''
+    source = read_script('dragon.scredu') * 400
+    tokens = Lexer(source).tokenize()
+
+    ast = Parser(tokens).parse()
+    nodes = {}
+    pending = [ast]
+    while pending:
+        node = pending.pop()
+        nodes.setdefault(type(node), node)
+        pending.extend(iter_child_nodes(node))
+    del ast
+
+    copies = 10000
+    print(f"{'node':<16} {'slots bytes':>12} {'dict bytes':>11}")
+    for cls, node in sorted(nodes.items(), key=lambda item: item[0].__name__):
+        legacy = dict_node_class(cls)
+        _, _, slots_peak = measure(lambda: [cls.__new__(cls) for _ in range(copies)])
+        _, _, dict_peak = measure(lambda: [legacy(node) for _ in range(copies)])
+        print(f"{cls.__name__:<16} {slots_peak / copies:>12.1f} {dict_peak / copies:>11.1f}")
+
+    for label, debug in (('parse', False), ('parse + verify_ast', True)):
+        start = time.perf_counter()
+        ast = Parser(tokens).parse()
+        if debug:
+            verify_ast(ast)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<20} {len(tokens) / elapsed:>12,.0f} tokens/sec")
+
+
+def bench_flat():
+    '''
+    Peak memory of parsing into objects versus straight into a FlatAST, and
+    the time of whole-tree passes (counting identifiers, shifting every line,
+    pickling) over both forms
+    '''
+    import pickle
+    from flatast import FlatAST, flatten, parse_flat, node_kinds
+    from incremental import shift_lines
+    source = read_script('dragon.scredu') * 400
+
+    tree, _, tree_peak = measure(lambda: Parser(Lexer(source).iter_tokens()).parse())
+    flat, _, flat_peak = measure(lambda: parse_flat(Parser(Lexer(source).iter_tokens())))
+    print(f"{'nodes':<28} {len(flat):>12,}")
+    print(f"{'parse peak MB':<28} {tree_peak / 1024 / 1024:>12.1f} {flat_peak / 1024 / 1024:>12.1f}")
+
+    def count_tree():
+        count = 0
+        pending = [tree]
+        while pending:
+            node = pending.pop()
+            if type(node) is Identifier:
+                count += 1
+            pending.extend(iter_child_nodes(node))
+        return count
+
+    def shift_flat(delta):
+        flat.lines = array('I', [line + delta for line in flat.lines])
+
+    identifier = node_kinds[Identifier]
+    passes = [
+        ('count identifiers', count_tree, lambda: flat.kinds.count(identifier)),
+        ('shift lines', lambda: shift_lines(tree, 1), lambda: shift_flat(1)),
+        ('pickle', lambda: pickle.dumps(tree, pickle.HIGHEST_PROTOCOL),
+                   lambda: pickle.dumps(flat, pickle.HIGHEST_PROTOCOL)),
+    ]
+    print(f"{'pass':<28} {'objects ms':>12} {'flat ms':>12}")
+    for label, on_tree, on_flat in passes:
+        start = time.perf_counter()
+        on_tree()
+        middle = time.perf_counter()
+        on_flat()
+        end = time.perf_counter()
+        print(f"{label:<28} {(middle - start) * 1000:>12.1f} {(end - middle) * 1000:>12.1f}")
+
+
+class LegacyExprParser(Parser):
+    '''
+    The expression parser before precedence climbing: one recursive method
+    per precedence level
+    '''
+    def primary(self):
+        if self.match(TOK_INTEGER):
+            return Integer(int(self.previous_token().lexeme), line=self.previous_token().line)
+        elif self.match(TOK_FLOAT):
+            return Float(float(self.previous_token().lexeme), line=self.previous_token().line)
+        elif self.match(TOK_TRUE):
+            return Bool(True, line=self.previous_token().line)
+        elif self.match(TOK_FALSE):
+            return Bool(False, line=self.previous_token().line)
+        elif self.match(TOK_STRING):
+            value, sid = self.intern(self.previous_token().lexeme[1:-1])  # Remove the quotes at the beginning and at the end of the lexeme
+            return String(value, line=self.previous_token().line, sid=sid)
+        elif self.match(TOK_LPAREN):
+            expr = self.expr()
+            if (not self.match(TOK_RPAREN)):
+                parse_error(f'Error: ")" expected.', self.previous_token().line)
+            else:
+                return Grouping(expr, line=self.previous_token().line)
+        else:
+            identifier = self.expect(TOK_IDENTIFIER)
+            name, sid = self.intern(identifier.lexeme)
+            if self.match(TOK_LPAREN):
+                args = self.args()
+                self.expect(TOK_RPAREN)
+                return FuncCall(name, args, line=self.previous_token().line, sid=sid)
+            else:
+                return Identifier(name, line=self.previous_token().line, sid=sid)
+
+    def unary(self):
+        if self.match(TOK_NOT) or self.match(TOK_MINUS) or self.match(TOK_PLUS):
+            op = self.previous_token()
+            operand = self.unary()
+            return UnOp(op, operand, line=op.line)
+        return self.primary()
+
+    def exponent(self):
+        expr = self.unary()
+        while self.match(TOK_CARET):
+            op = self.previous_token()
+            right = self.exponent()
+            expr = BinOp(op, expr, right, line=op.line)
+        return expr
+
+    def modulo(self):
+        expr = self.exponent()
+        while self.match(TOK_MOD):
+            op = self.previous_token()
+            right = self.exponent()
+            expr = BinOp(op, expr, right, line=op.line)
+        return expr
+
+    def multiplication(self):
+        expr = self.modulo()
+        while self.match(TOK_STAR) or self.match(TOK_SLASH):
+            op = self.previous_token()
+            right = self.modulo()
+            expr = BinOp(op, expr, right, op.line)
+        return expr
+
+    def addition(self):
+        expr = self.multiplication()
+        while self.match(TOK_PLUS) or self.match(TOK_MINUS):
+            op = self.previous_token()
+            right = self.multiplication()
+            expr = BinOp(op, expr, right, line=op.line)
+        return expr
+
+    def comparison(self):
+        expr = self.addition()
+        while self.match(TOK_GT) or self.match(TOK_GE) or self.match(TOK_LT) or self.match(TOK_LE):
+            op = self.previous_token()
+            right = self.addition()
+            expr = BinOp(op, expr, right, line=op.line)
+        return expr
+
+    def equality(self):
+        expr = self.comparison()
+        while self.match(TOK_NE) or self.match(TOK_EQEQ):
+            op = self.previous_token()
+            right = self.comparison()
+            expr = BinOp(op, expr, right, line=op.line)
+        return expr
+
+    def logical_and(self):
+        expr = self.equality()
+        while self.match(TOK_AND):
+            op = self.previous_token()
+            right = self.equality()
+            expr = LogicalOp(op, expr, right, line=op.line)
+        return expr
+
+    def logical_or(self):
+        expr = self.logical_and()
+        while self.match(TOK_OR):
+            op = self.previous_token()
+            right = self.logical_and()
+            expr = LogicalOp(op, expr, right, line=op.line)
+        return expr
+
+    def expr(self):
+        return self.logical_or()
+
+
+def bench_expr():
+    '''
+    Parse time of the recursive chain of precedence levels versus
+    precedence climbing, on dragon.scredu and on expression-heavy code
+    '''
+    expressions = ''.join(f'x{i} := (a + {i}) * b - c / 2 ^ {i % 3} % 7 > d and ~e or f({i}, -g) == h\n'
+                          for i in range(2000))
+    print(f"{'source':<20} {'chain tokens/sec':>17} {'climbing tokens/sec':>20}")
+    for label, source in (('dragon.scredu x400', read_script('dragon.scredu') * 400), ('expressions', expressions * 20)):
+        tokens = Lexer(source).tokenize()
+        rates = []
+        for parser_class in (LegacyExprParser, Parser):
+            start = time.perf_counter()
+            parser_class(tokens).parse()
+            rates.append(len(tokens) / (time.perf_counter() - start))
+        print(f"{label:<20} {rates[0]:>17,.0f} {rates[1]:>20,.0f}")
+
+
+def bench_cache():
+    '''
+    Startup latency of scripty.py on a cold cache (lex, parse, compile and
+    write the cache) versus a warm one (hash the source and load the cache),
+    as whole processes and for the front end alone
+    '''
+    import subprocess
+    from strings import StringTable
+    from compiler import Compiler
+    from peephole import peephole
+    from assembler import assemble
+    from flatast import flatten
+    from cache import source_key, load_cache, store_cache, clear_cache
+    scripty = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripty.py')
+    function = ('func f{0}(a, b)\n  local c := a * {0} + b ^ 2 - (a / 3)\n  if c > {0} then\n'
+                '    ret c\n  else\n    ret a + b\n  end\nend\n')
+    print(f"{'functions':>10} {'file KB':>8} {'cold ms':>9} {'warm ms':>9} {'front cold ms':>14} {'front warm ms':>14}")
+    for count in (100, 1000, 5000):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'big.scredu')
+            with open(path, 'w') as file:
+                file.write(''.join(function.format(i) for i in range(count)) + 'println f1(1, 2)\n')
+
+            def process(*flags):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, scripty, path, *flags], stdout=subprocess.DEVNULL, check=True)
+                return time.perf_counter() - start
+
+            cold = min(process('--clear-cache') for _ in range(3))
+            warm = min(process() for _ in range(3))
+
+            def front_end_cold():
+                clear_cache(path)
+                key = source_key(path)
+                strings = StringTable()
+                with open(path) as file:
+                    ast = Parser(Lexer(file, strings=strings).iter_tokens(), strings).parse()
+                compiler = Compiler()
+                code = assemble(*peephole(compiler.generate_code(ast), compiler.lines)[:2])
+                store_cache(path, key, strings, flatten(ast), code)
+
+            def front_end_warm():
+                return load_cache(path, source_key(path))
+
+            timings = []
+            for front_end in (front_end_cold, front_end_warm):
+                start = time.perf_counter()
+                front_end()
+                timings.append(time.perf_counter() - start)
+            print(f"{count:>10} {os.path.getsize(path) // 1024:>8} {cold * 1000:>9.0f} {warm * 1000:>9.0f}"
+                  f" {timings[0] * 1000:>14.1f} {timings[1] * 1000:>14.1f}")
+
+
+def run_backend(interpreter, ast):
+    import io
+    from contextlib import redirect_stdout
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        interpreter.interpret_ast(ast)
+        return time.perf_counter() - start
+
+
+def bench_closures():
+    '''
+    Run time of the tree-walking Interpreter versus the closure-compiling
+    back end on the same ASTs, and the cost of building the closures
+    '''
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter, ClosureCompiler
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+    programs = []
+    for name, replace in (('algol.scredu', None), ('dragon.scredu', ('dragon(60, 12, 1)', 'dragon(60, 4, 1)'))):
+        with open(os.path.join(scripts, name)) as file:
+            source = file.read()
+        if replace:
+            source = source.replace(*replace)
+        programs.append((name, Parser(Lexer(source).tokenize()).parse()))
+    print(f"{'script':>14} {'interp s':>9} {'closures s':>11} {'speedup':>8} {'build ms':>9}")
+    for name, ast in programs:
+        interpreted = min(run_backend(Interpreter(), ast) for _ in range(3))
+        closures = min(run_backend(ClosureInterpreter(), ast) for _ in range(3))
+        start = time.perf_counter()
+        ClosureCompiler().build(ast)
+        build = time.perf_counter() - start
+        print(f"{name:>14} {interpreted:>9.3f} {closures:>11.3f} {interpreted / closures:>7.1f}x {build * 1000:>9.2f}")
+
+
+def bench_scopes():
+    '''
+    Cost of reading and assigning globals from inside nested blocks in the
+    tree-walking interpreter, which should not depend on the nesting depth
+    '''
+    from interpreter import Interpreter
+    iterations = 20000
+    print(f"{'depth':>6} {'ms':>8} {'us/iteration':>13}")
+    for depth in (1, 10, 100, 1000):
+        source = ('x := 1\nn := 0\ni := 0\n' + 'if true then\n' * depth +
+                  f'while i < {iterations} do\n  n := n + x\n  i := i + 1\nend\n' + 'end\n' * depth)
+        ast = run_deep(Parser(Lexer(source).tokenize()).parse)
+        elapsed = min(run_deep(run_backend, Interpreter(), ast) for _ in range(3))
+        print(f"{depth:>6} {elapsed * 1000:>8.1f} {elapsed / iterations * 1e6:>13.2f}")
+
+
+def bench_calls():
+    '''
+    Calls per second in the tree-walking back ends, on call-heavy programs
+    that return from a function body, an if and nested loops
+    '''
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    programs = [
+        ('fib(20)', 21891,
+         'func fib(n)\n  if n < 2 then\n    ret n\n  end\n  ret fib(n - 1) + fib(n - 2)\nend\nx := fib(20)\n'),
+        ('loop of calls', 30000,
+         'func inc(a)\n  ret a + 1\nend\nx := 0\nfor i := 1, 30000 do\n  x := inc(x)\nend\n'),
+        ('ret from loops', 10000,
+         'func find(n)\n  for j := 1, 3 do\n    for k := 1, 3 do\n      if j * k == n then\n        ret k\n      end\n'
+         '    end\n  end\n  ret 0\nend\nx := 0\nfor i := 1, 10000 do\n  x := x + find(4)\nend\n'),
+    ]
+    print(f"{'program':>15} {'calls':>7} {'interp calls/s':>15} {'closures calls/s':>17}")
+    for name, calls, source in programs:
+        ast = Parser(Lexer(source).tokenize()).parse()
+        # Without memoization, which would skip most of these calls
+        rates = [calls / min(run_deep(run_backend, interpreter_class(memoize=False), ast) for _ in range(3))
+                 for interpreter_class in (Interpreter, ClosureInterpreter)]
+        print(f"{name:>15} {calls:>7} {rates[0]:>15,.0f} {rates[1]:>17,.0f}")
+
+
+def bench_tailcalls():
+    '''
+    A tail-recursive loop on every back end: the time grows with the number
+    of iterations, the peak memory should not
+    '''
+    import io
+    from contextlib import redirect_stdout
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    from compiler import Compiler
+    from vm import VM
+    print(f"{'backend':>12} {'iterations':>11} {'s':>7} {'peak KB':>8}")
+    for iterations in (10000, 1000000):
+        source = ('func loop(n, acc)\n  if n == 0 then\n    ret acc\n  end\n  ret loop(n - 1, acc + n)\nend\n'
+                  f'println loop({iterations}, 0)\n')
+        ast = Parser(Lexer(source).tokenize()).parse()
+        code = Compiler().generate_code(ast)
+        backends = [
+            ('interpreter', lambda: Interpreter().interpret_ast(ast)),
+            ('closures', lambda: ClosureInterpreter().interpret_ast(ast)),
+            ('vm', lambda: VM().run(code)),
+        ]
+        for name, backend in backends:
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                backend()
+                elapsed = time.perf_counter() - start
+                tracemalloc.start()
+                backend()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            print(f"{name:>12} {iterations:>11} {elapsed:>7.2f} {peak // 1024:>8}")
+
+
+def bench_optimizer():
+    '''
+    Run time of unoptimized and optimized ASTs on both AST back ends, with
+    the number of rewrites at each level
+    '''
+    from strings import StringTable
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    from optimizer import optimize, OPT_NONE, OPT_SAFE, OPT_FAST_MATH
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+    with open(os.path.join(scripts, 'dragon.scredu')) as file:
+        dragon = file.read().replace('dragon(60, 12, 1)', 'dragon(60, 4, 1)')
+    constants = ('n := 0\ni := 0\nwhile i < 20000 do\n  n := n + 2 * 3.5 - 1 / 4 + (i - 1) * 1\n'
+                 '  if 1 > 2 then\n    println "never"\n  end\n  i := i + 1\nend\nprintln n\n')
+    print(f"{'program':>10} {'level':>6} {'rewrites':>9} {'interp s':>9} {'closures s':>11}")
+    for name, source in (('dragon', dragon), ('constants', constants)):
+        for level in (OPT_NONE, OPT_SAFE, OPT_FAST_MATH):
+            strings = StringTable()
+            ast, rewrites = optimize(Parser(Lexer(source, strings=strings).tokenize(), strings).parse(), strings, level)
+            interpreted = min(run_backend(Interpreter(), ast) for _ in range(3))
+            closures = min(run_backend(ClosureInterpreter(), ast) for _ in range(3))
+            print(f"{name:>10} {level:>6} {len(rewrites):>9} {interpreted:>9.3f} {closures:>11.3f}")
+
+
+def bench_forloops():
+    '''
+    Numeric for loops on every back end: an empty body, which is all loop
+    overhead, and the factorial helper of dragon.scredu. The VM runs each
+    loop with its fused FOR_PREP/FOR_LOOP opcodes, and vm-while is the same
+    loop written as a while loop, which takes a load/add/store/compare/jump
+    sequence per iteration.
+    '''
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    from compiler import Compiler
+    from vm import VM
+    programs = [
+        ('empty', 300000, 'for i := 1, 300000 do\nend\n',
+         'i := 1\nwhile i <= 300000 do\n  i := i + 1\nend\n'),
+        ('factorial', 200000, 'func factorial(n)\n  res := 1.0\n  for i := 1, n do\n    res := res * i\n  end\n  ret res\nend\n'
+                              'for k := 1, 2000 do\n  factorial(100)\nend\n',
+         'func factorial(n)\n  res := 1.0\n  i := 1\n  while i <= n do\n    res := res * i\n    i := i + 1\n  end\n'
+         '  ret res\nend\nk := 1\nwhile k <= 2000 do\n  factorial(100)\n  k := k + 1\nend\n'),
+    ]
+
+    def run_vm(source):
+        code = Compiler().generate_code(Parser(Lexer(source).tokenize()).parse())
+        start = time.perf_counter()
+        VM(memoize=False).run(code)
+        return time.perf_counter() - start
+
+    print(f"{'loop':>10} {'iterations':>11} {'interp ns/it':>13} {'closures ns/it':>14} {'vm ns/it':>9} {'vm-while ns/it':>15}")
+    for name, iterations, source, while_source in programs:
+        ast = Parser(Lexer(source).tokenize()).parse()
+        interpreted = min(run_backend(Interpreter(), ast) for _ in range(3))
+        closures = min(run_backend(ClosureInterpreter(), ast) for _ in range(3))
+        vm = min(run_vm(source) for _ in range(3))
+        vm_while = min(run_vm(while_source) for _ in range(3))
+        print(f"{name:>10} {iterations:>11} {interpreted / iterations * 1e9:>13.0f} {closures / iterations * 1e9:>14.0f} "
+              f"{vm / iterations * 1e9:>9.0f} {vm_while / iterations * 1e9:>15.0f}")
+
+
+def bench_memo():
+    '''
+    dragon.scredu on every back end with and without memoization of its pure
+    functions (sin, cos, pow, factorial)
+    '''
+    import io
+    from contextlib import redirect_stdout
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    from compiler import Compiler
+    from vm import VM
+    from memo import memo_stats
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+    with open(os.path.join(scripts, 'dragon.scredu')) as file:
+        source = file.read().replace('dragon(60, 12, 1)', 'dragon(60, 6, 1)')
+    ast = Parser(Lexer(source).tokenize()).parse()
+    code = Compiler().generate_code(ast)
+    backends = [
+        ('interpreter', Interpreter, lambda backend: backend.interpret_ast(ast)),
+        ('closures', ClosureInterpreter, lambda backend: backend.interpret_ast(ast)),
+        ('vm', VM, lambda backend: backend.run(code)),
+    ]
+    print(f"{'backend':>12} {'plain s':>8} {'memo s':>8} {'speedup':>8} {'hit rate':>9}")
+    for name, backend_class, run in backends:
+        timings = []
+        for memoize in (False, True):
+            backend = backend_class(memoize)
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                run(backend)
+                timings.append(time.perf_counter() - start)
+        stats = memo_stats(backend.memo).values()
+        hits = sum(stat['hits'] for stat in stats)
+        calls = hits + sum(stat['misses'] for stat in stats)
+        print(f"{name:>12} {timings[0]:>8.3f} {timings[1]:>8.3f} {timings[0] / timings[1]:>7.1f}x {hits / calls:>9.1%}")
+
+
+def bench_callsites():
+    '''
+    Calls per second and inline cache hit rate of the tree-walking back ends,
+    on calls from a loop body and from functions declared in a loop
+    '''
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    from callsites import call_site_stats
+    programs = [
+        ('while of calls', 30000,
+         'func inc(a)\n  ret a + 1\nend\nx := 0\nwhile x < 30000 do\n  x := inc(x)\nend\n'),
+        ('nested calls', 30000,
+         'func sq(a)\n  ret a * a\nend\nfunc norm(a, b)\n  ret sq(a) + sq(b)\nend\n'
+         'x := 0\nfor i := 1, 10000 do\n  x := norm(i, x % 7)\nend\n'),
+        ('redeclared', 20000,
+         'x := 0\nfor i := 1, 10000 do\n  func inc(a)\n    ret a + 1\n  end\n  x := inc(inc(x))\nend\n'),
+        ('other declared', 20000,
+         'func inc(a)\n  ret a + 1\nend\nx := 0\nfor i := 1, 10000 do\n  func helper(a)\n    ret a\n  end\n'
+         '  x := inc(inc(x))\nend\n'),
+    ]
+    print(f"{'program':>15} {'calls':>7} {'interp calls/s':>15} {'closures calls/s':>17} {'hit rate':>9}")
+    for name, calls, source in programs:
+        ast = Parser(Lexer(source).tokenize()).parse()
+        rates = []
+        for interpreter_class in (Interpreter, ClosureInterpreter):
+            interpreter = interpreter_class(memoize=False)
+            rates.append(calls / min(run_deep(run_backend, interpreter, ast) for _ in range(3)))
+        stats = call_site_stats(interpreter.call_sites)
+        hit_rate = stats['hits'] / (stats['hits'] + stats['misses'])
+        print(f"{name:>15} {calls:>7} {rates[0]:>15,.0f} {rates[1]:>17,.0f} {hit_rate:>9.1%}")
+
+
+def bench_budget():
+    '''
+    What a step budget costs: dragon.scredu on every back end without a
+    budget, and with one too large to run out
+    '''
+    import io
+    from contextlib import redirect_stdout
+    from interpreter import Interpreter
+    from closures import ClosureInterpreter
+    from compiler import Compiler
+    from vm import VM
+    from budget import Budget
+    scripts = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+    with open(os.path.join(scripts, 'dragon.scredu')) as file:
+        source = file.read().replace('dragon(60, 12, 1)', 'dragon(60, 5, 1)')
+    ast = Parser(Lexer(source).tokenize()).parse()
+    code = Compiler().generate_code(ast)
+    backends = [
+        ('interpreter', lambda budget: Interpreter(memoize=False).interpret_ast(ast, budget)),
+        ('closures', lambda budget: ClosureInterpreter(memoize=False).interpret_ast(ast, budget)),
+        ('vm', lambda budget: VM(memoize=False).run(code, budget)),
+    ]
+    print(f"{'backend':>12} {'plain s':>8} {'budget s':>9} {'overhead':>9} {'steps':>9}")
+    for name, run in backends:
+        timings = []
+        for budget in (None, Budget(max_steps=10 ** 12)):
+            best = None
+            for _ in range(3):
+                with redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    result = run_deep(run, budget)
+                    elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        print(f"{name:>12} {timings[0]:>8.3f} {timings[1]:>9.3f} {timings[1] / timings[0] - 1:>9.1%} {result.steps:>9}")
+
+
+def bench_peephole():
+    '''
+    Instructions of each script in scripts/ before and after the peephole
+    optimizer: in the code, and run by the VM (its budget's step count)
+    '''
+    import io
+    from contextlib import redirect_stdout
+    from compiler import Compiler
+    from vm import VM
+    from budget import Budget
+    from peephole import peephole
+
+    def executed(code):
+        with redirect_stdout(io.StringIO()):
+            try:
+                return VM().run(code, Budget()).steps
+            except SystemExit:
+                return None
+
+    print(f"{'script':>20} {'code':>6} {'->':>6} {'saved':>6} {'run':>9} {'->':>9} {'saved':>6}")
+    for name in sorted(os.listdir(SCRIPTS_DIR)):
+        try:
+            with redirect_stdout(io.StringIO()):
+                code = Compiler().generate_code(Parser(Lexer(read_script(name)).tokenize()).parse())
+        except SystemExit:
+            print(f"{name:>20} does not compile")
+            continue
+        optimized, lines, rewrites = peephole(code)
+        before, after = executed(code), executed(optimized)
+        line = f"{name:>20} {len(code):>6} {len(optimized):>6} {1 - len(optimized) / len(code):>6.0%}"
+        if before is not None and after is not None:
+            line += f" {before:>9} {after:>9} {1 - after / before:>6.0%}"
+        print(line)
+
+
+def bench_symbols():
+    '''
+    Compile time of programs with many names: globals set and read at the
+    top level, and locals of one function, up to 100k of each
+    '''
+    from compiler import Compiler
+
+    def globals_program(n):
+        return ''.join(f'x{i} := {i}\n' for i in range(n)) + ''.join(f'println x{i}\n' for i in range(n))
+
+    def locals_program(n):
+        return ('func f()\n' + ''.join(f'  local x{i} := {i}\n' for i in range(n)) +
+                ''.join(f'  println x{i}\n' for i in range(n)) + 'end\nf()\n')
+
+    print(f"{'program':>10} {'names':>7} {'compile s':>10} {'us/name':>8}")
+    for name, program in (('globals', globals_program), ('locals', locals_program)):
+        for n in (1000, 10000, 100000):
+            ast = Parser(Lexer(program(n)).tokenize()).parse()
+            start = time.perf_counter()
+            Compiler().generate_code(ast)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10} {n:>7} {elapsed:>10.3f} {elapsed / n * 1e6:>8.2f}")
+
+
+def bench_assembler():
+    '''
+    Cost of assembling each script in scripts/, and how fast the VM runs the
+    assembled code of dragon.scredu and a while loop, in instructions per
+    second
+    '''
+    import io
+    from contextlib import redirect_stdout
+    from compiler import Compiler
+    from peephole import peephole
+    from assembler import assemble
+    from budget import Budget
+    from vm import VM
+
+    print(f"{'script':>20} {'instructions':>13} {'assemble ms':>12}")
+    for name in sorted(os.listdir(SCRIPTS_DIR)):
+        try:
+            with redirect_stdout(io.StringIO()):
+                compiler = Compiler()
+                code, lines, _ = peephole(compiler.generate_code(Parser(Lexer(read_script(name)).tokenize()).parse()),
+                                          compiler.lines)
+        except SystemExit:
+            continue
+        start = time.perf_counter()
+        assembled = assemble(code, lines)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>20} {len(assembled):>13} {elapsed * 1e3:>12.3f}")
+
+    dragon = read_script('dragon.scredu').replace('dragon(60, 12, 1)', 'dragon(60, 6, 1)')
+    loop = 'i := 0\nwhile i < 200000 do\n  i := i + 1\nend\n'
+    print(f"{'program':>10} {'executed':>10} {'run s':>7} {'M instr/s':>10}")
+    for name, source in (('dragon', dragon), ('while', loop)):
+        compiler = Compiler()
+        code = assemble(*peephole(compiler.generate_code(Parser(Lexer(source).tokenize()).parse()), compiler.lines)[:2])
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            steps = VM(memoize=False).run(code, Budget()).steps
+            elapsed = time.perf_counter() - start
+        print(f"{name:>10} {steps:>10} {elapsed:>7.3f} {steps / elapsed / 1e6:>10.2f}")
+
+
+def bench_bytecode():
+    '''
+    Cold start of a large generated script from its source (lex, parse,
+    compile, peephole and assemble) versus loading its bytecode file, as whole
+    processes and for the loading alone
+    '''
+    import subprocess
+    from compiler import Compiler
+    from peephole import peephole
+    from assembler import assemble
+    from bytecode import BYTECODE_SUFFIX, load_bytecode
+    scripty = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripty.py')
+    function = ('func f{0}(a, b)\n  local c := a * {0} + b ^ 2 - (a / 3)\n  if c > {0} then\n'
+                '    ret c\n  else\n    ret a + b\n  end\nend\n')
+    # Only functions that are called are compiled
+    call = 'x := x + f{0}(1, 2)\n'
+    print(f"{'functions':>10} {'.scb KB':>8} {'source ms':>10} {'.scb ms':>8} {'compile ms':>11} {'load ms':>8}")
+    for count in (100, 1000, 5000):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'big.scredu')
+            source = (''.join(function.format(i) for i in range(count)) + 'x := 0\n' +
+                      ''.join(call.format(i) for i in range(count)) + 'println x\n')
+            with open(path, 'w') as file:
+                file.write(source)
+            bytecode_path = os.path.join(directory, 'big' + BYTECODE_SUFFIX)
+            subprocess.run([sys.executable, scripty, 'compile', path, '-o', bytecode_path],
+                           stdout=subprocess.DEVNULL, check=True)
+
+            def process(*args):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, scripty, *args], stdout=subprocess.DEVNULL, check=True)
+                return time.perf_counter() - start
+
+            from_source = min(process(path, '--no-cache') for _ in range(3))
+            from_bytecode = min(process(bytecode_path) for _ in range(3))
+
+            def compile_source():
+                compiler = Compiler()
+                code = compiler.generate_code(Parser(Lexer(source).tokenize()).parse())
+                return assemble(*peephole(code, compiler.lines)[:2])
+
+            def timed(function):
+                start = time.perf_counter()
+                function()
+                return time.perf_counter() - start
+
+            compile_time = min(timed(compile_source) for _ in range(3))
+            load_time = min(timed(lambda: load_bytecode(bytecode_path)) for _ in range(3))
+            size = os.path.getsize(bytecode_path) / 1024
+            print(f"{count:>10} {size:>8.0f} {from_source * 1e3:>10.1f} {from_bytecode * 1e3:>8.1f} "
+                  f"{compile_time * 1e3:>11.1f} {load_time * 1e3:>8.1f}")
+
+
+BENCHMARKS = {
+    'stream': bench_stream,
+    'tokens': bench_tokens,
+    'incremental': bench_incremental,
+    'interning': bench_interning,
+    'ast': bench_ast,
+    'flat': bench_flat,
+    'expr': bench_expr,
+    'cache': bench_cache,
+    'closures': bench_closures,
+    'scopes': bench_scopes,
+    'calls': bench_calls,
+    'tailcalls': bench_tailcalls,
+    'optimizer': bench_optimizer,
+    'forloops': bench_forloops,
+    'memo': bench_memo,
+    'callsites': bench_callsites,
+    'budget': bench_budget,
+    'peephole': bench_peephole,
+    'symbols': bench_symbols,
+    'assembler': bench_assembler,
+    'bytecode': bench_bytecode,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
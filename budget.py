@@ -0,0 +1,132 @@
+import time
+from itertools import chain
+
+###############################################################################
+# Step and wall-clock budgets of a run
+#
+# A back end given a Budget stops once the run has taken max_steps steps or
+# max_seconds seconds, and reports it in a RunResult instead of running on.
+# A step is:
+#
+#   - on the VM, one instruction
+#   - on the tree-walking back ends, one loop iteration or one function call,
+#     since only those can make a run go on forever
+#
+# The steps are counted down, and the limits only checked every check_every
+# steps, so a budget costs little even with a short time limit.
+#
+# The VM keeps its whole state in pc, stack and frames, so a run it stopped
+# can go on later with VM.resume() and another budget: a scheduler can give
+# many programs a slice each in turn. The tree-walking back ends keep theirs
+# on the Python stack, so their runs end where the budget runs out.
+###############################################################################
+CHECK_EVERY = 1000  # steps between two checks of the limits
+
+RUN_DONE = 'done'
+RUN_OUT_OF_STEPS = 'out of steps'
+RUN_OUT_OF_TIME = 'out of time'
+
+
+class OutOfBudget(Exception):
+    '''
+    Unwinds a tree-walking back end to the top of the run
+    '''
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class Budget:
+    '''
+    The limits of a run, or of one slice of a VM run. None means no limit.
+    '''
+    __slots__ = ('max_steps', 'max_seconds', 'check_every', 'steps', 'chunk', 'left', 'started', 'deadline')
+
+    def __init__(self, max_steps=None, max_seconds=None, check_every=CHECK_EVERY):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.check_every = check_every
+        self.steps = 0        # steps taken up to the last check
+        self.chunk = 0        # steps between the last check and the next one
+        self.left = 0         # steps to take before the next check
+        self.started = None
+        self.deadline = None
+
+    def start(self):
+        self.steps = 0
+        self.started = time.perf_counter()
+        self.deadline = None if self.max_seconds is None else self.started + self.max_seconds
+        self.chunk = self.left = self.next_check()
+
+    def next_check(self):
+        if self.max_steps is None:
+            return self.check_every
+        return min(self.check_every, self.max_steps - self.steps)
+
+    def count(self):
+        '''
+        Add the steps taken since the last count
+        '''
+        self.steps += self.chunk - self.left
+        self.chunk = self.left
+
+    def check(self):
+        '''
+        The status to stop the run with, or None to go on for another chunk
+        '''
+        self.count()
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            return RUN_OUT_OF_STEPS
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return RUN_OUT_OF_TIME
+        self.chunk = self.left = self.next_check()
+        return None
+
+    def tick(self):
+        '''
+        One step of a tree-walking back end, about to be taken
+        '''
+        if self.left <= 0:
+            status = self.check()
+            if status is not None:
+                raise OutOfBudget(status)
+        self.left -= 1
+
+    def metered(self, values):
+        '''
+        The values of a counted loop (a range), one step each. They are taken
+        a chunk at a time, so an early 'ret' may leave a chunk partly used.
+        '''
+        return chain.from_iterable(self.chunks(values))
+
+    def chunks(self, values):
+        while values:
+            if self.left <= 0:
+                status = self.check()
+                if status is not None:
+                    raise OutOfBudget(status)
+            chunk = values[:self.left]
+            self.left -= len(chunk)
+            yield chunk
+            values = values[len(chunk):]
+
+    def result(self, status, resumable=False):
+        self.count()
+        return RunResult(status, self.steps, time.perf_counter() - self.started, resumable)
+
+
+class RunResult:
+    '''
+    How a run (or a VM slice) ended, with the steps and seconds it took.
+    steps is None when the run had no budget, since nothing counted them.
+    '''
+    __slots__ = ('status', 'steps', 'seconds', 'resumable')
+
+    def __init__(self, status, steps=None, seconds=None, resumable=False):
+        self.status = status
+        self.steps = steps
+        self.seconds = seconds
+        self.resumable = resumable  # a VM stopped by its budget, see VM.resume()
+
+    def __repr__(self):
+        return f'RunResult({self.status!r}, steps={self.steps}, seconds={self.seconds})'
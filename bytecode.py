@@ -0,0 +1,294 @@
+import os
+import sys
+import mmap
+import zlib
+import struct
+import tempfile
+from array import array
+from compiler import COMPILER_VERSION
+from assembler import *
+
+###############################################################################
+# Binary bytecode files (.scb), written by 'scripty.py compile' and run by
+# the VM without parsing or compiling the source again
+#
+# All numbers are little-endian. The file is a fixed-size header and a body:
+#
+#   header     magic, format version, compiler version, a checksum of the
+#              opcode table, the number of constants, instructions and labels,
+#              the size of the body and its CRC-32
+#   constants  every operand value once: numbers, strings, booleans and
+#              tuples of other constants (a PUSH value, the operands of an
+#              instruction), each a kind byte and its payload. Integers that
+#              do not fit in 64 bits are stored as decimal text. The pool also
+#              holds byte strings, for the script cache (cache.py).
+#   code       one opcode byte per instruction, padded to 4 bytes, then the
+#              constant index of each instruction's operands as a u32
+#   functions  (name, pc) of every label: the entry point of each function
+#              and the other jump targets, for disassembly
+#   lines      the source line of each instruction as a u32
+#
+# A constant only refers to constants before it, so the pool is read in one
+# pass. load_bytecode() maps the file and checks the header and the checksum
+# before reading anything else, so a file that is truncated, corrupt or made
+# by another version of the compiler is rejected with a BytecodeError instead
+# of running.
+###############################################################################
+BYTECODE_SUFFIX = '.scb'
+BYTECODE_MAGIC = b'SCRIPTYB'
+BYTECODE_FORMAT = 1
+
+HEADER = struct.Struct('<8sHHIIIIII')
+
+# Opcode numbers are only valid with the same opcode table
+OPCODES_CHECKSUM = zlib.crc32(','.join(OPCODES).encode())
+
+# Kinds of constants
+K_FLOAT = 0
+K_INT = 1
+K_FALSE = 2
+K_TRUE = 3
+K_STR = 4
+K_TUPLE = 5
+K_BYTES = 6
+K_BIGINT = 7
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+DOUBLE = struct.Struct('<d')
+INT64 = struct.Struct('<q')
+UINT32 = struct.Struct('<I')
+LABEL = struct.Struct('<II')
+
+
+class BytecodeError(Exception):
+    pass
+
+
+def constant_key(value):
+    '''
+    A key for value that tells apart constants that compare equal, like True,
+    1 and 1.0, or 0.0 and -0.0, also inside tuples
+    '''
+    if type(value) is tuple:
+        return (tuple, tuple([constant_key(item) for item in value]))
+    if type(value) is float:
+        return (float, DOUBLE.pack(value))
+    return (type(value), value)
+
+
+class ConstantPool:
+    '''
+    The constants of a file being written, each stored once
+    '''
+    def __init__(self):
+        self.index = {}  # constant_key(value) -> constant index
+        self.data = bytearray()
+        self.count = 0
+
+    def add(self, value):
+        key = constant_key(value)
+        index = self.index.get(key)
+        if index is not None:
+            return index
+        if type(value) is bool:
+            entry = bytes([K_TRUE if value else K_FALSE])
+        elif type(value) is float:
+            entry = bytes([K_FLOAT]) + DOUBLE.pack(value)
+        elif type(value) is int and INT64_MIN <= value <= INT64_MAX:
+            entry = bytes([K_INT]) + INT64.pack(value)
+        elif type(value) is int:
+            digits = str(value).encode('ascii')
+            entry = bytes([K_BIGINT]) + UINT32.pack(len(digits)) + digits
+        elif type(value) is str:
+            encoded = value.encode('utf-8')
+            entry = bytes([K_STR]) + UINT32.pack(len(encoded)) + encoded
+        elif type(value) is bytes:
+            entry = bytes([K_BYTES]) + UINT32.pack(len(value)) + value
+        elif type(value) is tuple:
+            items = [self.add(item) for item in value]
+            entry = bytes([K_TUPLE]) + UINT32.pack(len(items)) + struct.pack(f'<{len(items)}I', *items)
+        else:
+            raise BytecodeError(f'Cannot store a constant of type {type(value).__name__}.')
+        self.data += entry
+        index = self.index[key] = self.count
+        self.count += 1
+        return index
+
+
+def padding(size):
+    return b'\0' * (-size % 4)
+
+
+def dump_bytecode(code):
+    '''
+    The bytes of the bytecode file of an assembled Code
+    '''
+    pool = ConstantPool()
+    args = array('I', [pool.add(operands) for operands in code.args])
+    names = [(pool.add(name), pc) for pc, label_names in sorted(code.labels.items()) for name in label_names]
+    lines = array('I', code.lines)
+    if sys.byteorder != 'little':
+        args.byteswap()
+        lines.byteswap()
+    body = bytearray(pool.data)
+    body += padding(len(body))
+    body += bytes(code.ops)
+    body += padding(len(body))
+    body += args.tobytes()
+    for name, pc in names:
+        body += LABEL.pack(name, pc)
+    body += lines.tobytes()
+    header = HEADER.pack(BYTECODE_MAGIC, BYTECODE_FORMAT, COMPILER_VERSION, OPCODES_CHECKSUM,
+                         pool.count, len(code), len(names), len(body), zlib.crc32(body))
+    return header + body
+
+
+def write_bytecode(path, code):
+    '''
+    Write the bytecode file of an assembled Code, replacing the file at once
+    so a reader never sees half of it
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(dump_bytecode(code))
+        # mkstemp makes the file private, but a bytecode file is deployed like the source
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def is_bytecode_file(path):
+    '''
+    Whether the file starts like a bytecode file
+    '''
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(BYTECODE_MAGIC)) == BYTECODE_MAGIC
+    except OSError:
+        return False
+
+
+def read_constants(data, offset, count):
+    '''
+    Decode count constants from data at offset, returning them and the offset
+    after them
+    '''
+    constants = []
+    append = constants.append
+    for _ in range(count):
+        kind = data[offset]
+        offset += 1
+        if kind == K_FLOAT:
+            append(DOUBLE.unpack_from(data, offset)[0])
+            offset += 8
+        elif kind == K_INT:
+            append(INT64.unpack_from(data, offset)[0])
+            offset += 8
+        elif kind == K_BIGINT:
+            size = UINT32.unpack_from(data, offset)[0]
+            offset += 4
+            try:
+                append(int(str(data[offset:offset + size], 'ascii')))
+            except ValueError:
+                raise BytecodeError('Bad integer constant.')
+            offset += size
+        elif kind == K_FALSE or kind == K_TRUE:
+            append(kind == K_TRUE)
+        elif kind == K_STR:
+            size = UINT32.unpack_from(data, offset)[0]
+            offset += 4
+            append(str(data[offset:offset + size], 'utf-8'))
+            offset += size
+        elif kind == K_BYTES:
+            size = UINT32.unpack_from(data, offset)[0]
+            offset += 4
+            value = bytes(data[offset:offset + size])
+            if len(value) != size:
+                raise BytecodeError('Truncated constant.')
+            append(value)
+            offset += size
+        elif kind == K_TUPLE:
+            size = UINT32.unpack_from(data, offset)[0]
+            offset += 4
+            items = struct.unpack_from(f'<{size}I', data, offset)
+            offset += 4 * size
+            if items and max(items) >= len(constants):
+                raise BytecodeError('Bad constant reference.')
+            append(tuple([constants[item] for item in items]))
+        else:
+            raise BytecodeError(f'Unknown constant kind {kind}.')
+    return constants, offset
+
+
+def u32_view(data, offset, count):
+    '''
+    count u32 numbers of data at offset, without copying them where the
+    machine is little-endian
+    '''
+    if sys.byteorder == 'little':
+        return memoryview(data)[offset:offset + 4 * count].cast('I')
+    numbers = array('I', data[offset:offset + 4 * count])
+    numbers.byteswap()
+    return numbers
+
+
+def load_bytecode(path):
+    '''
+    Map a bytecode file and return its Code. Raises BytecodeError if the file
+    is not a bytecode file of this version, or is damaged.
+    '''
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                raise BytecodeError(f'{path} is not a Scripty bytecode file.')
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except OSError as e:
+        raise BytecodeError(f'Cannot read {path}: {e.strerror}.')
+    return read_bytecode(data, path)
+
+
+def read_bytecode(data, path):
+    '''
+    The Code of the bytecode file whose bytes are data (bytes, an mmap or a
+    memoryview), read without copying the opcodes and lines. path is only
+    used in the errors.
+    '''
+    if len(data) < HEADER.size:
+        raise BytecodeError(f'{path} is not a Scripty bytecode file.')
+    magic, version, compiler_version, opcodes, constant_count, count, label_count, body_size, checksum = \
+        HEADER.unpack_from(data, 0)
+    if magic != BYTECODE_MAGIC:
+        raise BytecodeError(f'{path} is not a Scripty bytecode file.')
+    if version != BYTECODE_FORMAT or compiler_version != COMPILER_VERSION or opcodes != OPCODES_CHECKSUM:
+        raise BytecodeError(f'{path} was compiled by another version of Scripty (format {version}, compiler '
+                            f'{compiler_version}), compile it again.')
+    body = memoryview(data)[HEADER.size:]
+    if len(body) != body_size or zlib.crc32(body) != checksum:
+        raise BytecodeError(f'{path} is damaged (truncated or corrupt).')
+
+    try:
+        constants, offset = read_constants(data, HEADER.size, constant_count)
+        offset += -offset % 4
+        ops = memoryview(data)[offset:offset + count]
+        offset += count + (-count % 4)
+        args = tuple([constants[index] for index in u32_view(data, offset, count)])
+        offset += 4 * count
+        labels = {}
+        for i in range(label_count):
+            name, pc = LABEL.unpack_from(data, offset + i * LABEL.size)
+            labels.setdefault(pc, []).append(constants[name])
+        offset += label_count * LABEL.size
+        lines = u32_view(data, offset, count)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise BytecodeError(f'{path} is damaged: {e}.')
+    if count and max(ops) >= len(OPCODES):
+        raise BytecodeError(f'{path} is damaged: unknown opcode.')
+    return Code(ops, args, labels, lines)
@@ -0,0 +1,178 @@
+import os
+import sys
+import zlib
+import struct
+import hashlib
+import tempfile
+from array import array
+from compiler import COMPILER_VERSION
+from strings import StringTable
+from flatast import FlatAST
+from bytecode import ConstantPool, BytecodeError, read_constants, dump_bytecode, read_bytecode
+
+###############################################################################
+# On-disk cache of the front end and compiler output, similar to __pycache__
+#
+# The cache file of scripts/foo.scredu is scripts/__scrcache__/foo.scredu.cache
+# (or foo.scredu.cache in the directory given with --cache-dir). It starts with
+# a magic string and the key of the source it was built from: a hash of the
+# source bytes, the compiler version, the cache format, the optimization level
+# and whether the peephole optimizer ran. A file with another key, or one that
+# cannot be read, is a miss and gets rewritten.
+#
+# The rest is data only, so a cache file planted by someone else can at worst
+# give wrong results, never run code: a header (the number of constants, the
+# size of the front end and a CRC-32 of everything after the header), the
+# front end as a constant pool of bytecode.py (the strings of the StringTable,
+# the literals of the flat AST and the bytes of its arrays, in one tuple), and
+# the assembled code as a bytecode file.
+###############################################################################
+CACHE_DIR_NAME = '__scrcache__'
+CACHE_MAGIC = b'SCRIPTY-CACHE\n'
+CACHE_FORMAT = 2
+# Prefix of the temporary files store_cache writes before renaming them
+CACHE_TEMP_PREFIX = '.scrcache-'
+
+CACHE_HEADER = struct.Struct('<III')
+
+# The arrays of a FlatAST, in the order they are stored
+FLAT_ARRAYS = ('kinds', 'lines', 'ops', 'literals', 'sids', 'first', 'counts', 'children')
+
+
+def source_key(path, opt_level=0, peephole=True):
+    '''
+    Hash of the script's bytes, the compiler version, the cache format, the
+    optimization level and the peephole flag
+    '''
+    digest = hashlib.sha256(f'{COMPILER_VERSION}:{CACHE_FORMAT}:{opt_level}:{int(peephole)}:'.encode())
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest().encode()
+
+
+def cache_dir_for(path, cache_dir=None):
+    return cache_dir if cache_dir is not None else os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+
+
+def cache_path(path, cache_dir=None):
+    return os.path.join(cache_dir_for(path, cache_dir), os.path.basename(path) + '.cache')
+
+
+def little_endian(numbers):
+    if sys.byteorder != 'little':
+        numbers = array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers
+
+
+def dump_cache(strings, flat, code):
+    '''
+    The bytes of a cache file after the key line
+    '''
+    pool = ConstantPool()
+    pool.add((tuple(strings.strings), tuple(flat.values), flat.root,
+              tuple(little_endian(getattr(flat, name)).tobytes() for name in FLAT_ARRAYS)))
+    body = bytes(pool.data) + dump_bytecode(code)
+    return CACHE_HEADER.pack(pool.count, len(pool.data), zlib.crc32(body)) + body
+
+
+def read_cache(data, path):
+    '''
+    The (strings, flat AST, code) of the bytes of a cache file after the key
+    line. Raises BytecodeError (or a decoding error) if they are damaged.
+    '''
+    count, size, checksum = CACHE_HEADER.unpack_from(data, 0)
+    body = memoryview(data)[CACHE_HEADER.size:]
+    if zlib.crc32(body) != checksum:
+        raise BytecodeError(f'{path} is damaged.')
+    constants, end = read_constants(body[:size], 0, count)
+    if end != size:
+        raise BytecodeError(f'{path} is damaged.')
+    names, values, root, arrays = constants[-1]
+    if len(arrays) != len(FLAT_ARRAYS):
+        raise BytecodeError(f'{path} is damaged.')
+
+    strings = StringTable()
+    strings.strings = list(names)
+    strings.ids = {name: sid for sid, name in enumerate(names)}
+    flat = FlatAST()
+    for name, numbers in zip(FLAT_ARRAYS, arrays):
+        table = getattr(flat, name)
+        table.frombytes(numbers)
+        if sys.byteorder != 'little':
+            table.byteswap()
+    flat.values = list(values)
+    flat.value_index = {(type(value), value): index for index, value in enumerate(values)}
+    flat.root = root
+    return strings, flat, read_bytecode(body[size:], path)
+
+
+def load_cache(path, key, cache_dir=None):
+    '''
+    The (strings, flat AST, code) stored for the script, or None on a miss
+    '''
+    try:
+        with open(cache_path(path, cache_dir), 'rb') as file:
+            if file.readline() != CACHE_MAGIC or file.readline().rstrip(b'\n') != key:
+                return None
+            return read_cache(file.read(), path)
+    except Exception:
+        # Missing, truncated or corrupt file: rebuild it
+        return None
+
+
+def store_cache(path, key, strings, flat, code, cache_dir=None):
+    '''
+    Write the cache file of the script. A cache that cannot be written (for
+    example in a read-only directory) is silently skipped.
+    '''
+    directory = cache_dir_for(path, cache_dir)
+    try:
+        data = dump_cache(strings, flat, code)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename it, so readers never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=CACHE_TEMP_PREFIX, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(CACHE_MAGIC)
+                file.write(key + b'\n')
+                file.write(data)
+            os.replace(temp_path, cache_path(path, cache_dir))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except (OSError, BytecodeError):
+        pass
+
+
+def is_cache_file(path):
+    '''
+    Whether the file at path was written by store_cache: a cache file or one of
+    its temporary files, starting with the cache magic
+    '''
+    name = os.path.basename(path)
+    if not (name.endswith('.cache') or name.startswith(CACHE_TEMP_PREFIX) and name.endswith('.tmp')):
+        return False
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(CACHE_MAGIC)) == CACHE_MAGIC
+    except OSError:
+        return False
+
+
+def clear_cache(path, cache_dir=None):
+    '''
+    Remove the cache files in the cache directory of the script. Files written
+    by anyone else are left alone, and only the default __scrcache__ directory
+    is removed once nothing else is left in it.
+    '''
+    directory = cache_dir_for(path, cache_dir)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        file_path = os.path.join(directory, name)
+        if is_cache_file(file_path):
+            os.remove(file_path)
+    if cache_dir is None and not os.listdir(directory):
+        os.rmdir(directory)
@@ -0,0 +1,69 @@
+###############################################################################
+# Inline caches of function calls, for the AST back ends
+#
+# Each FuncCall gets a CallSite that keeps the function it called last, and
+# what that result depends on:
+#
+#   - epoch: the back end counts the declarations it runs of each function
+#     name, so a (re)definition makes the call sites of that name look their
+#     function up again. Sites calling other names keep their function.
+#   - env: the scope the call ran in, since the same name may mean another
+#     function from another scope. It is None for a call that the resolver
+#     found can only reach a function of the global scope: then the function
+#     is the same from everywhere.
+#
+# The arity check is part of the lookup, so a hit skips it too.
+###############################################################################
+ANY_ENV = None
+
+
+class CallSite:
+    '''
+    Monomorphic inline cache of one FuncCall
+    '''
+    __slots__ = ('name', 'line', 'candidates', 'is_global', 'declared', 'func', 'env', 'epoch', 'hits', 'misses')
+
+    def __init__(self, name, line, candidates=None, is_global=False, declared=None):
+        self.name = name
+        self.line = line
+        self.candidates = candidates  # how the Interpreter finds the function, see Resolver
+        self.is_global = is_global    # only a function of the global scope can be called
+        # [declarations of name run so far], the counter the back end shares
+        # between the declarations and the call sites of name
+        self.declared = declared if declared is not None else [0]
+        self.func = None
+        self.env = ANY_ENV
+        self.epoch = -1               # no count is negative: empty cache
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, func, env):
+        '''
+        Keep the function found from env, at the current count of declarations
+        '''
+        self.func = func
+        self.env = ANY_ENV if self.is_global else env
+        self.epoch = self.declared[0]
+        self.misses += 1
+
+
+def call_site_stats(sites):
+    '''
+    Lookups that hit and missed the inline cache, over all call sites and for
+    each one
+    '''
+    sites = sorted(sites, key=lambda site: site.line)
+    return {
+        'hits': sum(site.hits for site in sites),
+        'misses': sum(site.misses for site in sites),
+        'sites': [{'name': site.name, 'line': site.line, 'global': site.is_global,
+                   'hits': site.hits, 'misses': site.misses} for site in sites],
+    }
+
+
+def print_call_site_stats(sites):
+    stats = call_site_stats(sites)
+    print(f"{'function':>16} {'line':>6} {'global':>7} {'hits':>10} {'misses':>10}")
+    for site in stats['sites']:
+        print(f"{site['name']:>16} {site['line']:>6} {'yes' if site['global'] else 'no':>7} {site['hits']:>10} {site['misses']:>10}")
+    print(f"{'total':>16} {'':>6} {'':>7} {stats['hits']:>10} {stats['misses']:>10}")
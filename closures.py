@@ -0,0 +1,522 @@
+import codecs
+import operator
+from utils import *
+from model import *
+from tokens import *
+from state import *
+from definitions import *
+from interpreter import BARE_RETURN, TailCall, counted_range
+from memo import *
+from callsites import *
+from budget import *
+from resolver import Resolver
+
+###############################################################################
+# Closure-compiling back end
+#
+# The AST is turned once into a tree of Python closures, one per node, each
+# taking the environment. What a node does (which operator, which operand
+# types the fast path expects, whether an operand is a constant) is decided
+# while building, so running the program is just calling the root closure.
+#
+# Expressions return bare Python values (float for numbers, str for strings,
+# bool for booleans), so no (type, value) tuples are built. The runtime types
+# are only worked out for error messages and at the interpret() boundary.
+# The semantics, including the error messages, are the Interpreter's, and
+# statements return their completion the same way (see BARE_RETURN).
+###############################################################################
+
+arithmetic_ops = {
+    TOK_PLUS  : operator.add,
+    TOK_MINUS : operator.sub,
+    TOK_STAR  : operator.mul,
+    TOK_SLASH : operator.truediv,
+    TOK_MOD   : operator.mod,
+    TOK_CARET : operator.pow,
+}
+
+comparison_ops = {
+    TOK_GT    : operator.gt,
+    TOK_GE    : operator.ge,
+    TOK_LT    : operator.lt,
+    TOK_LE    : operator.le,
+    TOK_EQEQ  : operator.eq,
+    TOK_NE    : operator.ne,
+}
+
+
+def type_of(value):
+    if type(value) is bool:
+        return TYPE_BOOL
+    if type(value) is str:
+        return TYPE_STRING
+    return TYPE_NUMBER
+
+
+def binary_op(op, left, right, line):
+    '''
+    A binary operator on any operand types, with the type rules and the
+    errors of Interpreter.interpret. The closures only call it when their
+    number fast path does not apply.
+    '''
+    lefttype, righttype = type_of(left), type_of(right)
+    kind = op.token_type
+    if kind == TOK_PLUS:
+        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
+            return left + right
+        elif lefttype == TYPE_STRING or righttype == TYPE_STRING:
+            return stringify(left) + stringify(right)
+    elif kind == TOK_SLASH:
+        if right == 0:
+            runtime_error(f'Division by zero.', line)
+        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
+            return left / right
+    elif kind in arithmetic_ops:
+        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
+            return arithmetic_ops[kind](left, right)
+    elif kind in (TOK_EQEQ, TOK_NE):
+        if lefttype == righttype:
+            return comparison_ops[kind](left, right)
+    elif kind in comparison_ops:
+        if lefttype == righttype and lefttype != TYPE_BOOL:
+            return comparison_ops[kind](left, right)
+    runtime_error(f'Unsupported operator {op.lexeme!r} between {lefttype} and {righttype}.', op.line)
+
+
+def call(func, values):
+    '''
+    Run a function body, and then the functions it tail calls, in a loop
+    '''
+    cache = func[4]
+    if cache is not None and cache.enabled:
+        # Raw values, so the types go in the key too: 1.0 == True
+        key = (*map(type, values), *values)
+        result = cache.get(key)
+        if result is not MISSING:
+            return result
+    else:
+        cache = None
+    while True:
+        func_name, params, body, func_env, _ = func
+        new_env = Environment(func_env)
+        new_env.vars.update(zip(params, values))
+        completion = body(new_env)
+        if type(completion) is not TailCall:
+            break
+        func, values = completion.func, completion.args
+    if completion is None:
+        result = 0.0
+    elif completion is BARE_RETURN:
+        result = None
+    else:
+        result = completion
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+def unary_op(op, operand):
+    '''
+    A unary operator on any operand type, see binary_op()
+    '''
+    operandtype = type_of(operand)
+    if op.token_type == TOK_MINUS and operandtype == TYPE_NUMBER:
+        return -operand
+    elif op.token_type == TOK_PLUS and operandtype == TYPE_NUMBER:
+        return operand
+    elif op.token_type == TOK_NOT and operandtype == TYPE_BOOL:
+        return not operand
+    runtime_error(f'Unsupported operator {op.lexeme!r} with {operandtype}.', op.line)
+
+
+class ClosureCompiler:
+    def __init__(self):
+        self.builders = {}  # node class -> build method
+        self.memo = {}  # function name -> MemoCache, for the pure ones
+        self.global_calls = set()  # see Resolver
+        self.call_sites = []  # CallSite of each FuncCall built, see callsites.py
+        self.epochs = {}  # function name -> [declarations of it run so far], shared with its CallSites
+        self.budget = None  # see Interpreter.budget
+
+    def build(self, node):
+        builder = self.builders.get(type(node))
+        if builder is None:
+            # Look the class up by name along the MRO, so FlatAST views build like their model class
+            for cls in type(node).__mro__:
+                builder = getattr(self, 'build_' + cls.__name__, None)
+                if builder is not None:
+                    break
+            self.builders[type(node)] = builder
+        return builder(node)
+
+    def build_Integer(self, node):
+        value = float(node.value)
+        return lambda env: value
+
+    def build_Float(self, node):
+        value = float(node.value)
+        return lambda env: value
+
+    def build_String(self, node):
+        value = str(node.value)
+        return lambda env: value
+
+    def build_Bool(self, node):
+        value = node.value
+        return lambda env: value
+
+    def build_Grouping(self, node):
+        return self.build(node.value)
+
+    def build_Identifier(self, node):
+        name = node.name
+        line = node.line
+
+        def identifier(env):
+            # Environment.get_var, inlined
+            while env is not None:
+                value = env.vars.get(name)
+                if value is not None:
+                    return value
+                if name in env.vars:
+                    # Set to the result of a bare 'ret', like Interpreter's UNINITIALIZED
+                    runtime_error(f'Uninitialized variable {name!r}.', line)
+                env = env.parent
+            runtime_error(f'Undefined variable {name!r}.', line)
+        return identifier
+
+    def build_Assignment(self, node):
+        name = node.left.name
+        right = self.build(node.right)
+
+        def assignment(env):
+            value = right(env)
+            # Environment.set_var, inlined
+            scope = env
+            while scope is not None:
+                if name in scope.vars:
+                    scope.vars[name] = value
+                    return
+                scope = scope.parent
+            env.vars[name] = value
+        return assignment
+
+    def build_LocalAssignment(self, node):
+        name = node.left.name
+        right = self.build(node.right)
+
+        def local_assignment(env):
+            env.vars[name] = right(env)
+        return local_assignment
+
+    def build_BinOp(self, node):
+        op = node.op
+        line = node.line
+        left = self.build(node.left)
+        kind = op.token_type
+        fn = arithmetic_ops.get(kind) or comparison_ops[kind]
+        if isinstance(node.right, (Integer, Float)):
+            # Constant right operand: only the left one needs a type check
+            constant = float(node.right.value)
+            if kind == TOK_SLASH and constant == 0:
+                return lambda env: binary_op(op, left(env), constant, line)
+
+            def binop_constant(env):
+                value = left(env)
+                if type(value) is float:
+                    return fn(value, constant)
+                return binary_op(op, value, constant, line)
+            return binop_constant
+
+        right = self.build(node.right)
+        if kind == TOK_SLASH:
+            def divide(env):
+                leftval = left(env)
+                rightval = right(env)
+                if type(leftval) is float and type(rightval) is float and rightval:
+                    return leftval / rightval
+                return binary_op(op, leftval, rightval, line)
+            return divide
+
+        def binop(env):
+            leftval = left(env)
+            rightval = right(env)
+            if type(leftval) is float and type(rightval) is float:
+                return fn(leftval, rightval)
+            return binary_op(op, leftval, rightval, line)
+        return binop
+
+    def build_UnOp(self, node):
+        op = node.op
+        operand = self.build(node.operand)
+        if op.token_type == TOK_MINUS:
+            def negate(env):
+                value = operand(env)
+                if type(value) is float:
+                    return -value
+                return unary_op(op, value)
+            return negate
+        elif op.token_type == TOK_NOT:
+            def logical_not(env):
+                value = operand(env)
+                if type(value) is bool:
+                    return not value
+                return unary_op(op, value)
+            return logical_not
+        return lambda env: unary_op(op, operand(env))
+
+    def build_LogicalOp(self, node):
+        left = self.build(node.left)
+        right = self.build(node.right)
+        if node.op.token_type == TOK_OR:
+            def logical_or(env):
+                value = left(env)
+                if value:
+                    return value
+                return right(env)
+            return logical_or
+
+        def logical_and(env):
+            value = left(env)
+            if not value:
+                return value
+            return right(env)
+        return logical_and
+
+    def build_Stmts(self, node):
+        stmts = tuple(self.build(stmt) for stmt in node.stmts)
+        if len(stmts) == 1:
+            return stmts[0]
+
+        def block(env):
+            for stmt in stmts:
+                completion = stmt(env)
+                if completion is not None:
+                    return completion
+        return block
+
+    def build_PrintStmt(self, node):
+        value = self.build(node.value)
+        end = node.end
+
+        def print_stmt(env):
+            val = stringify(value(env))
+            print(codecs.escape_decode(bytes(str(val), 'utf-8'))[0].decode('utf-8'), end=end)
+        return print_stmt
+
+    def build_IfStmt(self, node):
+        test = self.build(node.test)
+        test_line = node.test.line
+        then_stmts = self.build(node.then_stmts)
+        else_stmts = self.build(node.else_stmts) if node.else_stmts else None
+
+        def if_stmt(env):
+            testval = test(env)
+            if type(testval) is not bool:
+                runtime_error(f'Expected boolean value, got {type_of(testval)}.', test_line)
+            if testval:
+                return then_stmts(Environment(env))
+            elif else_stmts is not None:
+                return else_stmts(Environment(env))
+        return if_stmt
+
+    def build_WhileStmt(self, node):
+        test = self.build(node.test)
+        test_line = node.test.line
+        body = self.build(node.body_stmts)
+
+        def while_stmt(env):
+            new_env = Environment(env)
+            budget = self.budget
+            while True:
+                if budget is not None:
+                    budget.tick()
+                testval = test(new_env)
+                if type(testval) is not bool:
+                    runtime_error(f'Expected boolean value, got {type_of(testval)}.', test_line)
+                if not testval:
+                    break
+                completion = body(new_env)
+                if completion is not None:
+                    return completion
+        return while_stmt
+
+    def build_ForStmt(self, node):
+        varname = node.ident.name
+        start = self.build(node.start)
+        end = self.build(node.end)
+        step = self.build(node.step) if node.step is not None else None
+        body = self.build(node.body_stmts)
+        # Unless the body makes its own local of it, the loop variable stays
+        # in the scope where the first iteration sets it
+        fixed_scope = not any(isinstance(stmt, LocalAssignment) and stmt.left.name == varname
+                              for stmt in node.body_stmts.stmts)
+
+        def for_stmt(env):
+            i = start(env)
+            endval = end(env)
+            block_env = Environment(env)
+            if step is None:
+                stepval = 1.0 if i < endval else -1.0
+            else:
+                stepval = step(env)
+            values = counted_range(i, endval, stepval) if fixed_scope else None
+            if values is not None:
+                # Environment.set_var, looked up once for the whole loop
+                scope = env
+                while scope and varname not in scope.vars:
+                    scope = scope.parent
+                variables = (scope or block_env).vars
+                if self.budget is not None:
+                    values = self.budget.metered(values)
+                for value in map(float, values):
+                    variables[varname] = value
+                    completion = body(block_env)
+                    if completion is not None:
+                        return completion
+                return None
+            if i < endval:
+                while i <= endval:
+                    if self.budget is not None:
+                        self.budget.tick()
+                    block_env.set_var(varname, i)
+                    completion = body(block_env)
+                    if completion is not None:
+                        return completion
+                    i += stepval
+            else:
+                while i >= endval:
+                    if self.budget is not None:
+                        self.budget.tick()
+                    block_env.set_var(varname, i)
+                    completion = body(block_env)
+                    if completion is not None:
+                        return completion
+                    i += stepval
+        return for_stmt
+
+    def build_FuncDecl(self, node):
+        name = node.name
+        params = tuple(param.name for param in node.params)
+        body = self.build(node.body_stmts)
+        cache = self.memo.get(name)
+        declared = self.epochs.setdefault(name, [0])
+
+        def func_decl(env):
+            # Like the Interpreter's (node, env), with the body already built
+            # and the cache of its results if it is pure
+            env.funcs[name] = (name, params, body, env, cache)
+            declared[0] += 1
+        return func_decl
+
+    def make_prepare_call(self, node):
+        '''
+        A closure that finds the function a FuncCall calls and evaluates its args
+        '''
+        name = node.name
+        line = node.line
+        args = tuple(self.build(arg) for arg in node.args)
+        nargs = len(args)
+
+        declared = self.epochs.setdefault(name, [0])
+        site = CallSite(name, line, is_global=node in self.global_calls, declared=declared)
+        self.call_sites.append(site)
+
+        def prepare_call(env):
+            if self.budget is not None:
+                self.budget.tick()
+            if site.epoch == declared[0] and (site.env is env or site.env is ANY_ENV):
+                site.hits += 1
+                return site.func, [arg(env) for arg in args]
+            # Environment.get_func, inlined
+            scope = env
+            while scope is not None:
+                func = scope.funcs.get(name)
+                if func is not None:
+                    break
+                scope = scope.parent
+            else:
+                runtime_error(f'Function {name} not declared.', line)
+            func_name, params, body, func_env, cache = func
+            if nargs != len(params):
+                runtime_error(f'Function {func_name} expects {len(params)} arguments, but got {nargs}.', line)
+            site.store(func, env)
+            return func, [arg(env) for arg in args]
+        return prepare_call
+
+    def build_FuncCall(self, node):
+        prepare_call = self.make_prepare_call(node)
+
+        line = node.line
+
+        def func_call(env):
+            try:
+                return call(*prepare_call(env))
+            except RecursionError:
+                raise StackOverflow(line)
+        return func_call
+
+    def build_FuncCallStmt(self, node):
+        call = self.build(node.expr)
+
+        def func_call_stmt(env):
+            # The value is dropped, it must not look like a completion
+            call(env)
+        return func_call_stmt
+
+    def build_RetStmt(self, node):
+        if node.value is None:
+            return lambda env: BARE_RETURN
+        if isinstance(node.value, FuncCall):
+            # Tail call, made by the caller's call loop, see Interpreter
+            prepare_call = self.make_prepare_call(node.value)
+            return lambda env: TailCall(*prepare_call(env))
+        # Values are never None, so the value itself is the completion
+        return self.build(node.value)
+
+
+class ClosureInterpreter:
+    '''
+    Drop-in replacement for Interpreter that runs the AST through closures
+    '''
+    def __init__(self, memoize=True):
+        self.compiler = ClosureCompiler()
+        self.memoize = memoize
+        self.memo = {}  # function name -> MemoCache, like Interpreter.memo
+        self.call_sites = self.compiler.call_sites  # like Interpreter.call_sites
+
+    def interpret(self, node, env):
+        value = self.compiler.build(node)(env)
+        if isinstance(node, Expr):
+            return (type_of(value), value)
+
+    @deep
+    def interpret_ast(self, node, budget=None):
+        '''
+        Run a whole program, like Interpreter.interpret_ast()
+        '''
+        # Entrypoint with global environment
+        if self.memoize:
+            self.memo = self.compiler.memo = memo_caches(pure_functions(node))
+        resolver = Resolver()
+        resolver.resolve_ast(node)
+        self.compiler.global_calls = resolver.global_calls
+        self.call_sites.clear()
+        self.compiler.budget = budget
+        if budget is not None:
+            budget.start()
+        try:
+            self.run(node)
+        except OutOfBudget as e:
+            return budget.result(e.status)
+        except StackOverflow as e:
+            runtime_error('Stack overflow, too many nested function calls.', e.line)
+        if budget is None:
+            return RunResult(RUN_DONE)
+        return budget.result(RUN_DONE)
+
+    def run(self, node):
+        env = Environment()
+        completion = self.compiler.build(node)(env)
+        if type(completion) is TailCall:
+            call(completion.func, completion.args)
@@ -2,27 +2,55 @@ from definitions import *
 from model import *
 from tokens import *
 from utils import *
+from memo import pure_functions
+
+# Bump whenever the generated code changes, so cached code (cache.py) is rebuilt
+COMPILER_VERSION = 6
 
 SYM_VAR = 'SYM_VAR'
 SYM_FUNC = 'SYM_FUNC'
 
 
+def string_key(sid, text):
+    '''
+    The key of a name or string literal in the compiler's tables: its
+    StringTable id, or the text itself for nodes built without the parser,
+    which have no id
+    '''
+    return text if sid is None else sid
+
+
 class Symbol:
-    def __init__(self, name, symtype=SYM_VAR, depth=0, arity=0):
+    def __init__(self, name, symtype=SYM_VAR, depth=0, arity=0, sid=None):
         self.name = name
         self.depth = depth
         self.symtype = symtype
         self.arity = arity
+        self.sid = sid  # id of name in the parser's StringTable, used to compare names
+        self.key = string_key(sid, name)
 
 
 class Compiler:
     def __init__(self):
         self.code = []
+        self.lines = []  # source line of each instruction of code, for the assembler's debug table
+        self.line = 0    # line of the statement being compiled
         self.locals = []
         self.globals = []
         self.functions = []
+        # Name lookups go through dicts keyed by string_key(). A name can be
+        # a local of several open blocks, so local_slots keeps the slots of
+        # each name, innermost last, and end_block() pops them with the locals.
+        self.local_slots = {}     # key -> slots in self.locals
+        self.global_slots = {}    # key -> slot in self.globals
+        self.function_symbols = {}  # key -> Symbol of the latest declaration
         self.scope_depth = 0
+        self.function_depth = 0  # number of function bodies being compiled
+        self.pure = set()  # names of the functions whose results the VM may keep (memo.py)
         self.label_counter = 0
+        # Constant pool of string values by string_key(), so every PUSH of the
+        # same literal shares one value (and the string object from the AST)
+        self.constants = {}
 
     def make_label(self):
         self.label_counter += 1
@@ -30,35 +58,53 @@ class Compiler:
 
     def emit(self, instruction):
         self.code.append(instruction)
-
-    def get_func_symbol(self, name):
-        # Loop the function list trying to find the first occurrence of that symbol name
-        for symbol in reversed(self.functions):
-            if symbol.name == name:
-                return symbol
-
-    def get_var_symbol(self, name):
-        # Loop the locals list in reversed order, trying to find the first occurrence of that symbol name
-        for index, symbol in reversed(list(enumerate(self.locals))):
-            if symbol.name == name:
-                return (symbol, index)
-        # Loop the globals list in reversed order, trying to find the first occurrence of that symbol name
-        for index, symbol in reversed(list(enumerate(self.globals))):
-            if symbol.name == name:
-                return (symbol, index)
+        self.lines.append(self.line)
+
+    def get_func_symbol(self, key):
+        return self.function_symbols.get(key)
+
+    def get_var_symbol(self, key):
+        # The innermost local with that name, or else the global
+        slots = self.local_slots.get(key)
+        if slots:
+            return (self.locals[slots[-1]], slots[-1])
+        slot = self.global_slots.get(key)
+        if slot is not None:
+            return (self.globals[slot], slot)
         return None
 
+    def add_local(self, symbol):
+        '''
+        Declare a local in the current block, returning its slot
+        '''
+        slot = len(self.locals)
+        self.locals.append(symbol)
+        self.local_slots.setdefault(symbol.key, []).append(slot)
+        return slot
+
+    def add_global(self, symbol):
+        slot = len(self.globals)
+        self.globals.append(symbol)
+        self.global_slots[symbol.key] = slot
+        return slot
+
+    def add_function(self, symbol):
+        self.functions.append(symbol)
+        self.function_symbols[symbol.key] = symbol
+
     def begin_block(self):
         self.scope_depth += 1
 
     def end_block(self):
         self.scope_depth -= 1
         # Loop and remove all the locals that are "deeper" than the current scope depth
-        i = len(self.locals) - 1
-        while len(self.locals) > 0 and self.locals[i].depth > self.scope_depth:
+        while len(self.locals) > 0 and self.locals[-1].depth > self.scope_depth:
             self.emit(('POP',))
-            self.locals.pop()
-            i -= 1
+            symbol = self.locals.pop()
+            slots = self.local_slots[symbol.key]
+            slots.pop()
+            if not slots:
+                del self.local_slots[symbol.key]
 
     def compile(self, node):
         if isinstance(node, Integer):
@@ -74,7 +120,10 @@ class Compiler:
             self.emit(('PUSH', value))
 
         elif isinstance(node, String):
-            value = (TYPE_STRING, stringify(node.value))
+            key = string_key(node.sid, node.value)
+            value = self.constants.get(key)
+            if value is None:
+                value = self.constants[key] = (TYPE_STRING, stringify(node.value))
             self.emit(('PUSH', value))
 
         elif isinstance(node, BinOp):
@@ -165,22 +214,61 @@ class Compiler:
             self.emit(('JMP', test_label))
             self.emit(('LABEL', exit_label))
 
+        elif isinstance(node, ForStmt):
+            # The bounds and the step are evaluated once, before the loop
+            self.compile(node.start)
+            self.compile(node.end)
+            if node.step is not None:
+                self.compile(node.step)
+            body_label = self.make_label()
+            exit_label = self.make_label()
+            self.begin_block()
+            # FOR_PREP leaves the loop's state on the stack, as a hidden local
+            state_slot = self.add_local(Symbol('(for)', symtype=SYM_VAR, depth=self.scope_depth))
+            # The loop variable is updated where it is set, or else made a local of the loop
+            symbol = self.get_var_symbol(string_key(node.ident.sid, node.ident.name))
+            if symbol is None:
+                new_symbol = Symbol(node.ident.name, symtype=SYM_VAR, depth=self.scope_depth, sid=node.ident.sid)
+                var_slot, var_global, new_var = self.add_local(new_symbol), False, True
+            else:
+                sym, var_slot = symbol
+                var_global, new_var = sym.depth == 0, False
+            self.emit(('FOR_PREP', node.step is not None, new_var, var_slot, var_global, exit_label))
+            self.emit(('LABEL', body_label))
+            self.begin_block()
+            self.compile(node.body_stmts)
+            self.end_block()
+            self.emit(('FOR_LOOP', state_slot, var_slot, var_global, body_label))
+            self.emit(('LABEL', exit_label))
+            self.end_block()
+
         elif isinstance(node, Stmts):
+            # Instructions after the block, like the jump back of a loop, belong
+            # to the statement around it
+            line = self.line
             for stmt in node.stmts:
+                # Compound statements are on the line of their end, so they
+                # take the line of their header instead
+                if isinstance(stmt, (IfStmt, WhileStmt)):
+                    self.line = stmt.test.line
+                elif isinstance(stmt, ForStmt):
+                    self.line = stmt.start.line
+                else:
+                    self.line = getattr(stmt, 'line', line)
                 self.compile(stmt)
+            self.line = line
 
         elif isinstance(node, Assignment):
             self.compile(node.right)
-            symbol = self.get_var_symbol(node.left.name)
+            symbol = self.get_var_symbol(string_key(node.left.sid, node.left.name))
             if not symbol:
-                new_symbol = Symbol(node.left.name, symtype=SYM_VAR, depth=self.scope_depth)
+                new_symbol = Symbol(node.left.name, symtype=SYM_VAR, depth=self.scope_depth, sid=node.left.sid)
                 if self.scope_depth == 0:
-                    self.globals.append(new_symbol)
-                    new_global_slot = len(self.globals) - 1
+                    new_global_slot = self.add_global(new_symbol)
                     self.emit(('STORE_GLOBAL', new_global_slot))
                 else:
-                    self.locals.append(new_symbol)
-                    self.emit(('SET_SLOT', str(len(self.locals) - 1) + f" ({new_symbol.name})"))
+                    new_local_slot = self.add_local(new_symbol)
+                    self.emit(('SET_SLOT', str(new_local_slot) + f" ({new_symbol.name})"))
             else:
                 sym, slot = symbol
                 if sym.depth == 0:
@@ -190,12 +278,12 @@ class Compiler:
 
         elif isinstance(node, LocalAssignment):
             self.compile(node.right)
-            new_symbol = Symbol(node.left.name, symtype=SYM_VAR, depth=self.scope_depth)
-            self.locals.append(new_symbol)
-            self.emit(('SET_SLOT', str(len(self.locals) - 1) + " (" + str(new_symbol.name) + ")"))
+            new_symbol = Symbol(node.left.name, symtype=SYM_VAR, depth=self.scope_depth, sid=node.left.sid)
+            new_local_slot = self.add_local(new_symbol)
+            self.emit(('SET_SLOT', str(new_local_slot) + " (" + str(new_symbol.name) + ")"))
 
         elif isinstance(node, Identifier):
-            symbol = self.get_var_symbol(node.name)
+            symbol = self.get_var_symbol(string_key(node.sid, node.name))
             if not symbol:
                 compile_error(f'Variable {node.name} is not defined.', node.line)
             else:
@@ -206,71 +294,88 @@ class Compiler:
                     self.emit(('LOAD_LOCAL', slot))
 
         elif isinstance(node, FuncDecl):
-            var = self.get_var_symbol(node.name)
-            func = self.get_func_symbol(node.name)
+            var = self.get_var_symbol(string_key(node.sid, node.name))
+            func = self.get_func_symbol(string_key(node.sid, node.name))
             if func:
                 compile_error(f'A function with the name {node.name} was already declared.', node.line)
             if var:
                 compile_error(f'A variable with the name {node.name} was already defined in this scope.', node.line)
-            new_func = Symbol(node.name, symtype=SYM_FUNC, depth=self.scope_depth, arity=len(node.params))
-            self.functions.append(new_func)
+            new_func = Symbol(node.name, symtype=SYM_FUNC, depth=self.scope_depth, arity=len(node.params), sid=node.sid)
+            self.add_function(new_func)
 
             end_label = self.make_label()
             self.emit(('JMP', end_label))
             self.emit(('LABEL', new_func.name))
             self.begin_block()
+            self.function_depth += 1
             # Set params as local variables
             for param in node.params:
-                new_symbol = Symbol(name=param.name, symtype=SYM_VAR, depth=self.scope_depth)
-                self.locals.append(new_symbol)
-                self.emit(('SET_SLOT', str(len(self.locals) - 1) + " (" + str(new_symbol.name) + ")"))
+                new_symbol = Symbol(name=param.name, symtype=SYM_VAR, depth=self.scope_depth, sid=param.sid)
+                new_local_slot = self.add_local(new_symbol)
+                self.emit(('SET_SLOT', str(new_local_slot) + " (" + str(new_symbol.name) + ")"))
             self.compile(node.body_stmts)
+            self.function_depth -= 1
             self.end_block()
             self.emit(('PUSH', (TYPE_NUMBER, 0)))
             self.emit(('RTS',))
             self.emit(('LABEL', end_label))
 
         elif isinstance(node, FuncCall):
-            func = self.get_func_symbol(node.name)
-            if not func:
-                compile_error(f'Not found declaration for function {node.name}', node.line)
-            if func.arity != len(node.args):
-                compile_error(f'Function expected {func.arity} params but {len(node.args)} args were passed', node.line)
-            # Evaluate all args
-            for arg in node.args:
-                self.compile(arg)
-            numargs = (TYPE_NUMBER, len(node.args))
-            self.emit(('PUSH', numargs))
-            self.emit(('JSR', node.name))
+            self.compile_call(node, 'MEMO_JSR' if node.name in self.pure else 'JSR')
 
         elif isinstance(node, RetStmt):
-            self.compile(node.value)
-            self.emit(('RTS',))
+            if isinstance(node.value, FuncCall) and self.function_depth > 0:
+                # Tail call: the callee takes over this frame and its RTS returns to our caller
+                self.compile_call(node.value, 'TAIL_JSR')
+            else:
+                self.compile(node.value)
+                self.emit(('RTS',))
 
         elif isinstance(node, FuncCallStmt):
+            self.line = node.expr.line  # the statement itself has no line
             self.compile(node.expr)
             self.emit(('POP',)) # Pop unused return value since it is a statement not an expression
 
+    def compile_call(self, node, opcode):
+        func = self.get_func_symbol(string_key(node.sid, node.name))
+        if not func:
+            compile_error(f'Not found declaration for function {node.name}', node.line)
+        if func.arity != len(node.args):
+            compile_error(f'Function expected {func.arity} params but {len(node.args)} args were passed', node.line)
+        # Evaluate all args
+        for arg in node.args:
+            self.compile(arg)
+        numargs = (TYPE_NUMBER, len(node.args))
+        self.emit(('PUSH', numargs))
+        self.emit((opcode, node.name))
+
     def print_code(self):
-        i = 0
-        for instruction in self.code:
-            if instruction[0] == 'LABEL':
-                print(f"{i:08} {Colors.RED}{instruction[1]}:{Colors.WHITE}")
-                i += 1
-                continue
-            if instruction[0] == 'PUSH':
-                print(
-                    f"{i:08}     {Colors.GREEN}{instruction[0]} {Colors.CYAN}{stringify(instruction[1][1])}{Colors.WHITE}")
-                i += 1
-                continue
-            if len(instruction) == 1:
-                print(f"{i:08}     {Colors.BLUE}{instruction[0]}{Colors.WHITE}")
-            elif len(instruction) == 2:
-                print(f"{i:08}     {Colors.GREEN}{instruction[0]} {Colors.CYAN}{instruction[1]}{Colors.WHITE}")
-            i += 1
+        print_code(self.code)
 
+    @deep
     def generate_code(self, node):
+        self.pure = pure_functions(node)
         self.emit(('LABEL', 'START'))
         self.compile(node)
         self.emit(('HALT',))
         return self.code
+
+
+def print_code(code):
+    i = 0
+    for instruction in code:
+        if instruction[0] == 'LABEL':
+            print(f"{i:08} {Colors.RED}{instruction[1]}:{Colors.WHITE}")
+            i += 1
+            continue
+        if instruction[0] == 'PUSH':
+            print(
+                f"{i:08}     {Colors.GREEN}{instruction[0]} {Colors.CYAN}{stringify(instruction[1][1])}{Colors.WHITE}")
+            i += 1
+            continue
+        if len(instruction) == 1:
+            print(f"{i:08}     {Colors.BLUE}{instruction[0]}{Colors.WHITE}")
+        else:
+            args = ' '.join(str(arg) for arg in instruction[1:])
+            print(f"{i:08}     {Colors.GREEN}{instruction[0]} {Colors.CYAN}{args}{Colors.WHITE}")
+        i += 1
@@ -0,0 +1,288 @@
+from array import array
+from utils import *
+from tokens import *
+from lexer import *
+from parser import *
+from model import *
+
+###############################################################################
+# Flat AST
+#
+# The whole tree lives in one node table made of parallel arrays, indexed by
+# node number: the node kind, its line, its operator token type, where its
+# literal is in the side table of literals and names, its StringTable id, and
+# the slice of the children array that holds the numbers of its children.
+# Nodes are numbered in post-order, so children always come before their
+# parent and the root is the last node.
+#
+# FlatAST.node(i) returns a view of node i that is an instance of the matching
+# model class, so the Interpreter and the Compiler walk a flat tree exactly as
+# they walk an object tree.
+###############################################################################
+
+NO_NODE = 0xFFFFFFFF  # missing optional child (else branch, for step, ret value)
+NO_OP = 0xFF
+NO_VALUE = -1
+
+# Node class -> (attribute stored in the literal table, attributes holding the
+# children). Only the last child attribute may be a list of nodes.
+node_layouts = {
+    Integer:         ('value', ()),
+    Float:           ('value', ()),
+    Bool:            ('value', ()),
+    String:          ('value', ()),
+    Identifier:      ('name', ()),
+    Param:           ('name', ()),
+    UnOp:            (None, ('operand',)),
+    BinOp:           (None, ('left', 'right')),
+    LogicalOp:       (None, ('left', 'right')),
+    Grouping:        (None, ('value',)),
+    Stmts:           (None, ('stmts',)),
+    PrintStmt:       ('end', ('value',)),
+    IfStmt:          (None, ('test', 'then_stmts', 'else_stmts')),
+    WhileStmt:       (None, ('test', 'body_stmts')),
+    ForStmt:         (None, ('ident', 'start', 'end', 'step', 'body_stmts')),
+    Assignment:      (None, ('left', 'right')),
+    LocalAssignment: (None, ('left', 'right')),
+    FuncDecl:        ('name', ('body_stmts', 'params')),
+    FuncCall:        ('name', ('args',)),
+    FuncCallStmt:    (None, ('expr',)),
+    RetStmt:         (None, ('value',)),
+}
+list_fields = {'stmts', 'params', 'args'}
+
+node_classes = list(node_layouts)  # kind -> node class
+node_kinds = {cls: kind for kind, cls in enumerate(node_classes)}
+
+# Operator token type -> lexeme, to rebuild the op tokens of UnOp/BinOp/LogicalOp
+op_lexemes = {token_type: lexeme for lexeme, token_type in {**operators, **keywords}.items()}
+
+
+def child_nodes(node):
+    '''
+    The children of an object node in flat layout order, None for a missing one
+    '''
+    children = []
+    for field in node_layouts[type(node)][1]:
+        value = getattr(node, field)
+        if field in list_fields:
+            children.extend(value)
+        else:
+            children.append(value)
+    return children
+
+
+class FlatAST:
+    def __init__(self):
+        self.kinds = array('B')
+        self.lines = array('I')
+        self.ops = array('B')
+        self.literals = array('i')  # index in values, or NO_VALUE
+        self.sids = array('i')      # StringTable id, or NO_VALUE
+        self.first = array('I')     # start of the node's children in children
+        self.counts = array('I')    # number of children
+        self.children = array('I')
+        self.values = []            # literals and names
+        self.value_index = {}       # (type, value) -> index in values
+        self.root = NO_NODE
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def add_value(self, value):
+        # Equal literals share one entry (the type is part of the key so 1, 1.0 and true stay apart)
+        key = (type(value), value)
+        index = self.value_index.get(key)
+        if index is None:
+            index = self.value_index[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def add_node(self, node, children):
+        cls = type(node)
+        literal = node_layouts[cls][0]
+        index = len(self.kinds)
+        self.kinds.append(node_kinds[cls])
+        # FuncCallStmt has no line of its own, it is on the line of its call
+        self.lines.append(node.line if cls is not FuncCallStmt else node.expr.line)
+        self.ops.append(node.op.token_type if cls in (UnOp, BinOp, LogicalOp) else NO_OP)
+        self.literals.append(NO_VALUE if literal is None else self.add_value(getattr(node, literal)))
+        sid = getattr(node, 'sid', None)
+        self.sids.append(NO_VALUE if sid is None else sid)
+        self.first.append(len(self.children))
+        self.counts.append(len(children))
+        self.children.extend(children)
+        return index
+
+    def add_tree(self, root):
+        '''
+        Append an object tree to the table, returning the number of its root
+        '''
+        stack = [(root, False)]
+        done = []  # numbers of the finished nodes, waiting for their parent
+        while stack:
+            node, expanded = stack.pop()
+            if node is None:
+                done.append(NO_NODE)
+            elif expanded:
+                count = len(child_nodes(node))
+                children = done[len(done) - count:]
+                del done[len(done) - count:]
+                done.append(self.add_node(node, children))
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(child_nodes(node)))
+        return done[0]
+
+    def child(self, index, position):
+        return self.children[self.first[index] + position]
+
+    def child_list(self, index):
+        first = self.first[index]
+        return self.children[first:first + self.counts[index]]
+
+    def walk(self, index=None):
+        '''
+        Yield the numbers of the nodes below index (default the root), parents
+        before their children
+        '''
+        stack = [self.root if index is None else index]
+        while stack:
+            index = stack.pop()
+            yield index
+            first = self.first[index]
+            stack.extend(child for child in reversed(self.children[first:first + self.counts[index]])
+                         if child != NO_NODE)
+
+    def node(self, index=None):
+        '''
+        A view of node index (default the root) that reads its fields from the table
+        '''
+        if index is None:
+            index = self.root
+        if index == NO_NODE:
+            return None
+        return view_classes[self.kinds[index]](self, index)
+
+    def to_tree(self, index=None):
+        '''
+        Convert the subtree at index (default the root) back to model objects
+        '''
+        numbers = sorted(self.walk(index))  # post-order: children before parents
+        nodes = {NO_NODE: None}
+        for number in numbers:
+            cls = node_classes[self.kinds[number]]
+            literal, fields = node_layouts[cls]
+            node = cls.__new__(cls)
+            line = self.lines[number]
+            if 'line' in cls.__slots__:
+                node.line = line
+            if 'sid' in cls.__slots__:
+                sid = self.sids[number]
+                node.sid = None if sid == NO_VALUE else sid
+            if literal is not None:
+                setattr(node, literal, self.values[self.literals[number]])
+            if cls in (UnOp, BinOp, LogicalOp):
+                op = self.ops[number]
+                node.op = Token(op, op_lexemes[op], line)
+            children = [nodes[child] for child in self.child_list(number)]
+            for position, field in enumerate(fields):
+                if field in list_fields:
+                    setattr(node, field, children[position:])
+                else:
+                    setattr(node, field, children[position])
+            nodes[number] = node
+        return nodes[numbers[-1]]
+
+
+def flatten(root):
+    '''
+    Convert an object tree to a FlatAST
+    '''
+    flat = FlatAST()
+    flat.root = flat.add_tree(root)
+    return flat
+
+
+@deep
+def parse_flat(parser):
+    '''
+    Parse a whole program straight into a FlatAST. Each top-level statement is
+    added to the table as soon as it is parsed, so only one statement is ever
+    held as objects.
+    '''
+    flat = FlatAST()
+    stmts = array('I')
+    line = 0
+    for stmt in parser.iter_stmts():
+        stmts.append(flat.add_tree(stmt))
+    if stmts:
+        line = parser.previous_token().line
+    # Stmts(...) is only used for its class and line, its children are already numbered
+    flat.root = flat.add_node(Stmts([], line), stmts)
+    return flat
+
+
+###############################################################################
+# Views: one subclass per model class whose fields are properties reading the
+# FlatAST, so isinstance() checks and attribute access work as for objects
+###############################################################################
+
+def literal_property(literal):
+    return property(lambda self: self.ast.values[self.ast.literals[self.index]])
+
+
+def child_property(position):
+    return property(lambda self: self.ast.node(self.ast.child(self.index, position)))
+
+
+def list_property(position):
+    return property(lambda self: [self.ast.node(child) for child in self.ast.child_list(self.index)[position:]])
+
+
+def sid_property(self):
+    sid = self.ast.sids[self.index]
+    return None if sid == NO_VALUE else sid
+
+
+def op_property(self):
+    op = self.ast.ops[self.index]
+    return Token(op, op_lexemes[op], self.ast.lines[self.index])
+
+
+def make_view_class(cls):
+    literal, fields = node_layouts[cls]
+    namespace = {
+        '__slots__': ('ast', 'index'),
+        '__init__': view_init,
+        '__eq__': view_eq,
+        '__hash__': view_hash,
+        'line': property(lambda self: self.ast.lines[self.index]),
+    }
+    if literal is not None:
+        namespace[literal] = literal_property(literal)
+    if 'sid' in cls.__slots__:
+        namespace['sid'] = property(sid_property)
+    if cls in (UnOp, BinOp, LogicalOp):
+        namespace['op'] = property(op_property)
+    for position, field in enumerate(fields):
+        namespace[field] = list_property(position) if field in list_fields else child_property(position)
+    return type('Flat' + cls.__name__, (cls,), namespace)
+
+
+def view_init(self, ast, index):
+    self.ast = ast
+    self.index = index
+
+
+# Every field access makes a new view, so views of the same node compare and
+# hash equal. This lets them key side tables like the resolver's (resolver.py).
+def view_eq(self, other):
+    return type(other) is type(self) and other.ast is self.ast and other.index == self.index
+
+
+def view_hash(self):
+    return hash((id(self.ast), self.index))
+
+
+view_classes = [make_view_class(cls) for cls in node_classes]
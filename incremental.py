@@ -0,0 +1,293 @@
+from bisect import bisect_right
+from tokens import *
+from lexer import *
+from parser import *
+from model import *
+from strings import *
+
+###############################################################################
+# Incremental front end
+#
+# The source is cut into one segment per top-level statement. A segment runs
+# from the end of the previous statement's last token to the end of its own
+# last token, so it starts where the lexer is between tokens. For each segment
+# we keep its start offset, the lexer line there, its tokens and where they
+# end. After an edit only the segments around the damaged text are re-lexed,
+# until the lexer lands on an old segment start again, and only their
+# statements are re-parsed, until the parser lands on an old statement start.
+# Everything after that is reused.
+#
+# The tokens and nodes are the plain ones a full parse makes, with their
+# absolute line. For each segment we also keep a flat list of its tokens and
+# of the nodes of its statement, so that an edit that adds or removes lines
+# rebases the reused segments after it with one integer add per token and
+# node, without walking the tree. An edit that keeps the number of lines, the
+# common case, touches nothing outside the damaged segments.
+###############################################################################
+
+class SpanLexer(Lexer):
+    '''
+    A lexer that also records where every token ends in the source, and
+    interns identifiers in the given StringTable
+    '''
+    def __init__(self, source, start, line, strings):
+        super().__init__(source)
+        self.curr = start
+        self.line = line
+        self.strings = strings
+        self.ends = []
+
+    def add_span(self, token_type, start, end, line):
+        lexeme = self.source[start:end]
+        if token_type == TOK_IDENTIFIER:
+            lexeme = self.strings[self.strings.intern(lexeme)]
+        self.tokens.append(Token(token_type, lexeme, line))
+        self.ends.append(end)
+
+
+def shift_lines(node, delta):
+    '''
+    Add delta to the line of node and of every node below it (tokens are not
+    touched, they are shifted with the token lists that own them)
+    '''
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if hasattr(node, 'line'):
+            node.line += delta
+        stack.extend(iter_child_nodes(node))
+
+
+def line_items(stmt, tokens):
+    '''
+    The tokens of a segment and every token and node of its statement that has
+    a line, each once
+    '''
+    items = list(tokens)
+    seen = set(map(id, items))
+    stack = [stmt]
+    while stack:
+        node = stack.pop()
+        if 'line' in node.__slots__ and id(node) not in seen:
+            seen.add(id(node))
+            items.append(node)
+        for field in node.__slots__:
+            value = getattr(node, field)
+            if type(value) is Token and id(value) not in seen:
+                seen.add(id(value))
+                items.append(value)
+        stack.extend(iter_child_nodes(node))
+    return items
+
+
+def shift_items(items, delta):
+    '''
+    Add delta to the line of every token and node of a segment
+    '''
+    for item in items:
+        item.line += delta
+
+
+def common_affixes(old, new):
+    '''
+    Length of the common prefix and of the common suffix (not overlapping the
+    prefix) of two strings, comparing in blocks so the work is done in C
+    '''
+    size = min(len(old), len(new))
+    prefix = 0
+    block = 4096
+    while prefix < size:
+        step = min(block, size - prefix)
+        if old[prefix:prefix + step] == new[prefix:prefix + step]:
+            prefix += step
+        elif step == 1:
+            break
+        else:
+            block = max(1, step // 2)
+    suffix = 0
+    block = 4096
+    limit = size - prefix
+    while suffix < limit:
+        step = min(block, limit - suffix)
+        if old[len(old) - suffix - step:len(old) - suffix] == new[len(new) - suffix - step:len(new) - suffix]:
+            suffix += step
+        elif step == 1:
+            break
+        else:
+            block = max(1, step // 2)
+    return prefix, suffix
+
+
+class IncrementalParser:
+    '''
+    Keeps the tokens and AST of the last parse and updates them after an edit
+    '''
+    def __init__(self):
+        self.source = None
+        self.ast = None
+        self.strings = StringTable()  # shared by every parse, so ids stay stable across updates
+
+    @deep
+    def parse(self, source):
+        '''
+        Full parse, remembering the segments for later updates
+        '''
+        lexer = SpanLexer(source, 0, 1, self.strings)
+        lexer.tokenize_regex()
+        parser = Parser(lexer.tokens, self.strings)
+        self.source = source
+        self.bounds = [0]     # start offset of every segment, plus where the last one ends
+        self.lines = [1]      # lexer line at each of those offsets
+        self.seg_tokens = []  # tokens of every segment
+        self.seg_items = []   # line_items() of every segment
+        self.seg_ends = []    # end offset of each of those tokens, relative to the segment start
+        stmts = []
+        first = 0
+        for stmt in parser.iter_stmts():
+            self.add_segment(lexer.tokens, lexer.ends, first, parser.curr)
+            first = parser.curr
+            stmts.append(stmt)
+        # A stray 'end' or 'else' stops the program early, there is nothing to update incrementally
+        self.truncated = not parser.at_end()
+        self.ast = Stmts(stmts, line=parser.previous_token().line)
+        self.seg_items = [line_items(stmt, tokens) for stmt, tokens in zip(stmts, self.seg_tokens)]
+        return self.ast
+
+    def add_segment(self, tokens, ends, first, last):
+        # tokens[first:last] are the tokens of the next top-level statement
+        start = self.bounds[-1]
+        self.seg_tokens.append(tokens[first:last])
+        self.seg_ends.append([end - start for end in ends[first:last]])
+        self.bounds.append(ends[last - 1])
+        self.lines.append(tokens[last - 1].line)
+
+    @deep
+    def update(self, source):
+        '''
+        Re-parse after the source changed to source
+        '''
+        if self.ast is None or self.truncated:
+            return self.parse(source)
+        prefix, suffix = common_affixes(self.source, source)
+        return self.reparse(source, prefix, len(self.source) - suffix, len(source) - suffix)
+
+    @deep
+    def edit(self, start, end, text):
+        '''
+        Replace source[start:end] with text and re-parse
+        '''
+        source = self.source[:start] + text + self.source[end:]
+        if self.ast is None or self.truncated:
+            return self.parse(source)
+        return self.reparse(source, start, end, start + len(text))
+
+    def reparse(self, source, start, old_end, new_end):
+        # The old text source[start:old_end] was replaced by source[start:new_end]
+        bounds = self.bounds
+        count = len(self.seg_tokens)
+        delta = new_end - old_end
+        if count == 0:
+            return self.parse(source)
+
+        # First damaged segment: the one holding the character before the edit,
+        # since an edit right after a token can extend it
+        first = max(0, bisect_right(bounds, start - 1) - 1) if start > 0 else 0
+        first = min(first, count)
+        # The parser peeks one token past a statement, so if the first token of
+        # this segment may have changed, the previous statement is damaged too
+        if first > 0 and (first == count or start <= bounds[first] + self.seg_ends[first][0]):
+            first -= 1
+
+        # Re-lex from the start of the first damaged segment until the lexer
+        # stops exactly on an old segment start past the damage
+        lexer = SpanLexer(source, bounds[first], self.lines[first], self.strings)
+        resync = bisect_right(bounds, old_end - 1) if old_end > 0 else 0
+        resync = max(resync, first + 1)
+        while resync <= count:
+            lexer.tokenize_regex(stop=bounds[resync] + delta)
+            if lexer.curr == bounds[resync] + delta:
+                break
+            resync += 1
+        else:
+            lexer.tokenize_regex()
+
+        # Reused segments move by delta characters and their lines by line_delta
+        if resync <= count:
+            line_delta = lexer.line - self.lines[resync]
+            for index in range(resync, count + 1):
+                bounds[index] += delta
+                self.lines[index] += line_delta
+            if line_delta:
+                for index in range(resync, count):
+                    shift_items(self.seg_items[index], line_delta)
+
+        # Parse statements from the new tokens followed by the old segments,
+        # until the parser stops right before an old segment
+        tokens = lexer.tokens
+        ends = lexer.ends
+
+        def token_stream():
+            index = 0
+            while True:
+                while index < len(tokens):
+                    yield tokens[index]
+                    index += 1
+                segment = resync + pulled[0]
+                if segment >= count:
+                    return
+                # Copies, the old segment keeps its tokens
+                tokens.extend(Token(token.token_type, token.lexeme, token.line) for token in self.seg_tokens[segment])
+                ends.extend(bounds[segment] + end for end in self.seg_ends[segment])
+                pulled[0] += 1
+
+        pulled = [0]
+        parser = Parser(token_stream(), self.strings)
+        boundary_index = len(lexer.tokens)  # token index where segment boundary_seg starts
+        boundary_seg = resync
+        new_stmts = []
+        new_bounds = []
+        new_lines = []
+        new_seg_tokens = []
+        new_seg_ends = []
+        seg_start = bounds[first]
+        seg_line = self.lines[first]
+        while True:
+            while boundary_index < parser.curr and boundary_seg < count:
+                boundary_index += len(self.seg_tokens[boundary_seg])
+                boundary_seg += 1
+            if boundary_index == parser.curr and boundary_seg <= count and resync <= count:
+                break  # back in step with the old parse
+            if parser.at_end():
+                boundary_seg = count + 1
+                break
+            if parser.is_next(TOK_ELSE) or parser.is_next(TOK_END):
+                return self.parse(source)
+            stmt_start = parser.curr
+            stmt = parser.stmt()
+            new_stmts.append(stmt)
+            new_bounds.append(seg_start)
+            new_lines.append(seg_line)
+            new_seg_tokens.append(tokens[stmt_start:parser.curr])
+            new_seg_ends.append([end - seg_start for end in ends[stmt_start:parser.curr]])
+            seg_start = ends[parser.curr - 1]
+            seg_line = tokens[parser.curr - 1].line
+
+        new_seg_items = [line_items(stmt, stmt_tokens) for stmt, stmt_tokens in zip(new_stmts, new_seg_tokens)]
+
+        # Splice the new segments in place of the damaged ones
+        stop = min(boundary_seg, count)
+        self.seg_tokens[first:stop] = new_seg_tokens
+        self.seg_ends[first:stop] = new_seg_ends
+        self.seg_items[first:stop] = new_seg_items
+        self.ast.stmts[first:stop] = new_stmts
+        if boundary_seg <= count:
+            bounds[first:stop] = new_bounds
+            self.lines[first:stop] = new_lines
+        else:
+            bounds[first:] = new_bounds + [seg_start]
+            self.lines[first:] = new_lines + [seg_line]
+        self.source = source
+        if not self.seg_tokens:
+            return self.parse(source)
+        self.ast.line = self.seg_tokens[-1][-1].line
+        return self.ast
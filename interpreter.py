@@ -2,11 +2,83 @@ from utils import *
 from model import *
 from tokens import *
 from state import *
+from resolver import *
+from memo import *
+from callsites import *
+from budget import *
 from definitions import *
 import codecs
+import math
+from itertools import repeat
+
+# Statements return None, or the completion of the 'ret' that ends the
+# function: its value, or BARE_RETURN for a 'ret' without one. Blocks and
+# loops stop and pass a completion up to the FuncCall, so returning needs no
+# Python exception.
+BARE_RETURN = object()
+
+# The value of a variable set to the result of a call that ended with a bare
+# 'ret': reading it is an "Uninitialized variable" error
+UNINITIALIZED = (None, None)
+
+
+class TailCall:
+    '''
+    Completion of 'ret f(...)': the call is made by the caller's call loop
+    (Interpreter.call) once this body has returned, so tail calls do not
+    nest on the Python stack
+    '''
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+
+# Integers above this are not all exact as floats, so i + step could stall
+MAX_EXACT_INT = 2 ** 53
+
+
+def counted_range(start, end, step):
+    '''
+    The values of a numeric for loop from start to end, as a range of ints,
+    when they are integers that floats hold exactly and the loop ends. None
+    otherwise, and the loop is run step by step.
+    '''
+    if not (type(start) is float and type(end) is float and type(step) is float):
+        return None
+    if not (start.is_integer() and step.is_integer() and abs(start) < MAX_EXACT_INT and abs(end) < MAX_EXACT_INT):
+        return None
+    if start < end:
+        # Up to end, like 'while i <= end'
+        return range(int(start), math.floor(end) + 1, int(step)) if step > 0 else None
+    # Down to end, like 'while i >= end'
+    return range(int(start), math.ceil(end) - 1, int(step)) if step < 0 else None
 
 
 class Interpreter:
+    '''
+    Walks the AST. Names are resolved to frame slots first (resolver.py), so
+    env is the state.Frame of the innermost block that has one.
+    '''
+    def __init__(self, memoize=True):
+        self.accesses = {}  # see Resolver
+        self.frames = {}
+        self.memoize = memoize  # keep the results of pure functions, see memo.py
+        self.memo = {}  # function name -> MemoCache
+        self.call_sites = []  # CallSite of each FuncCall, see callsites.py
+        self.epochs = {}  # function name -> [declarations of it run so far], shared with its CallSites
+        self.budget = None  # Budget of the run, ticked by loops and calls
+
+    def enter(self, block, env):
+        '''
+        The frame to run a block in: a new one if it declares anything
+        '''
+        size = self.frames.get(block)
+        if size is None:
+            return env
+        return Frame(env, size)
+
     def interpret(self, node, env):
         if isinstance(node, Integer):
             return (TYPE_NUMBER, float(node.value))
@@ -24,7 +96,11 @@ class Interpreter:
             return self.interpret(node.value, env)
         
         elif isinstance(node, Identifier):
-            value = env.get_var(node.name)
+            access = self.accesses[node]
+            if type(access) is int:
+                value = env.slots[access]
+            else:
+                value = env.get(access)
             if value is None:
                 runtime_error(f'Undefined variable {node.name!r}.', node.line)
             if value[1] is None:
@@ -34,16 +110,21 @@ class Interpreter:
         elif isinstance(node, Assignment):
             # left := right
             # Eval right
-            righttype, rightval = self.interpret(node.right, env)
-            # varval = env.get_var(node.left.name)
-            env.set_var(node.left.name, (righttype, rightval))
+            value = self.interpret(node.right, env)
+            if value is None:
+                value = UNINITIALIZED
+            access = self.accesses[node]
+            if type(access) is int:
+                env.slots[access] = value
+            else:
+                env.set(access, value)
 
         elif isinstance(node, LocalAssignment):
             # left := right
             # Eval right
-            righttype, rightval = self.interpret(node.right, env)
+            value = self.interpret(node.right, env)
             # Always create a new variable in the current scope
-            env.set_local(node.left.name, (righttype, rightval))
+            env.slots[self.accesses[node]] = value if value is not None else UNINITIALIZED
 
 
         elif isinstance(node, BinOp):
@@ -178,7 +259,9 @@ class Interpreter:
         elif isinstance(node, Stmts):
             # eval them in sequence
             for stmt in node.stmts:
-                self.interpret(stmt, env)
+                completion = self.interpret(stmt, env)
+                if completion is not None:
+                    return completion
 
         elif isinstance(node, PrintStmt):
             exprtype, exprval = self.interpret(node.value, env)
@@ -190,93 +273,202 @@ class Interpreter:
             if testtype != TYPE_BOOL:
                 runtime_error(f'Expected boolean value, got {testtype}.', node.test.line)
             if testval:
-                self.interpret(node.then_stmts, env.new_env())
+                return self.interpret(node.then_stmts, self.enter(node.then_stmts, env))
             else:
                 if node.else_stmts:
-                    self.interpret(node.else_stmts, env.new_env())
+                    return self.interpret(node.else_stmts, self.enter(node.else_stmts, env))
         
         elif isinstance(node, WhileStmt):
-            new_env = env.new_env()
+            new_env = self.enter(node, env)
+            budget = self.budget
             while True:
+                if budget is not None:
+                    budget.tick()
                 testtype, testval = self.interpret(node.test, new_env)
                 if testtype!= TYPE_BOOL:
                     runtime_error(f'Expected boolean value, got {testtype}.', node.test.line)
                 if not testval:
                     break
-                self.interpret(node.body_stmts, new_env)
+                completion = self.interpret(node.body_stmts, new_env)
+                if completion is not None:
+                    return completion
 
         elif isinstance(node, ForStmt):
-            varname = node.ident.name
+            var = self.accesses[node.ident]
             ltype, i = self.interpret(node.start, env)
             endtype, end = self.interpret(node.end, env)
-            block_new_env = env.new_env()
+            block_new_env = self.enter(node, env)
+            if node.step is None:
+                step_type, step = TYPE_NUMBER, (1.0 if i < end else -1.0)
+            else:
+                step_type, step = self.interpret(node.step, env)
+            if type(var) is int:
+                values = counted_range(i, end, step)
+                if values is not None:
+                    # Counted loop: the values are made ahead, the loop variable
+                    # always lives in the loop's own frame, and the body's
+                    # statements are run without going through its Stmts
+                    slots = block_new_env.slots
+                    stmts = node.body_stmts.stmts
+                    interpret = self.interpret
+                    if self.budget is not None:
+                        values = self.budget.metered(values)
+                    for newval in zip(repeat(TYPE_NUMBER), map(float, values)):
+                        slots[var] = newval
+                        for stmt in stmts:
+                            completion = interpret(stmt, block_new_env)
+                            if completion is not None:
+                                return completion
+                    return None
             if i < end:
-                if node.step is None:
-                    step = 1
-                else:
-                    step_type, step = self.interpret(node.step, env)
                 while i <= end:
+                    if self.budget is not None:
+                        self.budget.tick()
                     newval = (TYPE_NUMBER, i)
-                    block_new_env.set_var(varname, newval)
-                    self.interpret(node.body_stmts, block_new_env)
+                    if type(var) is int:
+                        block_new_env.slots[var] = newval
+                    else:
+                        block_new_env.set(var, newval)
+                    completion = self.interpret(node.body_stmts, block_new_env)
+                    if completion is not None:
+                        return completion
                     i += step
             else:
-                if node.step is None:
-                    step = -1
-                else:
-                    step_type, step = self.interpret(node.step, env)
                 while i >= end:
+                    if self.budget is not None:
+                        self.budget.tick()
                     newval = (TYPE_NUMBER, i)
-                    block_new_env.set_var(varname, newval)
-                    self.interpret(node.body_stmts, block_new_env)
+                    if type(var) is int:
+                        block_new_env.slots[var] = newval
+                    else:
+                        block_new_env.set(var, newval)
+                    completion = self.interpret(node.body_stmts, block_new_env)
+                    if completion is not None:
+                        return completion
                     i += step
 
         elif isinstance(node, FuncDecl):
-            env.set_func(node.name, (node, env))
+            env.slots[self.accesses[node]] = (node, env)
+            declared = self.epochs.get(node.name)
+            if declared is not None:
+                declared[0] += 1
         elif isinstance(node, FuncCall):
+            func, args = self.prepare_call(node, env)
+            try:
+                return self.call(func, args)
+            except RecursionError:
+                raise StackOverflow(node.line)
+
+        elif isinstance(node, FuncCallStmt):
+            self.interpret(node.expr, env)
+
+        elif isinstance(node, RetStmt):
+            if node.value is None:
+                return BARE_RETURN
+            if isinstance(node.value, FuncCall):
+                # Tail call: leave the body first and let the call loop make it
+                return TailCall(*self.prepare_call(node.value, env))
+            return self.interpret(node.value, env)
+
+    def prepare_call(self, node, env):
+        '''
+        The function a FuncCall calls and its evaluated args
+        '''
+        if self.budget is not None:
+            self.budget.tick()
+        site = self.accesses[node]
+        if site.epoch == site.declared[0] and (site.env is env or site.env is ANY_ENV):
+            site.hits += 1
+            func = site.func
+        else:
             # Make sure the function exists
-            func = env.get_func(node.name)
+            func = env.get(site.candidates)
             if not func:
                 runtime_error(f'Function {node.name} not declared.', node.line)
 
             # fetch the fucntion declaration
             func_decl = func[0]
-            func_env = func[1]
 
             # Does the number of args match the expected number of params?
             if len(node.args) != len(func_decl.params):
                 runtime_error(f'Function {func_decl.name} expects {len(func_decl.params)} arguments, but got {len(node.args)}.',
                                 node.line)
-            # We need to eval all the args
-            args = []
-            for arg in node.args:
-                # argtype, argval = self.interpret(arg, env)
-                # args.append((argtype, argval))
-                args.append(self.interpret(arg, env))
+            site.store(func, env)
+        # We need to eval all the args
+        args = []
+        for arg in node.args:
+            args.append(self.interpret(arg, env))
+        return func, args
+
+    def call(self, func, args):
+        '''
+        Run a function body, and then the functions it tail calls, in a loop
+        '''
+        cache = self.memo.get(func[0].name)
+        if cache is not None and cache.enabled:
+            key = tuple(args)
+            result = cache.get(key)
+            if result is not MISSING:
+                return result
+        else:
+            cache = None
+        while True:
+            func_decl, func_env = func
             # Proper env
-            new_func_env = func_env.new_env()
-            # We must create local variables in the new child environment of the function for the parameters and bind the args to them
+            new_func_env = self.enter(func_decl, func_env)
+            # We must create local variables in the new frame of the function for the parameters and bind the args to them
             for param, argval in zip(func_decl.params, args):
-                # print(f'Binding {param.name} to {argval}')  # Debugging purpose only, remove later
-                new_func_env.set_local(param.name, argval)
+                new_func_env.slots[self.accesses[param]] = argval if argval is not None else UNINITIALIZED
             # ask to interpret the body statements of the function declaration
-
-            try:
-                self.interpret(func_decl.body_stmts, new_func_env)
-                return (TYPE_NUMBER, 0)
-            except Return as e:
-                return e.args[0]
-
-        elif isinstance(node, FuncCallStmt):
-            self.interpret(node.expr, env)
-
-        elif isinstance(node, RetStmt):
-            raise Return(self.interpret(node.value, env))
-
-    def interpret_ast(self, node):
-        # Entrypoint with global environment
-        env = Environment()
-        self.interpret(node, env)
-
-class Return(Exception):
-    pass
\ No newline at end of file
+            completion = self.interpret(func_decl.body_stmts, new_func_env)
+            if type(completion) is not TailCall:
+                break
+            func, args = completion.func, completion.args
+
+        if completion is None:
+            result = (TYPE_NUMBER, 0)
+        elif completion is BARE_RETURN:
+            result = None
+        else:
+            result = completion
+        if cache is not None:
+            cache.put(key, result)
+        return result
+
+    @deep
+    def interpret_ast(self, node, budget=None):
+        '''
+        Run a whole program, within the budget if one is given (see
+        budget.py). Returns a RunResult.
+        '''
+        # Entrypoint with global frame
+        resolver = Resolver()
+        self.accesses, self.frames = resolver.resolve_ast(node)
+        # Calls are reached through their inline cache instead of their candidates
+        self.call_sites = []
+        for call_node in [access_node for access_node in self.accesses if isinstance(access_node, FuncCall)]:
+            site = CallSite(call_node.name, call_node.line, self.accesses[call_node], call_node in resolver.global_calls,
+                            self.epochs.setdefault(call_node.name, [0]))
+            self.accesses[call_node] = site
+            self.call_sites.append(site)
+        if self.memoize:
+            self.memo = memo_caches(pure_functions(node))
+        self.budget = budget
+        if budget is not None:
+            budget.start()
+        try:
+            self.run(node)
+        except OutOfBudget as e:
+            return budget.result(e.status)
+        except StackOverflow as e:
+            runtime_error('Stack overflow, too many nested function calls.', e.line)
+        if budget is None:
+            return RunResult(RUN_DONE)
+        return budget.result(RUN_DONE)
+
+    def run(self, node):
+        env = self.enter(node, None)
+        completion = self.interpret(node, env)
+        if type(completion) is TailCall:
+            # 'ret f(...)' at the top level still makes the call
+            self.call(completion.func, completion.args)
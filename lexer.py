@@ -1,9 +1,94 @@
+import re
+import codecs
 from tokens import *
 from utils import *
 
+###############################################################################
+# Tokenizer engines
+###############################################################################
+ENGINE_SCAN = 'scan'    # Character-at-a-time scanner
+ENGINE_REGEX = 'regex'  # Single master regex, falls back to the scanner for odd input
+
+# Leading blanks are swallowed by every match, then one alternative per token
+# class is tried in order. Anything the master pattern is not sure about
+# (unterminated strings or comments, non-ASCII letters and digits, unexpected
+# characters) lands in OTHER and is handed to the scanner, so both engines
+# produce the same tokens and the same errors.
+TOKEN_PATTERN = re.compile(r'''[ \t\r]*(?:
+    (?P<NEWLINE>\n)
+  | (?P<COMMENT>--[^\n]*)
+  | (?P<BLOCK>/\*[\s\S]*?\*/)
+  | (?P<FLOAT>[0-9]+\.[0-9]+)
+  | (?P<INTEGER>[0-9]+)
+  | (?P<NAME>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<STRING>"[^"]*"|'[^']*')
+  | (?P<OP>==|~=|<=|>=|:=|[-(){}\[\].,+*^;?%=~<>:]|/(?!\*))
+  | (?P<OTHER>.)
+  | (?P<END>\Z)
+)''', re.VERBOSE | re.DOTALL)
+
+CHUNK_SIZE = 64 * 1024  # Characters read at a time by Lexer.iter_tokens
+
+operators = {
+    '(' : TOK_LPAREN,
+    ')' : TOK_RPAREN,
+    '{' : TOK_LCURLY,
+    '}' : TOK_RCURLY,
+    '[' : TOK_LSQUAR,
+    ']' : TOK_RSQUAR,
+    '.' : TOK_DOT,
+    ',' : TOK_COMMA,
+    '+' : TOK_PLUS,
+    '-' : TOK_MINUS,
+    '*' : TOK_STAR,
+    '/' : TOK_SLASH,
+    '^' : TOK_CARET,
+    ';' : TOK_SEMICOLON,
+    '?' : TOK_QUESTION,
+    '%' : TOK_MOD,
+    '=' : TOK_EQ,
+    '~' : TOK_NOT,
+    '<' : TOK_LT,
+    '>' : TOK_GT,
+    ':' : TOK_COLON,
+    '==': TOK_EQEQ,
+    '~=': TOK_NE,
+    '<=': TOK_LE,
+    '>=': TOK_GE,
+    ':=': TOK_ASSIGN,
+}
+
+def read_chunks(source, chunk_size):
+    '''
+    Yield the source text in chunks, from a string, a file object or an mmap
+    '''
+    if isinstance(source, str):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+        return
+    decoder = None
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        if not isinstance(chunk, str):
+            # Binary files and mmaps hand out bytes
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if decoder is not None:
+        yield decoder.decode(b'', final=True)
+
 class Lexer:
-    def __init__(self, source):
+    def __init__(self, source, engine=ENGINE_REGEX, strings=None):
         self.source = source
+        self.engine = engine
+        # With a StringTable, names are interned as they are lexed. String literals
+        # are interned by the parser, once the quotes are stripped.
+        self.strings = strings
+        if strings is not None:
+            self.add_span = self.add_interned_span
         self.start = 0
         self.curr = 0
         self.line = 1
@@ -47,7 +132,7 @@ class Lexer:
     def handle_string(self, start_quote):
         while self.peek() != start_quote:
             if self.curr >= len(self.source):
-                lexing_error(f"Unterminated string on line {self.line}")
+                lexing_error(f"Unterminated string", self.line)
             # if self.peek() == '\\':
             #     self.advance()
             self.advance()
@@ -66,87 +151,197 @@ class Lexer:
             self.add_token(keyword_type)
 
     def add_token(self, token_type):
-        self.tokens.append(Token(token_type, self.source[self.start:self.curr], self.line))
+        self.add_span(token_type, self.start, self.curr, self.line)
 
+    def add_span(self, token_type, start, end, line):
+        self.tokens.append(Token(token_type, self.source[start:end], line))
 
-    def tokenize(self):
+    def add_interned_span(self, token_type, start, end, line):
+        # Only names: string literals are interned by the parser, without their quotes
+        lexeme = self.source[start:end]
+        if token_type == TOK_IDENTIFIER:
+            lexeme = self.strings[self.strings.intern(lexeme)]
+        self.tokens.append(Token(token_type, lexeme, line))
+
+
+    def scan_token(self):
+        self.start = self.curr
+        ch = self.advance()
+
+        if ch == '\n': self.line = self.line + 1
+        elif ch == ' ': pass
+        elif ch == '\t': pass
+        elif ch == '\r': pass
+        elif ch == '(': self.add_token(TOK_LPAREN)
+        elif ch == ')': self.add_token(TOK_RPAREN)
+        elif ch == '{': self.add_token(TOK_LCURLY)
+        elif ch == '}': self.add_token(TOK_RCURLY)
+        elif ch == '[': self.add_token(TOK_LSQUAR)
+        elif ch == ']': self.add_token(TOK_RSQUAR)
+        elif ch == '.': self.add_token(TOK_DOT)
+        elif ch == ',': self.add_token(TOK_COMMA)
+        elif ch == '+': self.add_token(TOK_PLUS)
+        elif ch == '-':
+            if self.match('-'):
+                while self.peek() != '\n' and not (self.curr >= len(self.source)):
+                    self.advance()
+            else:
+                self.add_token(TOK_MINUS)
+        elif ch == '*': self.add_token(TOK_STAR)
+        elif ch == '^': self.add_token(TOK_CARET)
+        elif ch == '/':
+            if self.peek() == '*':  # Use peek() instead of lookahead()
+                self.advance()  # Consume the '*'
+                while True:
+                    if self.curr >= len(self.source):
+                        lexing_error(f"Unterminated comment", self.line)
+                    if self.peek() == '*' and self.lookahead() == '/':
+                        self.advance()  # Consume the '*'
+                        self.advance()  # Consume the '/'
+                        break
+                    if self.peek() == '\n':
+                        self.line += 1
+                    self.advance()
+            else:
+                self.add_token(TOK_SLASH)
+        elif ch == ';': self.add_token(TOK_SEMICOLON)
+        elif ch == '?': self.add_token(TOK_QUESTION)
+        elif ch == '%': self.add_token(TOK_MOD)
+        elif ch == '=':
+            if self.match('='): self.add_token(TOK_EQEQ)
+            else: self.add_token(TOK_EQ)
+        elif ch == '~':
+            if self.match('='): self.add_token(TOK_NE)
+            else: self.add_token(TOK_NOT)
+        elif ch == '<':
+            if self.match('='): self.add_token(TOK_LE)
+            # elif self.match('<'): self.add_token(TOK_SHL)
+            else: self.add_token(TOK_LT)
+        elif ch == '>':
+            if self.match('='): self.add_token(TOK_GE)
+            # elif self.match('>'): self.add_token(TOK_SHR)
+            else: self.add_token(TOK_GT)
+        elif ch == ':':
+            self.add_token(TOK_ASSIGN if self.match('=') else TOK_COLON)
+        elif ch == '"' or ch == '\'':
+            self.handle_string(ch)
+        elif ch.isdigit():
+            self.handle_number()
+        elif ch.isalpha() or ch == '_':
+            self.handle_identifier()
+        else:
+            lexing_error(f"Unexpected character '{ch}'", self.line)
+
+    def tokenize_scan(self):
         while self.curr < len(self.source):
-            self.start = self.curr
-            ch = self.advance()
-            # print(f"Current character: {ch}")
-            # print(f"Current line: {self.line}")
-            # print(f"next character: {self.lookahead()}")
-
-            if ch == '/':
-                print(f"character: {ch}")
-                print(f"Look ahead { self.lookahead() }")
-
-            if ch == '\n': self.line = self.line + 1
-            elif ch == ' ': pass
-            elif ch == '\t': pass
-            elif ch == '\r': pass
-            elif ch == '(': self.add_token(TOK_LPAREN)
-            elif ch == ')': self.add_token(TOK_RPAREN)
-            elif ch == '{': self.add_token(TOK_LCURLY)
-            elif ch == '}': self.add_token(TOK_RCURLY)
-            elif ch == '[': self.add_token(TOK_LSQUAR)
-            elif ch == ']': self.add_token(TOK_RSQUAR)
-            elif ch == '.': self.add_token(TOK_DOT)
-            elif ch == ',': self.add_token(TOK_COMMA)
-            elif ch == '+': self.add_token(TOK_PLUS)
-            elif ch == '-':
-                if self.match('-'):
-                    while self.peek() != '\n' and not (self.curr >= len(self.source)):
-                        self.advance()
-                else:
-                    self.add_token(TOK_MINUS)
-            elif ch == '*': self.add_token(TOK_STAR)
-            elif ch == '^': self.add_token(TOK_CARET)
-            elif ch == '/':
-                if self.peek() == '*':  # Use peek() instead of lookahead()
-                    self.advance()  # Consume the '*'
-                    while True:
-                        if self.curr >= len(self.source):
-                            lexing_error(f"Unterminated comment", self.line)
-                        if self.peek() == '*' and self.lookahead() == '/':
-                            self.advance()  # Consume the '*'
-                            self.advance()  # Consume the '/'
-                            break
-                        if self.peek() == '\n':
-                            self.line += 1
-                        self.advance()
+            self.scan_token()
+        # self.add_token(TOK_EOF)
+        return self.tokens
+
+    def rescan(self, start, line, final=True):
+        '''
+        Scan a single token the slow way, returning the new position and line,
+        or None when a partial (not final) buffer ends before the token does
+        '''
+        if not final and self.source[start] in '"\'/':
+            return None  # An unterminated string or comment may close in the next chunk
+        count = len(self.tokens)
+        self.curr = start
+        self.line = line
+        self.scan_token()
+        if not final and self.curr >= len(self.source) - 1:
+            del self.tokens[count:]
+            return None
+        return self.curr, self.line
+
+    def tokenize_regex(self, final=True, stop=None):
+        # Lex from self.curr until the end of the source, or until a token or
+        # blank run reaches the stop offset
+        source = self.source
+        length = len(source)
+        match = TOKEN_PATTERN.match
+        add = self.add_span
+        pos = self.curr
+        line = self.line
+        limit = length if stop is None else stop
+        while pos < limit:
+            m = match(source, pos)
+            group = m.lastgroup
+            end = m.end()
+            if end == length and not final:
+                break  # The token may go on in the next chunk
+            if group == 'NAME' or group == 'INTEGER' or group == 'FLOAT':
+                # Let the scanner decide when a non-ASCII char or a '.' follows,
+                # since str.isdigit()/isalnum() accept more than [0-9A-Za-z]
+                if end < length and (source[end] >= '\x80' or (source[end] == '.' and group == 'INTEGER')):
+                    rescanned = self.rescan(m.start(group), line, final)
+                    if rescanned is None:
+                        break
+                    pos, line = rescanned
                 else:
-                    self.add_token(TOK_SLASH)
-            elif ch == ';': self.add_token(TOK_SEMICOLON)
-            elif ch == '?': self.add_token(TOK_QUESTION)
-            elif ch == '%': self.add_token(TOK_MOD)
-            elif ch == '=':
-                if self.match('='): self.add_token(TOK_EQEQ)
-                else: self.add_token(TOK_EQ)
-            elif ch == '~':
-                if self.match('='): self.add_token(TOK_NE)
-                else: self.add_token(TOK_NOT)
-            elif ch == '<':
-                if self.match('='): self.add_token(TOK_LE)
-                # elif self.match('<'): self.add_token(TOK_SHL)
-                else: self.add_token(TOK_LT)
-            elif ch == '>':
-                if self.match('='): self.add_token(TOK_GE)
-                # elif self.match('>'): self.add_token(TOK_SHR)
-                else: self.add_token(TOK_GT)
-            elif ch == ':':
-                self.add_token(TOK_ASSIGN if self.match('=') else TOK_COLON)
-            elif ch == '"' or ch == '\'':
-                self.handle_string(ch)
-            elif ch.isdigit():
-                self.handle_number()
-            elif ch.isalpha() or ch == '_':
-                self.handle_identifier()
+                    if group == 'NAME':
+                        add(keywords.get(m.group(group), TOK_IDENTIFIER), m.start(group), end, line)
+                    elif group == 'INTEGER':
+                        add(TOK_INTEGER, m.start(group), end, line)
+                    else:
+                        add(TOK_FLOAT, m.start(group), end, line)
+                    pos = end
+                continue
+            if group == 'OP':
+                add(operators[m.group(group)], m.start(group), end, line)
+            elif group == 'NEWLINE':
+                line += 1
+            elif group == 'COMMENT' or group == 'END':
+                pass
+            elif group == 'STRING':
+                add(TOK_STRING, m.start(group), end, line)
+            elif group == 'BLOCK':
+                line += m.group(group).count('\n')
             else:
-                lexing_error(f"Unexpected character '{ch}'", self.line)
-                
+                rescanned = self.rescan(m.start(group), line, final)
+                if rescanned is None:
+                    break
+                end, line = rescanned
+            pos = end
+        self.curr = pos
+        self.line = line
+        return self.tokens
 
+    def iter_tokens(self, chunk_size=CHUNK_SIZE):
+        '''
+        Lazily yield tokens. The source may be a string, a file object or an
+        mmap, and is read chunk_size characters at a time, so only the current
+        chunk and the tokens lexed from it are kept in memory.
+        '''
+        chunks = read_chunks(self.source, chunk_size)
+        if self.engine == ENGINE_SCAN:
+            # The scanner cannot stop in the middle of a token, so it gets everything at once
+            self.source = ''.join(chunks)
+            yield from self.tokenize_scan()
+            return
+        self.source = ''
+        for chunk in chunks:
+            # Keep the unlexed tail of the previous chunk in front of the new one
+            self.source = self.source[self.curr:] + chunk
+            self.curr = 0
+            self.tokenize_regex(final=False)
+            yield from self.tokens
+            self.tokens.clear()
+        self.tokenize_regex(final=True)
+        yield from self.tokens
+        self.tokens.clear()
 
+    def tokenize_array(self):
+        '''
+        Tokenize into a columnar TokenArray instead of a list of Token objects
+        '''
+        self.tokens = TokenArray(self.source, self.strings)
+        self.add_span = self.tokens.append
+        return self.tokenize()
 
-        # self.add_token(TOK_EOF)
-        return self.tokens
\ No newline at end of file
+    def tokenize(self):
+        if self.engine == ENGINE_SCAN:
+            return self.tokenize_scan()
+        elif self.engine == ENGINE_REGEX:
+            return self.tokenize_regex()
+        raise ValueError(f"Unknown lexer engine {self.engine!r}")
@@ -0,0 +1,250 @@
+from collections import OrderedDict
+from model import *
+
+###############################################################################
+# Memoization of pure functions
+#
+# A function is pure when a call's result depends only on its arguments and
+# the call does nothing else. The check below is conservative:
+#
+#   - no print, and no function declared inside it
+#   - it reads only its params and names it assigns itself
+#   - it assigns no name that a scope around the declaration may hold, since
+#     'x := v' would update that one (see Frame.set())
+#   - it calls only pure functions, each declared once in the whole program,
+#     so the name means the same function wherever the call runs
+#
+# The back ends keep the results of pure functions in a bounded LRU cache per
+# function, keyed by the argument values with their types (1 and true are
+# different arguments). A call that ends in an error never stores anything.
+#
+# A function that is rarely called twice with the same arguments only pays for
+# its cache, so past MEMO_PROBATION lookups a cache with too few hits turns
+# itself off for the rest of the run.
+###############################################################################
+MEMO_SIZE = 1024  # results kept per function
+MEMO_PROBATION = 1024  # lookups before a cache may turn itself off
+MEMO_MIN_HIT_RATE = 0.1
+
+MISSING = object()  # a cache miss, since None is a valid result ('ret')
+
+
+class MemoCache:
+    '''
+    LRU cache of one function's results, with hit and miss counts
+    '''
+    __slots__ = ('entries', 'maxsize', 'hits', 'misses', 'evictions', 'enabled')
+
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.enabled = True  # the back ends skip the cache once it is off
+
+    def get(self, key):
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            lookups = self.hits + self.misses
+            if lookups >= MEMO_PROBATION and self.hits < lookups * MEMO_MIN_HIT_RATE:
+                self.enabled = False
+                self.entries.clear()
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+def memo_caches(names, maxsize=MEMO_SIZE):
+    '''
+    A new cache for each pure function, by name
+    '''
+    return {name: MemoCache(maxsize) for name in names}
+
+
+def memo_stats(caches):
+    '''
+    Hits, misses, evictions and cached results of each function, by name,
+    and whether its cache is still on
+    '''
+    return {name: {'hits': cache.hits, 'misses': cache.misses, 'evictions': cache.evictions,
+                   'size': len(cache.entries), 'enabled': cache.enabled}
+            for name, cache in caches.items()}
+
+
+def print_memo_stats(caches):
+    print(f"{'function':>16} {'hits':>10} {'misses':>10} {'evictions':>10} {'cached':>7}")
+    for name, stats in sorted(memo_stats(caches).items()):
+        state = '' if stats['enabled'] else ' (turned off)'
+        print(f"{name:>16} {stats['hits']:>10} {stats['misses']:>10} {stats['evictions']:>10} {stats['size']:>7}{state}")
+
+
+###############################################################################
+# Purity analysis
+###############################################################################
+class FunctionFacts:
+    '''
+    What a function does, as far as purity goes
+    '''
+    __slots__ = ('node', 'local_only', 'calls')
+
+    def __init__(self, node):
+        self.node = node
+        self.local_only = True  # no print, no nested function, no outside state
+        self.calls = set()      # names of the functions it calls
+
+
+def declared_names(stmts):
+    '''
+    The names a block's own statements may create in its scope
+    '''
+    names = set()
+    for stmt in stmts.stmts:
+        if isinstance(stmt, (Assignment, LocalAssignment)):
+            names.add(stmt.left.name)
+    return names
+
+
+class PurityChecker:
+    def __init__(self):
+        self.functions = {}  # name -> FunctionFacts of each declaration
+
+    def scope(self, stmts, outer, extra=()):
+        '''
+        The names visible in a block: its own and the ones around it
+        '''
+        return outer | declared_names(stmts) | set(extra)
+
+    def declare(self, node, outer):
+        '''
+        Look into a function, declared where the names in outer are visible
+        '''
+        facts = FunctionFacts(node)
+        self.functions.setdefault(node.name, []).append(facts)
+        params = {param.name for param in node.params}
+        assigned = set()
+        reads = set()
+        self.walk_function(node.body_stmts, facts, assigned, reads)
+        # Reads of anything but its own names see state from outside
+        if not reads <= params | assigned:
+            facts.local_only = False
+        # An assignment to a name from outside may update it there
+        if (assigned - params) & outer:
+            facts.local_only = False
+        # Functions declared inside make it impure, but may be pure themselves
+        self.walk(node.body_stmts, self.scope(node.body_stmts, outer, params))
+
+    def walk_function(self, node, facts, assigned, reads):
+        if isinstance(node, Identifier):
+            reads.add(node.name)
+
+        elif isinstance(node, (Integer, Float, String, Bool)):
+            pass
+
+        elif isinstance(node, Grouping):
+            self.walk_function(node.value, facts, assigned, reads)
+
+        elif isinstance(node, (BinOp, LogicalOp)):
+            self.walk_function(node.left, facts, assigned, reads)
+            self.walk_function(node.right, facts, assigned, reads)
+
+        elif isinstance(node, UnOp):
+            self.walk_function(node.operand, facts, assigned, reads)
+
+        elif isinstance(node, (Assignment, LocalAssignment)):
+            self.walk_function(node.right, facts, assigned, reads)
+            assigned.add(node.left.name)
+
+        elif isinstance(node, Stmts):
+            for stmt in node.stmts:
+                self.walk_function(stmt, facts, assigned, reads)
+
+        elif isinstance(node, PrintStmt):
+            facts.local_only = False
+
+        elif isinstance(node, IfStmt):
+            self.walk_function(node.test, facts, assigned, reads)
+            self.walk_function(node.then_stmts, facts, assigned, reads)
+            if node.else_stmts:
+                self.walk_function(node.else_stmts, facts, assigned, reads)
+
+        elif isinstance(node, WhileStmt):
+            self.walk_function(node.test, facts, assigned, reads)
+            self.walk_function(node.body_stmts, facts, assigned, reads)
+
+        elif isinstance(node, ForStmt):
+            self.walk_function(node.start, facts, assigned, reads)
+            self.walk_function(node.end, facts, assigned, reads)
+            if node.step is not None:
+                self.walk_function(node.step, facts, assigned, reads)
+            assigned.add(node.ident.name)
+            self.walk_function(node.body_stmts, facts, assigned, reads)
+
+        elif isinstance(node, FuncDecl):
+            facts.local_only = False
+
+        elif isinstance(node, FuncCall):
+            facts.calls.add(node.name)
+            for arg in node.args:
+                self.walk_function(arg, facts, assigned, reads)
+
+        elif isinstance(node, FuncCallStmt):
+            self.walk_function(node.expr, facts, assigned, reads)
+
+        elif isinstance(node, RetStmt):
+            if node.value is not None:
+                self.walk_function(node.value, facts, assigned, reads)
+
+    def walk(self, node, visible):
+        '''
+        Find the function declarations in the blocks of a tree, with the names
+        visible where each one is declared
+        '''
+        if isinstance(node, Stmts):
+            for stmt in node.stmts:
+                self.walk(stmt, visible)
+
+        elif isinstance(node, IfStmt):
+            self.walk(node.then_stmts, self.scope(node.then_stmts, visible))
+            if node.else_stmts:
+                self.walk(node.else_stmts, self.scope(node.else_stmts, visible))
+
+        elif isinstance(node, WhileStmt):
+            self.walk(node.body_stmts, self.scope(node.body_stmts, visible))
+
+        elif isinstance(node, ForStmt):
+            self.walk(node.body_stmts, self.scope(node.body_stmts, visible, [node.ident.name]))
+
+        elif isinstance(node, FuncDecl):
+            self.declare(node, visible)
+
+    def pure_functions(self, root):
+        self.walk(root, self.scope(root, set()))
+        # Only functions declared once, so a call always means that declaration
+        pure = {name for name, decls in self.functions.items() if len(decls) == 1 and decls[0].local_only}
+        # Drop the ones that call anything else, until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for name in list(pure):
+                if not self.functions[name][0].calls <= pure:
+                    pure.discard(name)
+                    changed = True
+        return pure
+
+
+def pure_functions(root):
+    '''
+    Names of the functions of a program that can be memoized
+    '''
+    return PurityChecker().pure_functions(root)
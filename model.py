@@ -1,25 +1,46 @@
 from tokens import *
 
 
+class VerifyError(Exception):
+    '''
+    Raised by verify_ast() for a node whose fields do not have the right types
+    '''
+    pass
+
+
 class Node:
     '''
     The parent class for every node in the AST
     '''
-    pass
+    __slots__ = ()
+
+    def verify(self):
+        '''
+        Structural checks for this node alone, see verify_ast()
+        '''
+        pass
+
+    def check(self, field, value, valid):
+        '''
+        Raise a VerifyError naming the node, the field and the line unless valid
+        '''
+        if not valid:
+            raise VerifyError(f'{type(self).__name__}.{field} at line {getattr(self, "line", "?")} '
+                              f'is not valid: {value!r}')
 
 
 class Expr(Node):
     '''
     Expressions evaluate to a result, like x + (3 * y) >= 6
     '''
-    pass
+    __slots__ = ()
 
 
 class Stmt(Node):
     '''
     Statements perform an action
     '''
-    pass
+    __slots__ = ()
 
 
 class Decl(Stmt):
@@ -27,18 +48,22 @@ class Decl(Stmt):
     Declarations are statements that declare a new name (functions)
     "var" <id> "=" <expr> ";"
     '''
-    pass
+    __slots__ = ()
 
 class Integer(Expr):
     '''
     Example: 17
     '''
 
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, int), value
         self.value = value
         self.line = line
 
+    def verify(self):
+        self.check('value', self.value, isinstance(self.value, int))
+
     def __repr__(self):
         return f'Integer[{self.value}]'
 
@@ -48,11 +73,15 @@ class Float(Expr):
     Example: 3.141592
     '''
 
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, float), value
         self.value = value
         self.line = line
 
+    def verify(self):
+        self.check('value', self.value, isinstance(self.value, float))
+
     def __repr__(self):
         return f'Float[{self.value}]'
 
@@ -63,11 +92,15 @@ class Bool(Expr):
     Example: true, false
     '''
 
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, bool), value
         self.value = value
         self.line = line
 
+    def verify(self):
+        self.check('value', self.value, isinstance(self.value, bool))
+
     def __repr__(self):
         return f'Bool[{self.value}]'
 
@@ -77,10 +110,15 @@ class String(Expr):
     Example: 'this is a string'
     '''
 
-    def __init__(self, value, line):
-        assert isinstance(value, str), value
+    __slots__ = ('value', 'line', 'sid')
+
+    def __init__(self, value, line, sid=None):
         self.value = value
         self.line = line
+        self.sid = sid  # id of value in the StringTable
+
+    def verify(self):
+        self.check('value', self.value, isinstance(self.value, str))
 
     def __repr__(self):
         return f'String[{self.value}]'
@@ -91,13 +129,17 @@ class UnOp(Expr):
     Example: -operand
     '''
 
+    __slots__ = ('op', 'operand', 'line')
+
     def __init__(self, op: Token, operand: Expr, line):
-        assert isinstance(op, Token), op
-        assert isinstance(operand, Expr), operand
         self.op = op
         self.operand = operand
         self.line = line
 
+    def verify(self):
+        self.check('op', self.op, isinstance(self.op, Token))
+        self.check('operand', self.operand, isinstance(self.operand, Expr))
+
     def __repr__(self):
         return f'UnOp({self.op.lexeme!r}, {self.operand})'
 
@@ -107,15 +149,19 @@ class BinOp(Expr):
     Example: x + y
     '''
 
+    __slots__ = ('op', 'left', 'right', 'line')
+
     def __init__(self, op: Token, left: Expr, right: Expr, line):
-        assert isinstance(op, Token), op
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.op = op
         self.left = left
         self.right = right
         self.line = line
 
+    def verify(self):
+        self.check('op', self.op, isinstance(self.op, Token))
+        self.check('left', self.left, isinstance(self.left, Expr))
+        self.check('right', self.right, isinstance(self.right, Expr))
+
     def __repr__(self):
         return f'BinOp({self.op.lexeme!r}, {self.left}, {self.right})'
 
@@ -125,15 +171,19 @@ class LogicalOp(Expr):
     Example: x and y, x or y
     '''
 
+    __slots__ = ('op', 'left', 'right', 'line')
+
     def __init__(self, op: Token, left: Expr, right: Expr, line):
-        assert isinstance(op, Token), op
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.op = op
         self.left = left
         self.right = right
         self.line = line
 
+    def verify(self):
+        self.check('op', self.op, isinstance(self.op, Token))
+        self.check('left', self.left, isinstance(self.left, Expr))
+        self.check('right', self.right, isinstance(self.right, Expr))
+
     def __repr__(self):
         return f'LogicalOp({self.op.lexeme!r}, {self.left}, {self.right})'
 
@@ -141,10 +191,15 @@ class Identifier(Expr):
     '''
     Example: x, PI, _score, numLives, start_vel
     '''
-    def __init__(self, name: str, line):
-        assert isinstance(name, str), name
+    __slots__ = ('name', 'line', 'sid')
+
+    def __init__(self, name: str, line, sid=None):
         self.name = name
         self.line = line
+        self.sid = sid  # id of name in the StringTable
+
+    def verify(self):
+        self.check('name', self.name, isinstance(self.name, str))
     
     def __repr__(self):
         return f'Identifier({self.name})'
@@ -154,11 +209,15 @@ class Grouping(Expr):
     Example: ( <expr> )
     '''
 
+    __slots__ = ('value', 'line')
+
     def __init__(self, value, line):
-        assert isinstance(value, Expr), value
         self.value = value
         self.line = line
 
+    def verify(self):
+        self.check('value', self.value, isinstance(self.value, Expr))
+
     def __repr__(self):
         return f'Grouping({self.value})'
 
@@ -166,11 +225,16 @@ class Stmts(Node):
     '''
     List of statements
     '''
+    __slots__ = ('stmts', 'line')
+
     def __init__(self, stmts, line):
-        assert all(isinstance(stmt, Stmt) for stmt in stmts), stmts
         self.stmts = stmts
         self.line = line
 
+    def verify(self):
+        for index, stmt in enumerate(self.stmts):
+            self.check(f'stmts[{index}]', stmt, isinstance(stmt, Stmt))
+
     def __repr__(self):
         return f'Stmts({self.stmts})'
 
@@ -180,12 +244,16 @@ class PrintStmt(Stmt):
     Example: print value 
     '''
 
+    __slots__ = ('value', 'line', 'end')
+
     def __init__(self, value: Expr, end, line):
-        assert isinstance(value, Expr), value
         self.value = value
         self.line = line
         self.end = end
 
+    def verify(self):
+        self.check('value', self.value, isinstance(self.value, Expr))
+
     def __repr__(self):
         return f'PrintStmt({self.value}, end={self.end!r})'
     
@@ -193,15 +261,19 @@ class PrintStmt(Stmt):
 class IfStmt(Stmt):
     '''
     "if" <expr> "then" <then_stmts> "else" <els_stmts> "end"'''
+    __slots__ = ('test', 'then_stmts', 'else_stmts', 'line')
+
     def __init__(self, test: Expr, then_stmts: Stmts, else_stmts: Stmts, line):
-        assert isinstance(test, Expr), test
-        assert isinstance(then_stmts, Stmts), then_stmts
-        assert else_stmts is None or isinstance(else_stmts, Stmts), else_stmts
         self.test = test
         self.then_stmts = then_stmts
         self.else_stmts = else_stmts
         self.line = line
 
+    def verify(self):
+        self.check('test', self.test, isinstance(self.test, Expr))
+        self.check('then_stmts', self.then_stmts, isinstance(self.then_stmts, Stmts))
+        self.check('else_stmts', self.else_stmts, self.else_stmts is None or isinstance(self.else_stmts, Stmts))
+
     def __repr__(self):
         return f'IfStmt(test={self.test}, then_stmts={self.then_stmts}, else_stmts={self.else_stmts})'
 
@@ -209,12 +281,16 @@ class WhileStmt(Stmt):
     '''
     "while" <expr> "do" <body_stmts> "end"
     '''
+    __slots__ = ('test', 'body_stmts', 'line')
+
     def __init__(self, test, body_stmts, line):
-        assert isinstance(test, Expr), test
-        assert isinstance(body_stmts, Stmts), body_stmts
         self.test = test
         self.body_stmts = body_stmts
         self.line = line
+
+    def verify(self):
+        self.check('test', self.test, isinstance(self.test, Expr))
+        self.check('body_stmts', self.body_stmts, isinstance(self.body_stmts, Stmts))
     
     def __repr__(self):
         return f'WhileStmt(test={self.test}, body_stmts={self.body_stmts})'
@@ -224,12 +300,9 @@ class ForStmt(Stmt):
     "for" <identifier> := <start> "," <end> ("," <increment>)? "do" <body_stmts> "end"
     '''
 
+    __slots__ = ('ident', 'start', 'end', 'step', 'body_stmts', 'line')
+
     def __init__(self, ident,  start: Expr, end: Expr, step: Expr, body_stmts, line):
-        assert isinstance(ident, Identifier), ident
-        assert isinstance(start, Expr), start
-        assert isinstance(end, Expr), end
-        assert isinstance(step, Expr) or step is None, step
-        assert isinstance(body_stmts, Stmts), body_stmts
         self.ident = ident  # Identifier instance, not str
         self.start = start
         self.end = end
@@ -237,6 +310,13 @@ class ForStmt(Stmt):
         self.body_stmts = body_stmts
         self.line = line
 
+    def verify(self):
+        self.check('ident', self.ident, isinstance(self.ident, Identifier))
+        self.check('start', self.start, isinstance(self.start, Expr))
+        self.check('end', self.end, isinstance(self.end, Expr))
+        self.check('step', self.step, isinstance(self.step, Expr) or self.step is None)
+        self.check('body_stmts', self.body_stmts, isinstance(self.body_stmts, Stmts))
+
     def __repr__(self):
         return f'ForStmt(ident={self.ident}, start={self.start}, end={self.end}, step={self.step}, body_stmts={self.body_stmts})'
 
@@ -248,13 +328,17 @@ class Assignment(Stmt):
     obj.name := "Mario"
     vel := 3.4
     '''
+    __slots__ = ('left', 'right', 'line')
+
     def __init__(self, left: Expr, right: Expr, line):
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.left = left
         self.right = right
         self.line = line
 
+    def verify(self):
+        self.check('left', self.left, isinstance(self.left, Expr))
+        self.check('right', self.right, isinstance(self.right, Expr))
+
     def __repr__(self):
         return f'Assignment({self.left}, {self.right})'
 
@@ -262,13 +346,17 @@ class LocalAssignment(Stmt):
     '''
     local left := right
     '''
+    __slots__ = ('left', 'right', 'line')
+
     def __init__(self, left: Expr, right: Expr, line):
-        assert isinstance(left, Expr), left
-        assert isinstance(right, Expr), right
         self.left = left
         self.right = right
         self.line = line
 
+    def verify(self):
+        self.check('left', self.left, isinstance(self.left, Expr))
+        self.check('right', self.right, isinstance(self.right, Expr))
+
     def __repr__(self):
         return f'LocalAssignment({self.left}, {self.right})'
 
@@ -278,13 +366,19 @@ class FuncDecl(Decl):
     '''
     "func" <identifier> "(" <params>? ")" <body_stmts> "end"
     '''
-    def __init__(self, name, params, body_stmts, line):
-        assert isinstance(name, str), name
-        assert all(isinstance(param, Param) for param in params), params
+    __slots__ = ('name', 'params', 'body_stmts', 'line', 'sid')
+
+    def __init__(self, name, params, body_stmts, line, sid=None):
         self.name = name
         self.params = params
         self.body_stmts = body_stmts
         self.line = line
+        self.sid = sid  # id of name in the StringTable
+
+    def verify(self):
+        self.check('name', self.name, isinstance(self.name, str))
+        for index, param in enumerate(self.params):
+            self.check(f'params[{index}]', param, isinstance(param, Param))
     def __repr__(self):
         return f'FuncDecl(name={self.name}, params={self.params}, body_stmts={self.body_stmts})'
 
@@ -293,10 +387,15 @@ class Param(Decl):
     Single function param
     "(" <param> ")"
     '''
-    def __init__(self, name, line):
-        assert isinstance(name, str), name
+    __slots__ = ('name', 'line', 'sid')
+
+    def __init__(self, name, line, sid=None):
         self.name = name
         self.line = line
+        self.sid = sid  # id of name in the StringTable
+
+    def verify(self):
+        self.check('name', self.name, isinstance(self.name, str))
     
     def __repr__(self):
         return f'Param({self.name})'
@@ -309,10 +408,13 @@ class FuncCall(Expr):
     <name> "(" <args>? ")"
     <args> ::= <expr> ("," <expr>)*
     '''
-    def __init__(self, name, args, line):
+    __slots__ = ('name', 'args', 'line', 'sid')
+
+    def __init__(self, name, args, line, sid=None):
         self.name = name
         self.args = args
         self.line = line
+        self.sid = sid  # id of name in the StringTable
     
     def __repr__(self):
         return f'FuncCall({self.name}, {self.args})'
@@ -321,9 +423,13 @@ class FuncCallStmt(Stmt):
     '''
     A special type of statement to wrap FuncCall
     '''
+    __slots__ = ('expr',)
+
     def __init__(self, expr: FuncCall):
-        assert isinstance(expr, FuncCall), expr
         self.expr = expr
+
+    def verify(self):
+        self.check('expr', self.expr, isinstance(self.expr, FuncCall))
     def __repr__(self):
         return f'FuncCallStmt({self.expr})'
 
@@ -331,10 +437,41 @@ class RetStmt(Stmt):
     '''
     "ret" <expr>?
     '''
+    __slots__ = ('value', 'line')
+
     def __init__(self, value: Expr, line):
-        assert value is None or isinstance(value, Expr), value
         self.value = value
         self.line = line
 
+    def verify(self):
+        self.check('value', self.value, self.value is None or isinstance(self.value, Expr))
+
     def __repr__(self):
-        return f'RetStmt(value={self.value})'
\ No newline at end of file
+        return f'RetStmt(value={self.value})'
+
+def iter_child_nodes(node):
+    '''
+    Yield the direct children of node (nodes, and the nodes inside list fields)
+    '''
+    for field in node.__slots__:
+        value = getattr(node, field)
+        if isinstance(value, Node):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, Node):
+                    yield item
+
+
+def verify_ast(root):
+    '''
+    Run the structural checks of every node in the tree, raising a VerifyError
+    for the first one that fails. The node constructors no longer validate
+    their arguments, so this is the debug-mode safety net
+    '''
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        node.verify()
+        pending.extend(iter_child_nodes(node))
+    return root
@@ -0,0 +1,389 @@
+import math
+from utils import *
+from model import *
+from tokens import *
+from definitions import *
+
+###############################################################################
+# AST optimizer, run between the parser and the back ends
+#
+# The rewrites keep what a program prints and every runtime error it reports,
+# on the interpreters and on the VM alike. When they could disagree (1 / 0, a
+# mismatched type, a function call with side effects), the tree is left as it
+# is. So:
+#
+#   - constant subtrees are folded, unless evaluating them is an error
+#   - identities like x + 0 and x * 1 only drop the constant when x is known
+#     to be a number, since "a" + 0 is "a0", and when the constant is a number,
+#     since true == 1 in Python but x * true is an error
+#   - an if or while with a constant test loses the branch that cannot run.
+#     The branch that always runs is spliced into the enclosing block only if
+#     it declares no names of its own, because a block is a scope.
+#
+# One error does go away with a dead branch: the VM compiler reports a name
+# that is read before it is defined when it compiles the program, even in code
+# that never runs, and once that code is removed it has nothing to report. The
+# interpreters only report such a name when the code runs, so their output is
+# the same either way.
+#
+# OPT_FAST_MATH also merges constant factors, as in x * 3.141592 / 180, which
+# is (x * 3.141592) / 180 and has no constant subtree. Reassociating can change
+# the last bits of a result, so it is not part of OPT_SAFE.
+###############################################################################
+OPT_NONE = 0
+OPT_SAFE = 1
+OPT_FAST_MATH = 2
+
+arithmetic_ops = {
+    TOK_MINUS : lambda a, b: a - b,
+    TOK_STAR  : lambda a, b: a * b,
+    TOK_SLASH : lambda a, b: a / b,
+    TOK_MOD   : lambda a, b: a % b,
+    TOK_CARET : lambda a, b: a ** b,
+}
+
+comparison_ops = {
+    TOK_GT    : lambda a, b: a > b,
+    TOK_GE    : lambda a, b: a >= b,
+    TOK_LT    : lambda a, b: a < b,
+    TOK_LE    : lambda a, b: a <= b,
+    TOK_EQEQ  : lambda a, b: a == b,
+    TOK_NE    : lambda a, b: a != b,
+}
+
+
+def constant(node):
+    '''
+    The (type, value) of a literal node, as the interpreter evaluates it, or None
+    '''
+    if isinstance(node, (Integer, Float)):
+        return (TYPE_NUMBER, float(node.value))
+    elif isinstance(node, String):
+        return (TYPE_STRING, node.value)
+    elif isinstance(node, Bool):
+        return (TYPE_BOOL, node.value)
+    return None
+
+
+def number(value):
+    '''
+    A folded number, or None when it is not a finite float
+    '''
+    if type(value) is float and math.isfinite(value):
+        return (TYPE_NUMBER, value)
+    return None
+
+
+def fold_binary(kind, left, right):
+    '''
+    The constant value of a binary operator on constants, or None where the
+    program would report an error
+    '''
+    lefttype, leftval = left
+    righttype, rightval = right
+    if kind == TOK_PLUS:
+        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
+            return number(leftval + rightval)
+        elif lefttype == TYPE_STRING or righttype == TYPE_STRING:
+            return (TYPE_STRING, stringify(leftval) + stringify(rightval))
+    elif kind in arithmetic_ops:
+        if lefttype != TYPE_NUMBER or righttype != TYPE_NUMBER:
+            return None
+        if kind in (TOK_SLASH, TOK_MOD) and rightval == 0:
+            return None
+        try:
+            return number(arithmetic_ops[kind](leftval, rightval))
+        except ArithmeticError:
+            return None
+    elif kind in (TOK_EQEQ, TOK_NE):
+        if lefttype == righttype:
+            return (TYPE_BOOL, comparison_ops[kind](leftval, rightval))
+    elif kind in comparison_ops:
+        if lefttype == righttype and lefttype != TYPE_BOOL:
+            return (TYPE_BOOL, comparison_ops[kind](leftval, rightval))
+    return None
+
+
+def fold_unary(kind, operand):
+    operandtype, operandval = operand
+    if kind == TOK_MINUS and operandtype == TYPE_NUMBER:
+        return (TYPE_NUMBER, -operandval)
+    elif kind == TOK_PLUS and operandtype == TYPE_NUMBER:
+        return operand
+    elif kind == TOK_NOT and operandtype == TYPE_BOOL:
+        return (TYPE_BOOL, not operandval)
+    return None
+
+
+def static_type(node):
+    '''
+    The type an expression has whenever it evaluates without an error, or
+    None if that depends on the values at run time
+    '''
+    if isinstance(node, (Integer, Float)):
+        return TYPE_NUMBER
+    elif isinstance(node, String):
+        return TYPE_STRING
+    elif isinstance(node, Bool):
+        return TYPE_BOOL
+    elif isinstance(node, Grouping):
+        return static_type(node.value)
+    elif isinstance(node, UnOp):
+        kind = node.op.token_type
+        if kind == TOK_NOT:
+            return TYPE_BOOL
+        elif kind == TOK_MINUS:
+            return TYPE_NUMBER
+        # The VM lets a unary + through whatever its operand
+        return static_type(node.operand)
+    elif isinstance(node, BinOp):
+        kind = node.op.token_type
+        if kind in comparison_ops:
+            return TYPE_BOOL
+        elif kind in arithmetic_ops:
+            return TYPE_NUMBER
+        lefttype, righttype = static_type(node.left), static_type(node.right)
+        if lefttype == TYPE_NUMBER and righttype == TYPE_NUMBER:
+            return TYPE_NUMBER
+        elif lefttype == TYPE_STRING or righttype == TYPE_STRING:
+            return TYPE_STRING
+    elif isinstance(node, LogicalOp):
+        lefttype = static_type(node.left)
+        if lefttype == TYPE_BOOL and static_type(node.right) == TYPE_BOOL:
+            return TYPE_BOOL
+    return None
+
+
+def declares(stmts):
+    '''
+    Whether a block's own statements may create a name in its scope
+    '''
+    return any(isinstance(stmt, (Assignment, LocalAssignment, FuncDecl)) for stmt in stmts.stmts)
+
+
+def has_func_decl(node):
+    '''
+    Whether a subtree declares a function. The compiler knows a function from
+    its declaration on, wherever that is, so such code is never removed.
+    '''
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, FuncDecl):
+            return True
+        stack.extend(iter_child_nodes(node))
+    return False
+
+
+class Optimizer:
+    def __init__(self, strings, level=OPT_SAFE):
+        self.strings = strings  # the parser's StringTable, for folded strings
+        self.level = level
+        self.rewrites = []  # (line, description) of every rewrite made, in order
+
+    def report(self, line, description):
+        self.rewrites.append((line, description))
+
+    def literal(self, value, line):
+        valuetype, value = value
+        if valuetype == TYPE_NUMBER:
+            return Float(value, line)
+        elif valuetype == TYPE_STRING:
+            return String(value, line, sid=self.strings.intern(value))
+        return Bool(value, line)
+
+    def optimize(self, node):
+        '''
+        The optimized tree. Nodes that do not change are shared with the input.
+        '''
+        if isinstance(node, Stmts):
+            stmts = []
+            for stmt in node.stmts:
+                stmts.extend(self.optimize_stmt(stmt))
+            return Stmts(stmts, node.line)
+        return self.optimize_expr(node)
+
+    def optimize_block(self, stmts):
+        return self.optimize(stmts) if stmts is not None else None
+
+    ###########################################################################
+    # Expressions
+    ###########################################################################
+    def optimize_expr(self, node):
+        if isinstance(node, Grouping):
+            # Parentheses only matter to the parser
+            return self.optimize_expr(node.value)
+
+        elif isinstance(node, BinOp):
+            return self.optimize_binop(BinOp(node.op, self.optimize_expr(node.left),
+                                             self.optimize_expr(node.right), node.line))
+
+        elif isinstance(node, UnOp):
+            return self.optimize_unop(UnOp(node.op, self.optimize_expr(node.operand), node.line))
+
+        elif isinstance(node, LogicalOp):
+            return self.optimize_logicalop(LogicalOp(node.op, self.optimize_expr(node.left),
+                                                     self.optimize_expr(node.right), node.line))
+
+        elif isinstance(node, FuncCall):
+            return FuncCall(node.name, [self.optimize_expr(arg) for arg in node.args], node.line, sid=node.sid)
+
+        return node
+
+    def optimize_binop(self, node):
+        kind = node.op.token_type
+        left, right = constant(node.left), constant(node.right)
+        if left is not None and right is not None:
+            value = fold_binary(kind, left, right)
+            if value is not None:
+                self.report(node.line, f'folded {stringify(left[1])!r} {node.op.lexeme} {stringify(right[1])!r}')
+                return self.literal(value, node.line)
+
+        # Identities, kept to operands that are surely numbers
+        if right is not None and right[0] == TYPE_NUMBER and static_type(node.left) == TYPE_NUMBER:
+            if (kind in (TOK_PLUS, TOK_MINUS) and right[1] == 0 or
+                    kind in (TOK_STAR, TOK_SLASH, TOK_CARET) and right[1] == 1):
+                self.report(node.line, f'removed {node.op.lexeme} {stringify(right[1])}')
+                return node.left
+        if left is not None and left[0] == TYPE_NUMBER and static_type(node.right) == TYPE_NUMBER:
+            if kind == TOK_PLUS and left[1] == 0 or kind == TOK_STAR and left[1] == 1:
+                self.report(node.line, f'removed {stringify(left[1])} {node.op.lexeme}')
+                return node.right
+
+        if self.level >= OPT_FAST_MATH and right is not None:
+            return self.merge_factors(node, right)
+        return node
+
+    def merge_factors(self, node, right):
+        '''
+        (x * a) * b  ->  x * (a * b)
+        (x * a) / b  ->  x * (a / b)
+        (x / a) / b  ->  x / (a * b)
+        The inner operator is kept, so an error in x is reported as before.
+        '''
+        inner = node.left
+        kind = node.op.token_type
+        if not isinstance(inner, BinOp) or kind not in (TOK_STAR, TOK_SLASH):
+            return node
+        inner_kind = inner.op.token_type
+        inner_right = constant(inner.right)
+        if inner_right is None or inner_right[0] != TYPE_NUMBER or right[0] != TYPE_NUMBER:
+            return node
+        if inner_kind == TOK_STAR:
+            merged = fold_binary(kind, inner_right, right)
+        elif inner_kind == TOK_SLASH and kind == TOK_SLASH:
+            merged = fold_binary(TOK_STAR, inner_right, right)
+        else:
+            return node
+        if merged is None or merged[1] == 0:
+            return node
+        self.report(node.line, f'merged constant factors {stringify(inner_right[1])!r} and {stringify(right[1])!r}')
+        return BinOp(inner.op, inner.left, self.literal(merged, node.line), node.line)
+
+    def optimize_unop(self, node):
+        kind = node.op.token_type
+        operand = constant(node.operand)
+        if operand is not None:
+            value = fold_unary(kind, operand)
+            if value is not None:
+                self.report(node.line, f'folded {node.op.lexeme}{stringify(operand[1])!r}')
+                return self.literal(value, node.line)
+        inner = node.operand
+        if kind == TOK_PLUS and static_type(inner) == TYPE_NUMBER:
+            self.report(node.line, 'removed unary +')
+            return inner
+        if isinstance(inner, UnOp) and inner.op.token_type == kind:
+            if (kind == TOK_MINUS and static_type(inner.operand) == TYPE_NUMBER or
+                    kind == TOK_NOT and static_type(inner.operand) == TYPE_BOOL):
+                self.report(node.line, f'removed double {node.op.lexeme}')
+                return inner.operand
+        return node
+
+    def optimize_logicalop(self, node):
+        left, right = constant(node.left), constant(node.right)
+        if left is not None and right is not None and left[0] == TYPE_BOOL and right[0] == TYPE_BOOL:
+            value = (TYPE_BOOL, left[1] or right[1]) if node.op.token_type == TOK_OR else (TYPE_BOOL, left[1] and right[1])
+            self.report(node.line, f'folded {stringify(left[1])} {node.op.lexeme} {stringify(right[1])}')
+            return self.literal(value, node.line)
+        # true and x, false or x, x and true, x or false  ->  x, for a boolean x
+        neutral = node.op.token_type == TOK_AND
+        if left == (TYPE_BOOL, neutral) and static_type(node.right) == TYPE_BOOL:
+            self.report(node.line, f'removed {stringify(neutral)} {node.op.lexeme}')
+            return node.right
+        if right == (TYPE_BOOL, neutral) and static_type(node.left) == TYPE_BOOL:
+            self.report(node.line, f'removed {node.op.lexeme} {stringify(neutral)}')
+            return node.left
+        return node
+
+    ###########################################################################
+    # Statements, each optimized into a list of zero or more statements
+    ###########################################################################
+    def optimize_stmt(self, node):
+        if isinstance(node, Assignment):
+            return [Assignment(node.left, self.optimize_expr(node.right), node.line)]
+
+        elif isinstance(node, LocalAssignment):
+            return [LocalAssignment(node.left, self.optimize_expr(node.right), node.line)]
+
+        elif isinstance(node, PrintStmt):
+            return [PrintStmt(self.optimize_expr(node.value), node.end, node.line)]
+
+        elif isinstance(node, IfStmt):
+            return self.optimize_if(node)
+
+        elif isinstance(node, WhileStmt):
+            test = self.optimize_expr(node.test)
+            if constant(test) == (TYPE_BOOL, False) and not has_func_decl(node.body_stmts):
+                self.report(test.line, "removed a 'while false' loop")
+                return []
+            return [WhileStmt(test, self.optimize(node.body_stmts), node.line)]
+
+        elif isinstance(node, ForStmt):
+            step = self.optimize_expr(node.step) if node.step is not None else None
+            return [ForStmt(node.ident, self.optimize_expr(node.start), self.optimize_expr(node.end), step,
+                            self.optimize(node.body_stmts), node.line)]
+
+        elif isinstance(node, FuncDecl):
+            return [FuncDecl(node.name, node.params, self.optimize(node.body_stmts), node.line, sid=node.sid)]
+
+        elif isinstance(node, FuncCallStmt):
+            return [FuncCallStmt(self.optimize_expr(node.expr))]
+
+        elif isinstance(node, RetStmt):
+            value = self.optimize_expr(node.value) if node.value is not None else None
+            return [RetStmt(value, node.line)]
+
+        return [node]
+
+    def optimize_if(self, node):
+        test = self.optimize_expr(node.test)
+        then_stmts = self.optimize(node.then_stmts)
+        else_stmts = self.optimize_block(node.else_stmts)
+        value = constant(test)
+        if value is None or value[0] != TYPE_BOOL:
+            return [IfStmt(test, then_stmts, else_stmts, node.line)]
+
+        taken, dead = (then_stmts, else_stmts) if value[1] else (else_stmts, then_stmts)
+        if dead is not None and has_func_decl(dead):
+            return [IfStmt(test, then_stmts, else_stmts, node.line)]
+        if taken is None:
+            self.report(test.line, "removed an 'if false' without else")
+            return []
+        if not declares(taken):
+            self.report(test.line, f"replaced 'if {stringify(value[1])}' with the branch that runs")
+            return taken.stmts
+        # The branch keeps its own scope, as an if whose test always holds
+        if dead is not None or not value[1]:
+            self.report(test.line, f"removed the branch of 'if {stringify(value[1])}' that never runs")
+        return [IfStmt(Bool(True, test.line), taken, None, node.line)]
+
+
+@deep
+def optimize(ast, strings, level=OPT_SAFE):
+    '''
+    Optimize a program, returning the new tree and the rewrites made
+    '''
+    if level <= OPT_NONE:
+        return ast, []
+    optimizer = Optimizer(strings, level)
+    return optimizer.optimize(ast), optimizer.rewrites
@@ -1,12 +1,81 @@
+from collections import deque
 from utils import *
 from tokens import *
 from model import *
+from strings import *
+
+
+class TokenBuffer:
+    '''
+    A small sliding window over a token iterator, so the parser can index the
+    tokens around its current position without holding the whole token list
+    '''
+    def __init__(self, tokens, size=16):
+        self.tokens = iter(tokens)
+        self.window = deque()
+        self.base = 0  # index of the oldest token still in the window
+        self.size = size
+
+    def has(self, index):
+        # Pull tokens from the iterator until index is inside the window
+        while index >= self.base + len(self.window):
+            token = next(self.tokens, None)
+            if token is None:
+                return False
+            self.window.append(token)
+            if len(self.window) > self.size:
+                self.window.popleft()
+                self.base += 1
+        return True
+
+    def __getitem__(self, index):
+        if index < self.base or not self.has(index):
+            raise IndexError(index)
+        return self.window[index - self.base]
+
+
+###############################################################################
+# Binding power of the binary operators, loosest first. All of them are left
+# associative except '^'. The unary operators bind more tightly than any of
+# them, so -2^2 is (-2)^2.
+###############################################################################
+PREC_OR       = 1   # or
+PREC_AND      = 2   # and
+PREC_EQUALITY = 3   # == ~=
+PREC_COMPARE  = 4   # > >= < <=
+PREC_ADD      = 5   # + -
+PREC_MULTIPLY = 6   # * /
+PREC_MODULO   = 7   # %
+PREC_EXPONENT = 8   # ^ (right associative)
+
+binary_precedence = {
+    TOK_OR    : PREC_OR,
+    TOK_AND   : PREC_AND,
+    TOK_EQEQ  : PREC_EQUALITY,
+    TOK_NE    : PREC_EQUALITY,
+    TOK_GT    : PREC_COMPARE,
+    TOK_GE    : PREC_COMPARE,
+    TOK_LT    : PREC_COMPARE,
+    TOK_LE    : PREC_COMPARE,
+    TOK_PLUS  : PREC_ADD,
+    TOK_MINUS : PREC_ADD,
+    TOK_STAR  : PREC_MULTIPLY,
+    TOK_SLASH : PREC_MULTIPLY,
+    TOK_MOD   : PREC_MODULO,
+    TOK_CARET : PREC_EXPONENT,
+}
+
+unary_operators = {TOK_NOT, TOK_MINUS, TOK_PLUS}
 
 
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
+    def __init__(self, tokens, strings=None):
+        # A list is indexed directly, anything else (e.g. Lexer.iter_tokens()) is streamed
+        self.stream = iter(tokens) is tokens
+        self.tokens = TokenBuffer(tokens) if self.stream else tokens
         self.curr = 0
+        # Names and string literals in the AST carry their id in this table
+        self.strings = StringTable() if strings is None else strings
 
     def advance(self):
         token = self.tokens[self.curr]
@@ -16,25 +85,34 @@ class Parser:
     def peek(self):
         return self.tokens[self.curr]
 
+    def at_end(self):
+        if self.stream:
+            return not self.tokens.has(self.curr)
+        return self.curr >= len(self.tokens)
+
     def is_next(self, expected_type):
-        if self.curr >= len(self.tokens):
+        if self.at_end():
             return False
         return self.peek().token_type == expected_type
 
     def expect(self, expected_type):
-        if self.curr >= len(self.tokens):
+        if self.at_end():
             parse_error(f'Found {self.previous_token().lexeme!r} at the end of parsing', self.previous_token().line)
         elif self.peek().token_type == expected_type:
             token = self.advance()
             return token
         else:
-            parse_error(f'Expected {expected_type!r}, found {self.peek().lexeme!r}.', self.peek().line)
+            parse_error(f'Expected {token_names[expected_type]!r}, found {self.peek().lexeme!r}.', self.peek().line)
 
     def previous_token(self):
         return self.tokens[self.curr - 1]
 
+    def intern(self, text):
+        sid = self.strings.intern(text)
+        return self.strings[sid], sid
+
     def match(self, expected_type):
-        if self.curr >= len(self.tokens):
+        if self.at_end():
             return False
         if self.peek().token_type != expected_type:
             return False
@@ -46,116 +124,72 @@ class Parser:
     #              |  <bool>
     #              |  <string>
     #              |  <identifier>
+    #              |  <identifier> '(' <args> ')'
     #              | '(' <expr> ')'
     def primary(self):
-        if self.match(TOK_INTEGER):
-            return Integer(int(self.previous_token().lexeme), line=self.previous_token().line)
-        elif self.match(TOK_FLOAT):
-            return Float(float(self.previous_token().lexeme), line=self.previous_token().line)
-        elif self.match(TOK_TRUE):
-            return Bool(True, line=self.previous_token().line)
-        elif self.match(TOK_FALSE):
-            return Bool(False, line=self.previous_token().line)
-        elif self.match(TOK_STRING):
-            return String(str(self.previous_token().lexeme[1:-1]),
-                        line=self.previous_token().line)  # Remove the quotes at the beginning and at the end of the lexeme
-        elif self.match(TOK_LPAREN):
+        if self.at_end():
+            self.expect(TOK_IDENTIFIER)  # reports the end of the input
+        token = self.advance()
+        token_type = token.token_type
+        if token_type == TOK_IDENTIFIER:
+            name, sid = self.intern(token.lexeme)
+            if self.match(TOK_LPAREN):
+                args = self.args()
+                self.expect(TOK_RPAREN)
+                return FuncCall(name, args, line=self.previous_token().line, sid=sid)
+            return Identifier(name, line=token.line, sid=sid)
+        elif token_type == TOK_INTEGER:
+            return Integer(int(token.lexeme), line=token.line)
+        elif token_type == TOK_FLOAT:
+            return Float(float(token.lexeme), line=token.line)
+        elif token_type == TOK_STRING:
+            value, sid = self.intern(token.lexeme[1:-1])  # Remove the quotes at the beginning and at the end of the lexeme
+            return String(value, line=token.line, sid=sid)
+        elif token_type == TOK_TRUE:
+            return Bool(True, line=token.line)
+        elif token_type == TOK_FALSE:
+            return Bool(False, line=token.line)
+        elif token_type == TOK_LPAREN:
             expr = self.expr()
             if (not self.match(TOK_RPAREN)):
                 parse_error(f'Error: ")" expected.', self.previous_token().line)
             else:
                 return Grouping(expr, line=self.previous_token().line)
         else:
-            identifier = self.expect(TOK_IDENTIFIER)
-            if self.match(TOK_LPAREN):
-                args = self.args()
-                self.expect(TOK_RPAREN)
-                return FuncCall(identifier.lexeme, args, line=self.previous_token().line)
-            else:
-                return Identifier(identifier.lexeme, line=self.previous_token().line)
+            self.curr -= 1
+            self.expect(TOK_IDENTIFIER)  # reports the unexpected token
 
     # <unary>  ::=  ('+'|'-'|'~') <unary>  |  <primary>
     def unary(self):
-        if self.match(TOK_NOT) or self.match(TOK_MINUS) or self.match(TOK_PLUS):
-            op = self.previous_token()
+        if not self.at_end() and self.peek().token_type in unary_operators:
+            op = self.advance()
             operand = self.unary()
             return UnOp(op, operand, line=op.line)
         return self.primary()
 
-    # <exponent> ::= <unary> ( "^" <unary> )*
-    def exponent(self):
-        expr = self.unary()
-        while self.match(TOK_CARET):
-            op = self.previous_token()
-            right = self.exponent()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    # <modulo> ::= <exponent> ( "%" <exponent> )*
-    def modulo(self):
-        expr = self.exponent()
-        while self.match(TOK_MOD):
-            op = self.previous_token()
-            right = self.exponent()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    # <multiplication>  ::=  <modulo> ( ('*'|'/') <modulo> )*
-    def multiplication(self):
-        expr = self.modulo()
-        while self.match(TOK_STAR) or self.match(TOK_SLASH):
-            op = self.previous_token()
-            right = self.modulo()
-            expr = BinOp(op, expr, right, op.line)
-        return expr
-
-    # <addition>  ::=  <multiplication> ( ('+'|'-') <multiplication> )*
-    def addition(self):
-        expr = self.multiplication()
-        while self.match(TOK_PLUS) or self.match(TOK_MINUS):
-            op = self.previous_token()
-            right = self.multiplication()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    # <comparison> ::= <addition> (( ">" | ">=" | "<" | "<=" ) <addition>)*
-    def comparison(self):
-        expr = self.addition()
-        while self.match(TOK_GT) or self.match(TOK_GE) or self.match(TOK_LT) or self.match(TOK_LE):
-            op = self.previous_token()
-            right = self.addition()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    # <equality>  ::=  <comparison> ( ( "~=" | "==" ) <comparison> )*
-    def equality(self):
-        expr = self.comparison()
-        while self.match(TOK_NE) or self.match(TOK_EQEQ):
-            op = self.previous_token()
-            right = self.comparison()
-            expr = BinOp(op, expr, right, line=op.line)
-        return expr
-
-    # <logical_and> ::= <equality> ( "and" <equality> )*
-    def logical_and(self):
-        expr = self.equality()
-        while self.match(TOK_AND):
-            op = self.previous_token()
-            right = self.equality()
-            expr = LogicalOp(op, expr, right, line=op.line)
-        return expr
-
-    # <logical_or> ::= <logical_and> ( "or" <logical_and> )*
-    def logical_or(self):
-        expr = self.logical_and()
-        while self.match(TOK_OR):
-            op = self.previous_token()
-            right = self.logical_and()
-            expr = LogicalOp(op, expr, right, line=op.line)
-        return expr
-
-    def expr(self):
-        return self.logical_or()
+    # <expr>  ::=  <unary> ( <binary_op> <unary> )*
+    #
+    # Precedence climbing over binary_precedence: each loop iteration takes an
+    # operator that binds at least as tightly as min_precedence, and parses its
+    # right operand with the operators that bind more tightly (or as tightly,
+    # for the right-associative '^')
+    def expr(self, min_precedence=PREC_OR):
+        left = self.unary()
+        while not self.at_end():
+            op = self.peek()
+            precedence = binary_precedence.get(op.token_type)
+            if precedence is None or precedence < min_precedence:
+                break
+            self.curr += 1
+            if precedence == PREC_EXPONENT:
+                right = self.expr(precedence)
+            else:
+                right = self.expr(precedence + 1)
+            if precedence <= PREC_AND:
+                left = LogicalOp(op, left, right, line=op.line)
+            else:
+                left = BinOp(op, left, right, line=op.line)
+        return left
     
     # <print_stmt> ::= "print" <expr>
     def print_stmt(self, end):
@@ -210,8 +244,8 @@ class Parser:
             param_count += 1
             if param_count > 255:
                 raise parse_error('Error: Maximum number of parameters exceeded.', self.previous_token().line)
-            name = self.expect(TOK_IDENTIFIER)
-            params.append(Param(name.lexeme, line=self.previous_token().line))
+            name, sid = self.intern(self.expect(TOK_IDENTIFIER).lexeme)
+            params.append(Param(name, line=self.previous_token().line, sid=sid))
             if not self.is_next(TOK_RPAREN):
                 self.expect(TOK_COMMA)
         return params
@@ -228,13 +262,13 @@ class Parser:
   # <func_decl>  ::=  "func" <name> "(" <params>? ")" <body_stmts> "end"
     def func_decl(self):
         self.expect(TOK_FUNC)
-        name = self.expect(TOK_IDENTIFIER)
+        name, sid = self.intern(self.expect(TOK_IDENTIFIER).lexeme)
         self.expect(TOK_LPAREN)
         params = self.params()
         self.expect(TOK_RPAREN)
         body_stmts = self.stmts()
         self.expect(TOK_END)
-        return FuncDecl(name.lexeme, params, body_stmts, line=self.previous_token().line)
+        return FuncDecl(name, params, body_stmts, line=self.previous_token().line, sid=sid)
 
     # <local_assign> ::= local <assign>
     def local_assign(self):
@@ -275,6 +309,8 @@ class Parser:
                 return Assignment(left, right, line=left.line)
             else:
                 # handle function call statement
+                if not isinstance(left, FuncCall):
+                    parse_error(f'Expected a function call or an assignment, found {left!r}.', left.line)
                 return FuncCallStmt(left)
 
 
@@ -283,17 +319,25 @@ class Parser:
     def stmts(self):
         stmts = []
         # loop all statements of the current block
-        while self.curr < len(self.tokens) and not self.is_next(TOK_ELSE) and not self.is_next(TOK_END):
+        while not self.at_end() and not self.is_next(TOK_ELSE) and not self.is_next(TOK_END):
             stmt = self.stmt()
             # print(f"Parsed {stmt}")  # for debugging purposes, print the parsed statement
             stmts.append(stmt)
         return Stmts(stmts, line=self.previous_token().line)
     
+    def iter_stmts(self):
+        '''
+        Yield the top-level statements one at a time, as soon as each one is parsed
+        '''
+        while not self.at_end() and not self.is_next(TOK_ELSE) and not self.is_next(TOK_END):
+            yield self.stmt()
+
     def program(self):
         stmts = self.stmts()
         # print("HIII")
         return stmts
     
+    @deep
     def parse(self):
         ast = self.program()
         return ast
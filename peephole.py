@@ -0,0 +1,136 @@
+from definitions import *
+
+###############################################################################
+# Peephole optimizer over the VM instruction stream, run between
+# Compiler.generate_code and VM.run
+#
+# Each pass looks at an instruction and the ones right before it, and the
+# passes repeat until one changes nothing. The rewrites keep what a program
+# prints and the runtime errors it reports:
+#
+#   - SET_SLOT, which only names a new local for print_code, is dropped
+#   - a LABEL that no instruction jumps to is dropped
+#   - code after a JMP, RTS, TAIL_JSR or HALT, up to the next label, can
+#     never run (like the PUSH 0; RTS epilogue after an explicit ret)
+#   - a JMP to the label right after it is dropped, and a JMPZ to it becomes
+#     a POP of the test
+#   - PUSH true; XOR, the code of ~x, becomes NOT
+#   - STORE_x n; LOAD_x n becomes TEE_x n, which stores the value and keeps it
+#     on the stack
+#
+# A label marks the start of a block that may be jumped to, so no rewrite
+# spans one: LABEL instructions are only dropped once nothing refers to them.
+# The source line of each instruction (Compiler.lines) is carried along, and a
+# fused instruction keeps the line of its first.
+###############################################################################
+
+# Opcodes with a label operand, and its index among the arguments
+LABEL_OPERANDS = {
+    'JMP': 0,
+    'JMPZ': 0,
+    'JSR': 0,
+    'TAIL_JSR': 0,
+    'MEMO_JSR': 0,
+    'FOR_PREP': 4,
+    'FOR_LOOP': 3,
+}
+
+# Opcodes after which the next instruction only runs if it is jumped to
+UNCONDITIONAL = {'JMP', 'RTS', 'TAIL_JSR', 'HALT'}
+
+TEE = {
+    'STORE_GLOBAL': ('LOAD_GLOBAL', 'TEE_GLOBAL'),
+    'STORE_LOCAL': ('LOAD_LOCAL', 'TEE_LOCAL'),
+}
+
+PUSH_TRUE = ('PUSH', (TYPE_BOOL, True))
+
+
+def referenced_labels(code):
+    labels = set()
+    for instruction in code:
+        index = LABEL_OPERANDS.get(instruction[0])
+        if index is not None:
+            labels.add(instruction[index + 1])
+    return labels
+
+
+def peephole_pass(code, lines, rewrites):
+    '''
+    One pass over code, returning the new code and its lines. Adds the number
+    of each kind of rewrite made to the rewrites dict.
+    '''
+    def rewrite(kind):
+        rewrites[kind] = rewrites.get(kind, 0) + 1
+
+    labels = referenced_labels(code)
+    out = []
+    out_lines = []  # the source line of each instruction of out
+    # Index in out of every instruction but the labels, so the last one before
+    # a run of labels is found without scanning the run. A dropped jump is set
+    # to None and removed at the end, as deleting it would move the run.
+    positions = []
+    dropped = False
+    reachable = True
+    for instruction, line in zip(code, lines):
+        opcode = instruction[0]
+        if opcode == 'LABEL':
+            label = instruction[1]
+            if label not in labels:
+                rewrite('unused label')
+                continue
+            reachable = True
+            # A jump to this label over nothing but other labels
+            i = positions[-1] if positions else -1
+            if i >= 0 and out[i] == ('JMP', label):
+                rewrite('jump to next')
+                out[i] = None
+                positions.pop()
+                dropped = True
+            elif i >= 0 and out[i] == ('JMPZ', label):
+                rewrite('jump to next')
+                out[i] = ('POP',)
+            out.append(instruction)
+            out_lines.append(line)
+            continue
+        if not reachable:
+            rewrite('unreachable')
+            continue
+        if opcode == 'SET_SLOT':
+            rewrite('set slot')
+            continue
+        previous = out[-1] if out else None
+        if opcode == 'XOR' and previous == PUSH_TRUE:
+            rewrite('not')
+            out[-1] = ('NOT',)
+            continue
+        if previous is not None and previous[0] in TEE:
+            load, tee = TEE[previous[0]]
+            if opcode == load and instruction[1] == previous[1]:
+                rewrite('store and load')
+                out[-1] = (tee, previous[1])
+                continue
+        positions.append(len(out))
+        out.append(instruction)
+        out_lines.append(line)
+        if opcode in UNCONDITIONAL:
+            reachable = False
+    if dropped:
+        kept = [i for i, instruction in enumerate(out) if instruction is not None]
+        return [out[i] for i in kept], [out_lines[i] for i in kept]
+    return out, out_lines
+
+
+def peephole(code, lines=None):
+    '''
+    Optimize the instructions of code until nothing changes. Returns the new
+    code, the source line of each of its instructions (None unless lines has
+    them for code) and a dict of the number of rewrites of each kind.
+    '''
+    rewrites = {}
+    new_lines = lines if lines is not None else [0] * len(code)
+    while True:
+        count = sum(rewrites.values())
+        code, new_lines = peephole_pass(code, new_lines, rewrites)
+        if sum(rewrites.values()) == count:
+            return code, (new_lines if lines is not None else None), rewrites
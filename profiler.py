@@ -0,0 +1,206 @@
+import time
+from collections import Counter
+from utils import *
+from model import *
+from interpreter import Interpreter
+
+###############################################################################
+# Source-level profiler of the tree-walking interpreter
+#
+# ProfilingInterpreter is an Interpreter that also records, for a run:
+#
+#   - each function declaration's calls, and its inclusive time (body and the
+#     calls it makes) and exclusive time (body only)
+#   - how many times each line ran: a statement counts once per run of it, and
+#     a while loop's line once per test
+#   - the time spent in each call stack, written out in the collapsed format
+#     of flamegraph.pl, speedscope and the like: '<main>;f;g 1234' per stack,
+#     with its exclusive time in microseconds
+#
+# Interpreter itself is untouched, so a run that is not profiled pays nothing.
+#
+# A call made in tail position replaces its caller on the stack, as it does
+# when it runs. A call whose result is memoized runs no body, and is not
+# counted, so memoization is off unless asked for.
+###############################################################################
+MAIN = '<main>'  # the program's own statements, outside of any function
+
+
+class FunctionProfile:
+    '''
+    Calls and time of one function declaration (or MAIN)
+    '''
+    __slots__ = ('name', 'line', 'label', 'calls', 'inclusive', 'exclusive', 'active')
+
+    def __init__(self, name, line, label):
+        self.name = name
+        self.line = line    # where its declaration ends, as for every FuncDecl
+        self.label = label  # its name, with the line if another declaration has the same name
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.active = 0     # runs of it on the stack, so recursion is timed once
+
+
+class Profile:
+    '''
+    What a profiled run spent, by function, by line and by call stack
+    '''
+    def __init__(self):
+        self.functions = {}      # FuncDecl (or MAIN) -> FunctionProfile
+        self.lines = Counter()   # line -> statements run on it
+        # Call stacks are numbered as they show up, so a deep recursion does
+        # not build a string per call: stack number -> exclusive seconds
+        self.stacks = Counter()
+        self.stack_ids = {}      # (caller's stack number or None, FunctionProfile) -> stack number
+        self.stack_keys = []     # stack number -> (caller's stack number or None, FunctionProfile)
+
+    def stack_id(self, caller, function):
+        key = (caller, function)
+        stack = self.stack_ids.get(key)
+        if stack is None:
+            stack = self.stack_ids[key] = len(self.stack_keys)
+            self.stack_keys.append(key)
+        return stack
+
+    def stack_name(self, stack):
+        '''
+        '<main>;f;g' for a stack number
+        '''
+        labels = []
+        while stack is not None:
+            stack, function = self.stack_keys[stack]
+            labels.append(function.label)
+        return ';'.join(reversed(labels))
+
+    def collapsed(self):
+        '''
+        The stacks and their exclusive time in microseconds, as flamegraph
+        tools read them
+        '''
+        lines = []
+        for stack, seconds in self.stacks.items():
+            micros = round(seconds * 1e6)
+            if micros > 0:
+                lines.append(f'{self.stack_name(stack)} {micros}')
+        return sorted(lines)
+
+    def write_collapsed(self, file):
+        for line in self.collapsed():
+            file.write(line + '\n')
+
+    def report(self, source_lines=None, top=20):
+        '''
+        The functions by exclusive time, then the most run lines, as text.
+        source_lines (the program's lines) shows what is on each line.
+        '''
+        total = sum(function.exclusive for function in self.functions.values()) or 1.0
+        out = [f"{'function':>20} {'calls':>9} {'incl s':>9} {'excl s':>9} {'excl %':>7}"]
+        for function in sorted(self.functions.values(), key=lambda function: -function.exclusive):
+            out.append(f"{function.label:>20} {function.calls:>9} {function.inclusive:>9.4f} "
+                       f"{function.exclusive:>9.4f} {function.exclusive / total:>7.1%}")
+        out.append('')
+        out.append(f"{'line':>6} {'hits':>10}")
+        for line, hits in sorted(self.lines.items(), key=lambda item: (-item[1], item[0]))[:top]:
+            text = ''
+            if source_lines is not None and 0 < line <= len(source_lines):
+                text = '  ' + source_lines[line - 1].strip()
+            out.append(f'{line:>6} {hits:>10}{text}')
+        return '\n'.join(out)
+
+
+class ProfilingInterpreter(Interpreter):
+    '''
+    Interpreter that profiles its run into self.profile
+    '''
+    def __init__(self, memoize=False, clock=time.perf_counter):
+        super().__init__(memoize)
+        self.clock = clock
+        self.profile = Profile()
+        self.bodies = {}  # body Stmts of a FuncDecl -> its FunctionProfile
+        self.lines = {}   # statement, or while test -> the line it counts for
+        self.stack = []   # [FunctionProfile, stack number, start, time in calls], innermost last
+
+    def collect(self, node):
+        '''
+        Find the function bodies and the statements of a tree ahead of the run
+        '''
+        if isinstance(node, Stmts):
+            for stmt in node.stmts:
+                self.collect(stmt)
+
+        elif isinstance(node, (PrintStmt, Assignment, LocalAssignment, RetStmt)):
+            self.lines[node] = node.line
+
+        elif isinstance(node, FuncCallStmt):
+            self.lines[node] = node.expr.line
+
+        elif isinstance(node, IfStmt):
+            # Its own line is the one of its 'end'
+            self.lines[node] = node.test.line
+            self.collect(node.then_stmts)
+            if node.else_stmts:
+                self.collect(node.else_stmts)
+
+        elif isinstance(node, WhileStmt):
+            self.lines[node.test] = node.test.line
+            self.collect(node.body_stmts)
+
+        elif isinstance(node, ForStmt):
+            self.lines[node] = node.ident.line
+            self.collect(node.body_stmts)
+
+        elif isinstance(node, FuncDecl):
+            self.bodies[node.body_stmts] = self.declare(node)
+            self.collect(node.body_stmts)
+
+    def declare(self, node):
+        function = FunctionProfile(node.name, node.line, node.name)
+        for other in self.profile.functions.values():
+            if other.name == node.name:
+                function.label = f'{node.name}@{node.line}'
+                other.label = f'{other.name}@{other.line}'
+        self.profile.functions[node] = function
+        return function
+
+    def interpret(self, node, env):
+        line = self.lines.get(node)
+        if line is not None:
+            self.profile.lines[line] += 1
+        function = self.bodies.get(node)
+        if function is None:
+            return Interpreter.interpret(self, node, env)
+        # A function body, run by call()
+        function.calls += 1
+        self.push(function)
+        try:
+            return Interpreter.interpret(self, node, env)
+        finally:
+            self.pop()
+
+    def push(self, function):
+        stack = self.profile.stack_id(self.stack[-1][1] if self.stack else None, function)
+        function.active += 1
+        self.stack.append([function, stack, self.clock(), 0.0])
+
+    def pop(self):
+        function, stack, start, in_calls = self.stack.pop()
+        elapsed = self.clock() - start
+        function.active -= 1
+        if not function.active:
+            function.inclusive += elapsed
+        function.exclusive += elapsed - in_calls
+        self.profile.stacks[stack] += elapsed - in_calls
+        if self.stack:
+            self.stack[-1][3] += elapsed
+
+    @deep
+    def interpret_ast(self, node, budget=None):
+        self.collect(node)
+        main = self.profile.functions[MAIN] = FunctionProfile(MAIN, 0, MAIN)
+        main.calls = 1
+        self.push(main)
+        try:
+            return super().interpret_ast(node, budget)
+        finally:
+            self.pop()
@@ -0,0 +1,229 @@
+from utils import *
+from model import *
+
+###############################################################################
+# Static scope resolution for the tree-walking interpreter
+#
+# Every block gets a frame (state.Frame) at run time only if it declares
+# something, and each declared name gets a slot in it. The resolver works out
+# the slots ahead of time, so the interpreter never looks names up by string.
+#
+# Scoping in Scripty is dynamic: 'x := v' updates the innermost x that is set
+# anywhere up the scope chain, and only creates x in the current block if
+# there is none. So an access resolves to its candidates: a (hops, slot) pair
+# for every enclosing block that may hold the name, innermost first. The list
+# is cut at the first block where the name is known to be set at that point
+# (definite), which for most accesses leaves a single candidate. A variable
+# that can only be in the innermost frame is reached by its bare slot number.
+#
+# Functions live in their own namespace and are resolved the same way. A call
+# whose name no block around it declares, but the program's, finds the same
+# function from anywhere: these are the global_calls (see callsites.py).
+###############################################################################
+VARS = 'var'
+FUNCS = 'func'
+
+
+class Scope:
+    '''
+    A block that gets a frame at run time
+    '''
+    __slots__ = ('slots', 'definite', 'depth')
+
+    def __init__(self, slots, depth):
+        self.slots = slots      # (namespace, name) -> slot number in the frame
+        self.definite = set()   # keys whose slot is known to be set at this point
+        self.depth = depth      # number of frames above this one
+
+
+class Resolver:
+    def __init__(self):
+        self.accesses = {}  # access node -> slot number or candidates
+        self.frames = {}    # block node -> size of its frame, for blocks that get one
+        self.declared = {}  # key -> open scopes that declare it, innermost last
+        self.global_calls = set()  # FuncCalls that can only reach a function of the global frame
+        self.scope = None   # innermost open scope
+
+    def is_definite(self, key):
+        for scope in reversed(self.declared.get(key, ())):
+            if key in scope.definite:
+                return True
+        return False
+
+    def candidates(self, key):
+        '''
+        The (hops, slot) pairs of the open scopes that may hold key
+        '''
+        candidates = []
+        for scope in reversed(self.declared.get(key, ())):
+            candidates.append((self.scope.depth - scope.depth, scope.slots[key]))
+            if key in scope.definite:
+                break
+        return tuple(candidates)
+
+    def access(self, key):
+        '''
+        How the interpreter reaches a variable: the bare slot number when it
+        can only be in the innermost frame, else its candidates
+        '''
+        candidates = self.candidates(key)
+        if len(candidates) == 1 and candidates[0][0] == 0:
+            return candidates[0][1]
+        return candidates
+
+    def open_scope(self, node, stmts, params=(), loop_var=None, force=False):
+        '''
+        Collect what a block declares, before resolving anything in it, so
+        that reads ahead of a declaration (in a loop) see it. Returns the
+        scope to restore on close_scope().
+        '''
+        slots = {}
+        definite = set()
+
+        def assign(key):
+            # Follows the run time rule of 'x := v', see Frame.set()
+            if key in definite or self.is_definite(key):
+                return
+            slots.setdefault(key, len(slots))
+            if not self.declared.get(key):
+                definite.add(key)
+
+        for param in params:
+            key = (VARS, param.name)
+            slots.setdefault(key, len(slots))
+            definite.add(key)
+        if loop_var is not None:
+            assign((VARS, loop_var.name))
+        for stmt in stmts:
+            if isinstance(stmt, LocalAssignment):
+                key = (VARS, stmt.left.name)
+                slots.setdefault(key, len(slots))
+                definite.add(key)
+            elif isinstance(stmt, Assignment):
+                assign((VARS, stmt.left.name))
+            elif isinstance(stmt, FuncDecl):
+                key = (FUNCS, stmt.name)
+                slots.setdefault(key, len(slots))
+                definite.add(key)
+
+        outer = self.scope
+        if slots or force:
+            # A block that declares nothing runs in the frame of its parent
+            self.scope = Scope(slots, 0 if outer is None else outer.depth + 1)
+            self.frames[node] = len(slots)
+            for key in slots:
+                self.declared.setdefault(key, []).append(self.scope)
+        return outer
+
+    def close_scope(self, outer):
+        if self.scope is not outer:
+            for key in self.scope.slots:
+                self.declared[key].pop()
+            self.scope = outer
+
+    def assign(self, node, key):
+        access = self.access(key)
+        self.accesses[node] = access
+        if type(access) is int:
+            # No other block may hold it, so it is set in this one from now on
+            self.scope.definite.add(key)
+
+    def block(self, node, stmts):
+        outer = self.open_scope(node, stmts.stmts)
+        self.resolve(stmts)
+        self.close_scope(outer)
+
+    def resolve_ast(self, node):
+        '''
+        Resolve a whole program, whose block always gets the global frame
+        '''
+        outer = self.open_scope(node, node.stmts, force=True)
+        self.resolve(node)
+        self.close_scope(outer)
+        return self.accesses, self.frames
+
+    def resolve(self, node):
+        if isinstance(node, Identifier):
+            self.accesses[node] = self.access((VARS, node.name))
+
+        elif isinstance(node, (Integer, Float, String, Bool)):
+            pass
+
+        elif isinstance(node, Grouping):
+            self.resolve(node.value)
+
+        elif isinstance(node, (BinOp, LogicalOp)):
+            self.resolve(node.left)
+            self.resolve(node.right)
+
+        elif isinstance(node, UnOp):
+            self.resolve(node.operand)
+
+        elif isinstance(node, LocalAssignment):
+            self.resolve(node.right)
+            key = (VARS, node.left.name)
+            self.accesses[node] = self.scope.slots[key]
+            self.scope.definite.add(key)
+
+        elif isinstance(node, Assignment):
+            # The value is evaluated before the name is assigned
+            self.resolve(node.right)
+            self.assign(node, (VARS, node.left.name))
+
+        elif isinstance(node, Stmts):
+            for stmt in node.stmts:
+                self.resolve(stmt)
+
+        elif isinstance(node, PrintStmt):
+            self.resolve(node.value)
+
+        elif isinstance(node, IfStmt):
+            self.resolve(node.test)
+            self.block(node.then_stmts, node.then_stmts)
+            if node.else_stmts:
+                self.block(node.else_stmts, node.else_stmts)
+
+        elif isinstance(node, WhileStmt):
+            # The test runs in the frame of the loop, like the body
+            outer = self.open_scope(node, node.body_stmts.stmts)
+            self.resolve(node.test)
+            self.resolve(node.body_stmts)
+            self.close_scope(outer)
+
+        elif isinstance(node, ForStmt):
+            # The bounds are evaluated outside the loop's frame
+            self.resolve(node.start)
+            self.resolve(node.end)
+            if node.step is not None:
+                self.resolve(node.step)
+            outer = self.open_scope(node, node.body_stmts.stmts, loop_var=node.ident)
+            self.assign(node.ident, (VARS, node.ident.name))
+            self.resolve(node.body_stmts)
+            self.close_scope(outer)
+
+        elif isinstance(node, FuncDecl):
+            key = (FUNCS, node.name)
+            self.accesses[node] = self.scope.slots[key]
+            # Set before the body can run, so recursive calls find it
+            self.scope.definite.add(key)
+            outer = self.open_scope(node, node.body_stmts.stmts, params=node.params)
+            for param in node.params:
+                self.accesses[param] = self.scope.slots[(VARS, param.name)]
+            self.resolve(node.body_stmts)
+            self.close_scope(outer)
+
+        elif isinstance(node, FuncCall):
+            for arg in node.args:
+                self.resolve(arg)
+            key = (FUNCS, node.name)
+            self.accesses[node] = self.candidates(key)
+            scopes = self.declared.get(key, ())
+            if len(scopes) == 1 and scopes[0].depth == 0:
+                self.global_calls.add(node)
+
+        elif isinstance(node, FuncCallStmt):
+            self.resolve(node.expr)
+
+        elif isinstance(node, RetStmt):
+            if node.value is not None:
+                self.resolve(node.value)
@@ -1,46 +1,275 @@
+import os
 import sys
+import argparse
 from tokens import *
 from lexer import *
 from parser import *
+from strings import *
+from flatast import *
+from cache import *
 from utils import *
 from interpreter import *
 from compiler import *
+from closures import *
+from optimizer import *
+from peephole import *
+from assembler import *
+from bytecode import *
+from memo import *
+from callsites import *
+from budget import *
+from profiler import *
 from vm import *
 
 VERBOSE = False
 
-if __name__ == "__main__":
-    if(len(sys.argv) < 2):
-        raise SystemExit("Usage: python {} <file_path>".format(sys.argv[0]))
-    
-    file_path = sys.argv[1]
+BACKEND_VM = 'vm'
+BACKEND_INTERPRETER = 'interpreter'
+BACKEND_CLOSURES = 'closures'
+
+
+def parse_script(file, args, strings):
+    '''
+    Parse the script, returning its AST and the FlatAST behind it (None
+    unless --flat)
+    '''
+    # Tokens are streamed from the file straight into the parser, and both
+    # intern names and string literals in one table
+    tokens = Lexer(file, engine=args.lexer, strings=strings).iter_tokens()
+    if args.flat:
+        # The rest of the pipeline walks the flat tree through its node views
+        flat = parse_flat(Parser(tokens, strings))
+        if args.debug:
+            verify_ast(flat.to_tree())
+        return flat.node(), flat
+    ast = Parser(tokens, strings).parse()
+    if args.debug:
+        verify_ast(ast)
+    return ast, None
+
+
+def optimize_script(ast, flat, args, strings):
+    '''
+    Run the optimizer over the parsed script at the level of -O, returning
+    the new AST and FlatAST like parse_script()
+    '''
+    if args.opt_level == OPT_NONE:
+        return ast, flat
+    ast, rewrites = optimize(flat.to_tree() if flat is not None else ast, strings, args.opt_level)
+    if args.opt_report:
+        print(f"{Colors.GREEN}Optimizer: {len(rewrites)} rewrites{Colors.WHITE}")
+        for line, description in rewrites:
+            print(f'  line {line}: {description}')
+    if args.debug:
+        verify_ast(ast)
+    if flat is not None:
+        flat = flatten(ast)
+        return flat.node(), flat
+    return ast, None
+
+
+def generate_vm_code(ast, args):
+    '''
+    Compile the AST for the VM, through the peephole optimizer unless
+    --no-peephole, and assemble it
+    '''
+    compiler = Compiler()
+    code = compiler.generate_code(ast)
+    lines = compiler.lines
+    if not args.no_peephole:
+        code, lines, rewrites = peephole(code, lines)
+        if args.opt_report:
+            print(f"{Colors.GREEN}Peephole: {len(compiler.code)} -> {len(code)} instructions{Colors.WHITE}")
+            for kind, count in sorted(rewrites.items()):
+                print(f'  {kind}: {count}')
+    return assemble(code, lines)
+
+
+def load_script(args):
+    '''
+    The AST of the script (None when only the VM needs the script and its code
+    is cached) and its assembled code (None unless the VM runs it)
+    '''
+    file_path = args.file_path
+    code = None
+    # --profile runs the interpreter, whatever the back end
+    run_vm = args.backend == BACKEND_VM and args.profile is None
+
+    if args.clear_cache:
+        clear_cache(file_path, args.cache_dir)
+    # VERBOSE and --opt-report show the front end at work, so they never use
+    # the cache. Only runs on the VM fill the cache, because they are the ones
+    # that need the code.
+    use_cache = not (args.no_cache or args.opt_report or VERBOSE)
+    key = source_key(file_path, args.opt_level, not args.no_peephole) if use_cache else None
+    cached = None if key is None else load_cache(file_path, key, args.cache_dir)
 
-    with open(file_path, 'r') as file:
-        source = file.read()
-        # print(f"Source code:\n{source}")
+    if cached is not None:
+        strings, flat, code = cached
+        ast = flat.to_tree() if not run_vm else None
+        if args.debug:
+            verify_ast(flat.to_tree())
+    else:
+        with open(file_path, 'r') as file:
+            strings = StringTable()
+            ast, flat = parse_script(file, args, strings)
+            ast, flat = optimize_script(ast, flat, args, strings)
+            if VERBOSE:
+                file.seek(0)
+                tokens = Lexer(file.read(), engine=args.lexer).tokenize()
+                print(f"{Colors.GREEN}LEXER:{Colors.WHITE}")
+                for token in tokens:
+                    print(token)
+                print(f"{Colors.GREEN}Parsed AST:{Colors.WHITE}")
+                print_pretty_ast(str(ast))
 
-        tokens = Lexer(source).tokenize()
-        ast = Parser(tokens).parse()
-        if VERBOSE:
-            print(f"{Colors.GREEN}LEXER:{Colors.WHITE}")
-            for token in tokens:
-                print(token)
-            print(f"{Colors.GREEN}Parsed AST:{Colors.WHITE}")
-            print_pretty_ast(str(ast))
+        if run_vm:
+            if VERBOSE:
+                print(f"{Colors.GREEN}*******************{Colors.WHITE}")
+                print(f"{Colors.GREEN}Code generation:{Colors.WHITE}")
+                print(f"{Colors.GREEN}*******************{Colors.WHITE}")
 
-        # interpreter = Interpreter()
-        # interpreter.interpret_ast(ast)
+            code = generate_vm_code(ast, args)
+            if key is not None:
+                store_cache(file_path, key, strings, flat if flat is not None else flatten(ast), code, args.cache_dir)
+    return ast, code
 
 
-        if VERBOSE:
-            print(f"{Colors.GREEN}*******************{Colors.WHITE}")
-            print(f"{Colors.GREEN}Code generation:{Colors.WHITE}")
-            print(f"{Colors.GREEN}*******************{Colors.WHITE}")
+def load_bytecode_script(args):
+    '''
+    The code of a bytecode file, which only the VM runs
+    '''
+    if args.backend != BACKEND_VM or args.profile is not None:
+        print(f"{Colors.RED}{args.file_path} is a bytecode file, which only runs on the VM back end.{Colors.WHITE}")
+        sys.exit(1)
+    try:
+        return load_bytecode(args.file_path)
+    except BytecodeError as e:
+        print(f"{Colors.RED}Error: {e}{Colors.WHITE}")
+        sys.exit(1)
 
-        compiler = Compiler()
-        code = compiler.generate_code(ast)
 
-        compiler.print_code()
+def run(args):
+    file_path = args.file_path
+    if file_path.endswith(BYTECODE_SUFFIX) or is_bytecode_file(file_path):
+        ast, code = None, load_bytecode_script(args)
+    else:
+        ast, code = load_script(args)
+
+    memoize = not args.no_memo
+    budget = None
+    if args.max_steps is not None or args.max_seconds is not None:
+        budget = Budget(args.max_steps, args.max_seconds)
+    if args.profile is not None:
+        # Every call is counted and timed, so no result is memoized
+        backend = ProfilingInterpreter(memoize=False)
+        result = backend.interpret_ast(ast, budget)
+        with open(args.profile, 'w') as file:
+            backend.profile.write_collapsed(file)
+        with open(file_path) as file:
+            source_lines = file.read().splitlines()
+        print(f"{Colors.GREEN}Profile (stacks written to {args.profile}):{Colors.WHITE}")
+        print(backend.profile.report(source_lines))
+    elif args.backend == BACKEND_INTERPRETER:
+        backend = Interpreter(memoize)
+        result = backend.interpret_ast(ast, budget)
+    elif args.backend == BACKEND_CLOSURES:
+        backend = ClosureInterpreter(memoize)
+        result = backend.interpret_ast(ast, budget)
+    else:
+        print_code(disassemble(code))
+
+        backend = VM(memoize)
+        result = backend.run(code, budget)
+    if args.memo_stats:
+        print(f"{Colors.GREEN}Memoized functions:{Colors.WHITE}")
+        print_memo_stats(backend.memo)
+    if args.call_stats and not isinstance(backend, VM):
+        print(f"{Colors.GREEN}Call sites:{Colors.WHITE}")
+        print_call_site_stats(backend.call_sites)
+    if result.status != RUN_DONE:
+        print(f"{Colors.RED}Stopped, {result.status} after {result.steps} steps and {result.seconds:.3f}s.{Colors.WHITE}")
+        sys.exit(2)
+
+
+def compile_script(args):
+    '''
+    Compile the script to a bytecode file (bytecode.py)
+    '''
+    with open(args.file_path, 'r') as file:
+        strings = StringTable()
+        ast, flat = parse_script(file, args, strings)
+        ast, flat = optimize_script(ast, flat, args, strings)
+    code = generate_vm_code(ast, args)
+    output = args.output or os.path.splitext(args.file_path)[0] + BYTECODE_SUFFIX
+    write_bytecode(output, code)
+    print(f"{Colors.GREEN}Wrote {output} ({len(code)} instructions).{Colors.WHITE}")
+
+
+def add_front_end_arguments(argparser):
+    '''
+    The options of parsing, optimizing and compiling a script
+    '''
+    argparser.add_argument('--lexer', choices=[ENGINE_REGEX, ENGINE_SCAN], default=ENGINE_REGEX,
+                           help='tokenizer engine (default: %(default)s)')
+    argparser.add_argument('--flat', action='store_true',
+                           help='parse into a flat array-backed AST')
+    argparser.add_argument('--debug', action='store_true',
+                           help='check the structure of the AST after parsing')
+    argparser.add_argument('-O', '--opt-level', type=int, choices=[OPT_NONE, OPT_SAFE, OPT_FAST_MATH], default=OPT_NONE,
+                           help='optimize the AST before running it: 1 folds constants, simplifies and removes dead '
+                                'branches, 2 also merges constant factors, which can change float rounding '
+                                '(default: %(default)s)')
+    argparser.add_argument('--opt-report', action='store_true',
+                           help='list the rewrites made by the optimizer')
+    argparser.add_argument('--no-peephole', action='store_true',
+                           help='run the VM code as the compiler generates it, without the peephole optimizer')
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ['compile']:
+        argparser = argparse.ArgumentParser(prog='scripty.py compile',
+                                            description='Compile a Scripty program to a bytecode file, which '
+                                                        'scripty.py runs on the VM without compiling it again')
+        argparser.add_argument('file_path')
+        argparser.add_argument('-o', '--output', default=None,
+                               help=f'the bytecode file (default: the script with the {BYTECODE_SUFFIX} suffix)')
+        add_front_end_arguments(argparser)
+        args = argparser.parse_args(sys.argv[2:])
+        run_deep(compile_script, args)
+        sys.exit(0)
+
+    argparser = argparse.ArgumentParser(description='Run a Scripty program, or a bytecode file made by '
+                                                    '"scripty.py compile"')
+    argparser.add_argument('file_path')
+    argparser.add_argument('--backend', choices=[BACKEND_VM, BACKEND_INTERPRETER, BACKEND_CLOSURES], default=BACKEND_VM,
+                           help='how to run the program: compile it for the VM, walk the AST, or walk it '
+                                'compiled to closures (default: %(default)s)')
+    add_front_end_arguments(argparser)
+    argparser.add_argument('--no-memo', action='store_true',
+                           help='do not keep the results of pure functions')
+    argparser.add_argument('--memo-stats', action='store_true',
+                           help='print the memo cache hits and misses of each pure function after the run')
+    argparser.add_argument('--call-stats', action='store_true',
+                           help='print the inline cache hits and misses of each function call after the run, '
+                                'on the interpreter and closures back ends')
+    argparser.add_argument('--max-steps', type=int, default=None,
+                           help='stop the program after this many steps: VM instructions, or loop iterations and '
+                                'calls on the other back ends')
+    argparser.add_argument('--max-seconds', type=float, default=None,
+                           help='stop the program after this many seconds')
+    argparser.add_argument('--profile', metavar='FILE', default=None,
+                           help='run on the interpreter back end, profiling the run: print the time of each '
+                                'function and the lines run most, and write the call stacks to FILE in the '
+                                'collapsed format of flamegraph tools. Pure functions are not memoized, so '
+                                'every call is counted')
+    argparser.add_argument('--no-cache', action='store_true',
+                           help='neither read nor write the compiled script cache')
+    argparser.add_argument('--clear-cache', action='store_true',
+                           help='delete the cached files of the cache directory before running')
+    argparser.add_argument('--cache-dir', default=None,
+                           help=f'where to keep the cache (default: {CACHE_DIR_NAME} next to the script)')
+    args = argparser.parse_args()
 
-        vm = VM()
-        vm.run(code)
\ No newline at end of file
+    # Deeply nested programs make the front end and the back ends recurse deeply
+    run_deep(run, args)
@@ -43,4 +43,41 @@ class Environment:
         '''
         Create a new child environment
         '''
-        return Environment(parent=self)  # create a new child environment
\ No newline at end of file
+        return Environment(parent=self)  # create a new child environment
+
+class Frame:
+    '''
+    Array-backed scope of the resolved interpreter. Names were turned into
+    slot numbers by the resolver (resolver.py), and a variable is reached
+    through its candidates: (hops, slot) pairs, innermost first, where hops
+    counts the frames to walk up. An empty slot holds None. A variable that
+    can only be in this frame is reached as slots[slot] directly.
+    '''
+    __slots__ = ('slots', 'parent')
+
+    def __init__(self, parent=None, size=0):
+        self.slots = [None] * size
+        self.parent = parent  # frame of the enclosing scope
+
+    def get(self, candidates):
+        for hops, slot in candidates:
+            frame = self
+            while hops:
+                frame = frame.parent
+                hops -= 1
+            value = frame.slots[slot]
+            if value is not None:
+                return value
+        return None  # not set in any of the scopes that declare it
+
+    def set(self, candidates, value):
+        for hops, slot in candidates:
+            frame = self
+            while hops:
+                frame = frame.parent
+                hops -= 1
+            if frame.slots[slot] is not None:
+                frame.slots[slot] = value  # update the innermost variable that is set
+                return
+        # Nothing set yet: the first candidate is always a slot of this frame
+        self.slots[candidates[0][1]] = value
@@ -0,0 +1,25 @@
+class StringTable:
+    '''
+    Per-compilation table of identifier names and string literals. Every
+    distinct string is stored once and gets a small integer id (sid), so the
+    lexer, the AST, the compiler and the VM all share the same string objects
+    and names can be compared by id.
+    '''
+    def __init__(self):
+        self.ids = {}  # string -> sid
+        self.strings = []  # sid -> string
+
+    def intern(self, text):
+        # Return the sid of text, adding it to the table the first time it is seen
+        sid = self.ids.get(text)
+        if sid is None:
+            sid = len(self.strings)
+            self.ids[text] = sid
+            self.strings.append(text)
+        return sid
+
+    def __getitem__(self, sid):
+        return self.strings[sid]
+
+    def __len__(self):
+        return len(self.strings)
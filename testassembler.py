@@ -0,0 +1,110 @@
+import io
+import re
+import pickle
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from compiler import *
+from peephole import *
+from assembler import *
+from vm import *
+from testpeephole import PATTERNS
+from testforloops import PROGRAMS as FOR_PROGRAMS
+
+SOURCE = 'x := 1\nfunc f(a)\n  if a > 1 then\n    ret a\n  end\n  ret 0\nend\nwhile x < 3 do\n  x := x + 1\nend\nprintln f(x)'
+
+
+def generate(source):
+    compiler = Compiler()
+    code = compiler.generate_code(Parser(Lexer(source).tokenize()).parse())
+    return code, compiler.lines
+
+
+def run(code):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        try:
+            VM().run(code)
+        except SystemExit:
+            pass
+    # Without the labels, errors are at other pcs
+    return re.sub(r'program counter \d+', 'program counter', output.getvalue())
+
+
+class TestAssembler(unittest.TestCase):
+    def test_labels_resolved(self):
+        code, lines = generate(SOURCE)
+        assembled = assemble(code, lines)
+        self.assertEqual(len(assembled), len([instruction for instruction in code if instruction[0] != 'LABEL']))
+        self.assertNotIn('LABEL', OPCODES)
+        for pc, op in enumerate(assembled.ops):
+            opcode = OPCODES[op]
+            index = LABEL_OPERANDS.get(opcode)
+            if index is not None:
+                target = assembled.args[pc][index]
+                self.assertIsInstance(target, int)
+                self.assertTrue(0 <= target < len(assembled))
+        # The function's first instruction is where its label was
+        target, name = assembled.args[list(assembled.ops).index(OPCODE['MEMO_JSR'])]
+        self.assertEqual(name, 'f')
+        self.assertIn('f', assembled.labels[target])
+
+    def test_lines(self):
+        code, lines = generate(SOURCE)
+        assembled = assemble(code, lines)
+        by_opcode = {}
+        for pc, op in enumerate(assembled.ops):
+            by_opcode.setdefault(OPCODES[op], []).append(assembled.lines[pc])
+        self.assertEqual(by_opcode['GT'], [3])
+        # The implicit ret 0 is on the line of the end of the function
+        self.assertEqual(by_opcode['RTS'], [4, 6, 7])
+        self.assertEqual(by_opcode['LT'], [8])
+        self.assertEqual(by_opcode['PRINTLN'], [11])
+        # The jump back of the loop is on the line of the while
+        self.assertEqual(by_opcode['JMP'][-1], 8)
+
+    def test_lines_after_peephole(self):
+        code, lines = generate('x := 1\ny := 2\n\nprintln x')
+        optimized, optimized_lines, rewrites = peephole(code, lines)
+        self.assertEqual(len(optimized_lines), len(optimized))
+        assembled = assemble(optimized, optimized_lines)
+        self.assertEqual([(OPCODES[op], line) for op, line in zip(assembled.ops, assembled.lines)],
+                         [('PUSH', 1), ('STORE_GLOBAL', 1), ('PUSH', 2), ('STORE_GLOBAL', 2), ('LOAD_GLOBAL', 4),
+                          ('PRINTLN', 4), ('HALT', 0)])
+
+    def test_disassemble(self):
+        for source in PATTERNS + [SOURCE]:
+            with self.subTest(source=source):
+                code, lines = generate(source)
+                # Labels that share a pc all come back, but each jump names the first of them
+                assembled = assemble(code)
+                disassembled = disassemble(assembled)
+                self.assertEqual([instruction for instruction in disassembled if instruction[0] == 'LABEL'],
+                                 [instruction for instruction in code if instruction[0] == 'LABEL'])
+                reassembled = assemble(disassembled)
+                self.assertEqual((reassembled.ops, reassembled.args), (assembled.ops, assembled.args))
+
+    def test_same_output(self):
+        sources = PATTERNS + [SOURCE] + [source for source, expected in FOR_PROGRAMS if 'g()' not in source]
+        for source in sources:
+            with self.subTest(source=source):
+                code, lines = generate(source)
+                assembled = assemble(*peephole(code, lines)[:2])
+                self.assertEqual(run(assembled), run(code))
+
+    def test_pickle(self):
+        code, lines = generate(SOURCE)
+        assembled = assemble(code, lines)
+        loaded = pickle.loads(pickle.dumps(assembled, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((loaded.ops, loaded.args, loaded.labels), (assembled.ops, assembled.args, assembled.labels))
+        self.assertEqual(loaded.lines, assembled.lines)
+        self.assertEqual(run(loaded), run(assembled))
+
+    def test_undefined_label(self):
+        with redirect_stdout(io.StringIO()):
+            self.assertRaises(SystemExit, assemble, [('JMP', 'nowhere'), ('HALT',)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from interpreter import *
+from closures import *
+from compiler import *
+from vm import *
+from budget import *
+from testhelpers import *
+
+# Programs that never end, each through something else: a loop, a counted
+# loop too long to finish, calls in tail position and plain recursion
+RUNAWAY = [
+    'i := 0\nwhile true do\n  i := i + 1\nend',
+    'x := 0\nfor i := 1, 1000000000 do\n  x := x + i\nend',
+    'func loop(n)\n  ret loop(n + 1)\nend\nloop(0)',
+    'func f(n)\n  if n > 0 then\n    f(n - 1)\n  end\n  f(n)\nend\nf(3)',
+]
+
+COUNT = 'i := 0\nwhile i < 50 do\n  println i\n  i := i + 1\nend\nprintln "done"'
+
+
+class TestBudget(unittest.TestCase):
+    def test_check_every(self):
+        budget = Budget(max_steps=2500, check_every=1000)
+        budget.start()
+        for _ in range(2500):
+            budget.tick()
+        with self.assertRaises(OutOfBudget) as context:
+            budget.tick()
+        self.assertEqual((context.exception.status, budget.steps), (RUN_OUT_OF_STEPS, 2500))
+
+    def test_no_steps(self):
+        budget = Budget(max_steps=0)
+        budget.start()
+        self.assertRaises(OutOfBudget, budget.tick)
+
+
+class TestBackendBudgets(unittest.TestCase):
+    backends = [Interpreter, ClosureInterpreter, VM]
+
+    def test_runaway(self):
+        for backend in self.backends:
+            for source in RUNAWAY:
+                with self.subTest(backend=backend.__name__, source=source):
+                    output, _, result = run_backend(backend, source, budget=Budget(max_steps=5000))
+                    self.assertEqual((result.status, result.steps), (RUN_OUT_OF_STEPS, 5000))
+                    self.assertEqual(result.resumable, backend is VM)
+                    output, _, result = run_backend(backend, source, budget=Budget(max_seconds=0.05))
+                    self.assertEqual(result.status, RUN_OUT_OF_TIME)
+                    self.assertGreaterEqual(result.seconds, 0.05)
+
+    def test_within_budget(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.__name__):
+                expected, _, result = run_backend(backend, COUNT, budget=None)
+                self.assertEqual((result.status, result.steps), (RUN_DONE, None))
+                output, _, result = run_backend(backend, COUNT, budget=Budget(max_steps=100000, max_seconds=60))
+                self.assertEqual((output, result.status, result.resumable), (expected, RUN_DONE, False))
+                self.assertLess(result.steps, 100000)
+
+    def test_resume(self):
+        code = Compiler().generate_code(parse(COUNT))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            total = VM().run(code, Budget()).steps
+            output.truncate(0)
+            output.seek(0)
+            vm = VM()
+            results = [vm.run(code, Budget(max_steps=7))]
+            while results[-1].status != RUN_DONE:
+                results.append(vm.resume(Budget(max_steps=7)))
+        self.assertEqual(output.getvalue(), ''.join(f'{i}\n' for i in range(50)) + 'done\n')
+        self.assertEqual(sum(result.steps for result in results), total)
+        self.assertEqual(len(results), -(-total // 7))
+        self.assertTrue(all(result.resumable for result in results[:-1]))
+
+    def test_time_slices(self):
+        # Two programs take turns on the same thread, a slice each
+        sources = ['i := 0\nwhile i < 3 do\n  println "a"\n  i := i + 1\nend',
+                   'i := 0\nwhile i < 3 do\n  println "b"\n  i := i + 1\nend']
+        vms = [VM() for _ in sources]
+        codes = [Compiler().generate_code(parse(source)) for source in sources]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            results = [vm.run(code, Budget(max_steps=12)) for vm, code in zip(vms, codes)]
+            while any(result.status != RUN_DONE for result in results):
+                results = [vm.resume(Budget(max_steps=12)) for vm in vms]
+        lines = output.getvalue().split()
+        self.assertEqual(sorted(lines), ['a', 'a', 'a', 'b', 'b', 'b'])
+        # The second one started before the first one was done
+        self.assertLess(lines.index('b'), len(lines) - 1 - lines[::-1].index('a'))
+
+
+if __name__ == "__main__":
+    unittest.main()
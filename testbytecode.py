@@ -0,0 +1,146 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from compiler import *
+from peephole import *
+from assembler import *
+from bytecode import *
+from vm import *
+from testpeephole import PATTERNS
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(ROOT_DIR, 'scripts')
+SCRIPTS = ['factorial.scedu', 'functions.scredu', 'locals.scredu', 'localvar.scredu', 'stress.scredu']
+
+
+def build(source):
+    compiler = Compiler()
+    code = compiler.generate_code(Parser(Lexer(source).tokenize()).parse())
+    return assemble(*peephole(code, compiler.lines)[:2])
+
+
+def read_script(name):
+    with open(os.path.join(SCRIPTS_DIR, name)) as file:
+        return file.read()
+
+
+def run(code):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        try:
+            VM().run(code)
+        except SystemExit:
+            pass
+    return output.getvalue()
+
+
+class TestBytecode(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'program' + BYTECODE_SUFFIX)
+
+    def write(self, code):
+        write_bytecode(self.path, code)
+        return load_bytecode(self.path)
+
+    def test_round_trip(self):
+        sources = PATTERNS + [read_script(name) for name in SCRIPTS]
+        for source in sources:
+            with self.subTest(source=source[:40]):
+                code = build(source)
+                loaded = self.write(code)
+                self.assertEqual(list(loaded.ops), list(code.ops))
+                self.assertEqual(loaded.args, code.args)
+                self.assertEqual(loaded.labels, code.labels)
+                self.assertEqual(list(loaded.lines), list(code.lines))
+                self.assertEqual(disassemble(loaded), disassemble(code))
+                self.assertEqual(run(loaded), run(code))
+
+    def test_constant_types(self):
+        # Values that compare equal but print or behave differently stay apart
+        code = Code(array('B', [OPCODE['HALT']] * 6),
+                    ((1.0,), (1,), (True,), (-0.0,), ((TYPE_NUMBER, 1),), ((TYPE_NUMBER, 1.0),)), {}, array('i', [0] * 6))
+        loaded = self.write(code)
+        for value, expected in zip(loaded.args, code.args):
+            self.assertEqual(repr(value), repr(expected))
+        self.assertIs(type(loaded.args[1][0]), int)
+
+    def test_big_integers(self):
+        # Integer literals of any size, beyond the 64 bits of K_INT
+        values = (2 ** 63 - 1, -2 ** 63, 2 ** 63, -2 ** 63 - 1, 99999999999999999999999)
+        code = Code(array('B', [OPCODE['HALT']] * len(values)), tuple((value,) for value in values),
+                    {}, array('i', [0] * len(values)))
+        loaded = self.write(code)
+        self.assertEqual(loaded.args, code.args)
+
+    def test_is_bytecode_file(self):
+        self.write(build('println 1'))
+        self.assertTrue(is_bytecode_file(self.path))
+        self.assertFalse(is_bytecode_file(os.path.join(SCRIPTS_DIR, 'functions.scredu')))
+        self.assertFalse(is_bytecode_file(os.path.join(self.dir, 'missing')))
+
+    def damaged(self, change):
+        write_bytecode(self.path, build('x := 1\nprintln x + 1'))
+        with open(self.path, 'rb') as file:
+            data = bytearray(file.read())
+        with open(self.path, 'wb') as file:
+            file.write(change(data))
+        with self.assertRaises(BytecodeError) as context:
+            load_bytecode(self.path)
+        return str(context.exception)
+
+    def test_rejected(self):
+        def flip(offset):
+            def change(data):
+                data[offset] ^= 0xff
+                return data
+            return change
+
+        self.assertIn('not a Scripty bytecode file', self.damaged(lambda data: b''))
+        self.assertIn('not a Scripty bytecode file', self.damaged(lambda data: data[:10]))
+        self.assertIn('not a Scripty bytecode file', self.damaged(flip(0)))
+        # Format and compiler version
+        self.assertIn('another version', self.damaged(flip(8)))
+        self.assertIn('another version', self.damaged(flip(10)))
+        # The opcode table
+        self.assertIn('another version', self.damaged(flip(12)))
+        self.assertIn('damaged', self.damaged(lambda data: data[:-1]))
+        self.assertIn('damaged', self.damaged(lambda data: data + b'\0'))
+        self.assertIn('damaged', self.damaged(flip(HEADER.size + 3)))
+        self.assertIn('damaged', self.damaged(flip(-1)))
+
+    def test_command(self):
+        script = os.path.join(self.dir, 'functions.scredu')
+        shutil.copy(os.path.join(SCRIPTS_DIR, 'functions.scredu'), script)
+        result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'scripty.py'), 'compile', script],
+                                capture_output=True, text=True, cwd=self.dir)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        path = os.path.join(self.dir, 'functions' + BYTECODE_SUFFIX)
+        self.assertTrue(is_bytecode_file(path))
+        # The source is not needed any more
+        os.remove(script)
+        result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'scripty.py'), path],
+                                capture_output=True, text=True, cwd=self.dir)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        expected = run(build(read_script('functions.scredu')))
+        self.assertTrue(result.stdout.endswith(expected))
+
+        with open(path, 'r+b') as file:
+            file.seek(-1, os.SEEK_END)
+            file.write(b'\xff')
+        result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'scripty.py'), path],
+                                capture_output=True, text=True, cwd=self.dir)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn('damaged', result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
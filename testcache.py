@@ -0,0 +1,196 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+import cache
+from lexer import *
+from parser import *
+from strings import *
+from flatast import *
+from compiler import *
+from peephole import *
+from assembler import *
+from cache import *
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(ROOT_DIR, 'scripts')
+
+
+def build(path):
+    strings = StringTable()
+    with open(path) as file:
+        ast = Parser(Lexer(file, strings=strings).iter_tokens(), strings).parse()
+    compiler = Compiler()
+    code = compiler.generate_code(ast)
+    return strings, flatten(ast), assemble(*peephole(code, compiler.lines)[:2])
+
+
+def same_code(first, second):
+    return ((list(first.ops), first.args, first.labels, list(first.lines)) ==
+            (list(second.ops), second.args, second.labels, list(second.lines)))
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.script = os.path.join(self.dir, 'functions.scredu')
+        shutil.copy(os.path.join(SCRIPTS_DIR, 'functions.scredu'), self.script)
+
+    def store(self, path=None, cache_dir=None):
+        path = path or self.script
+        key = source_key(path)
+        strings, flat, code = build(path)
+        store_cache(path, key, strings, flat, code, cache_dir)
+        return key, code
+
+    def test_round_trip(self):
+        key, code = self.store()
+        self.assertTrue(os.path.exists(os.path.join(self.dir, CACHE_DIR_NAME, 'functions.scredu.cache')))
+        strings, flat, cached_code = load_cache(self.script, key)
+        expected_strings, expected_flat, _ = build(self.script)
+        self.assertTrue(same_code(cached_code, code))
+        self.assertEqual(strings.strings, expected_strings.strings)
+        self.assertEqual(strings.ids, expected_strings.ids)
+        self.assertEqual(repr(flat.to_tree()), repr(expected_flat.to_tree()))
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self.dir, 'elsewhere')
+        key, code = self.store(cache_dir=cache_dir)
+        self.assertIsNone(load_cache(self.script, key))
+        self.assertTrue(same_code(load_cache(self.script, key, cache_dir)[2], code))
+
+    def test_source_change_is_a_miss(self):
+        key, _ = self.store()
+        with open(self.script, 'a') as file:
+            file.write('println 1\n')
+        self.assertNotEqual(source_key(self.script), key)
+        self.assertIsNone(load_cache(self.script, source_key(self.script)))
+
+    def test_compiler_version_change_is_a_miss(self):
+        key, _ = self.store()
+        with mock.patch.object(cache, 'COMPILER_VERSION', COMPILER_VERSION + 1):
+            new_key = source_key(self.script)
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(load_cache(self.script, new_key))
+
+    def test_corrupt_file_is_a_miss(self):
+        key, _ = self.store()
+        path = cache_path(self.script)
+        with open(path, 'rb') as file:
+            data = file.read()
+        for corrupt in (data[:len(data) // 2], data[:20], b'', b'garbage\n' + data,
+                        data[:-40] + b'\x00' * 40):
+            with open(path, 'wb') as file:
+                file.write(corrupt)
+            self.assertIsNone(load_cache(self.script, key))
+
+    def test_no_code_is_loaded(self):
+        # A planted pickle that would create a file when unpickled
+        key, _ = self.store()
+        marker = os.path.join(self.dir, 'planted')
+        payload = b'cos\nmkdir\n(S' + repr(marker).encode() + b'\ntR.'
+        with open(cache_path(self.script), 'wb') as file:
+            file.write(CACHE_MAGIC + key + b'\n' + payload)
+        self.assertIsNone(load_cache(self.script, key))
+        self.assertFalse(os.path.exists(marker))
+
+    def test_flat_arrays(self):
+        key, _ = self.store()
+        flat = load_cache(self.script, key)[1]
+        _, expected, _ = build(self.script)
+        for name in FLAT_ARRAYS:
+            self.assertEqual(getattr(flat, name), getattr(expected, name))
+        self.assertEqual((flat.values, flat.value_index, flat.root), (expected.values, expected.value_index, expected.root))
+
+    def test_unwritable_cache_is_skipped(self):
+        blocker = os.path.join(self.dir, 'file')
+        open(blocker, 'w').close()
+        # The cache directory cannot be created under a regular file
+        self.store(cache_dir=os.path.join(blocker, 'cache'))
+
+    def test_clear_cache(self):
+        self.store()
+        other = os.path.join(self.dir, CACHE_DIR_NAME, 'notes.txt')
+        open(other, 'w').close()
+        clear_cache(self.script)
+        self.assertEqual(os.listdir(os.path.join(self.dir, CACHE_DIR_NAME)), ['notes.txt'])
+        os.remove(other)
+        self.store()
+        clear_cache(self.script)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, CACHE_DIR_NAME)))
+
+    def test_clear_cache_keeps_foreign_files(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        self.store(cache_dir=cache_dir)
+        # An interrupted store leaves a temporary file behind
+        with open(os.path.join(cache_dir, CACHE_TEMP_PREFIX + 'x.tmp'), 'wb') as file:
+            file.write(CACHE_MAGIC)
+        foreign = ['notes.tmp', 'browser.cache', CACHE_TEMP_PREFIX + 'y.tmp']
+        for name in foreign:
+            with open(os.path.join(cache_dir, name), 'w') as file:
+                file.write('not a cache\n')
+        clear_cache(self.script, cache_dir)
+        self.assertEqual(sorted(os.listdir(cache_dir)), sorted(foreign))
+        clear_cache(self.script, cache_dir)
+        self.assertEqual(sorted(os.listdir(cache_dir)), sorted(foreign))
+
+
+class TestScriptyCache(unittest.TestCase):
+    def scripty(self, *args):
+        result = subprocess.run([sys.executable, os.path.join(ROOT_DIR, 'scripty.py'), *args],
+                                capture_output=True, text=True)
+        return result.stdout
+
+    def test_cold_and_warm_runs_match(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            for name in ('algol.scredu', 'functions.scredu', 'locals.scredu', 'myscript1.scredu'):
+                with self.subTest(script=name):
+                    script = os.path.join(SCRIPTS_DIR, name)
+                    expected = self.scripty(script, '--no-cache')
+                    self.assertEqual(self.scripty(script, '--cache-dir', cache_dir), expected)
+                    self.assertEqual(self.scripty(script, '--cache-dir', cache_dir), expected)
+                    self.assertEqual(self.scripty(script, '--cache-dir', cache_dir, '--flat', '--debug'), expected)
+            # myscript1.scredu does not parse, so nothing is cached for it
+            self.assertEqual(sorted(os.listdir(cache_dir)),
+                             ['algol.scredu.cache', 'functions.scredu.cache', 'locals.scredu.cache'])
+            with open(os.path.join(cache_dir, 'notes.tmp'), 'w') as file:
+                file.write('notes\n')
+            self.scripty(os.path.join(SCRIPTS_DIR, 'locals.scredu'), '--cache-dir', cache_dir, '--clear-cache', '--no-cache')
+            # Only the cache files go, the directory given with --cache-dir and
+            # the files of others stay
+            self.assertEqual(os.listdir(cache_dir), ['notes.tmp'])
+
+    def test_huge_literal(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            script = os.path.join(temp_dir, 'huge.scredu')
+            with open(script, 'w') as file:
+                file.write('x := 99999999999999999999999\nprintln x\n')
+            expected = self.scripty(script, '--no-cache')
+            self.assertEqual(self.scripty(script, '--cache-dir', cache_dir), expected)
+            self.assertEqual(os.listdir(cache_dir), ['huge.scredu.cache'])
+            self.assertEqual(self.scripty(script, '--cache-dir', cache_dir), expected)
+
+    def test_profile_after_cached_run(self):
+        # The cache keeps no AST for the VM, which --profile needs to run
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_dir = os.path.join(temp_dir, 'cache')
+            script = os.path.join(temp_dir, 'square.scredu')
+            with open(script, 'w') as file:
+                file.write('func square(n)\n  ret n * n\nend\ni := 0\nx := 0\nwhile i < 50 do\n  x := square(3)\n'
+                           '  i := i + 1\nend\nprintln x\n')
+            self.scripty(script, '--cache-dir', cache_dir)
+            self.assertTrue(os.listdir(cache_dir))
+            output = self.scripty(script, '--cache-dir', cache_dir, '--profile', os.path.join(temp_dir, 'stacks.txt'))
+            self.assertIn('9', output)
+            # square is pure, but every call of it is counted
+            self.assertRegex(output, r'square +50 ')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from lexer import *
+from parser import *
+from interpreter import *
+from closures import *
+from flatast import *
+from callsites import *
+from testhelpers import *
+
+LOOP = 'func f(n)\n  ret n + 1\nend\ni := 0\nwhile i < 10 do\n  i := f(i)\nend\nprintln i'
+
+# Programs whose calls reach another function after a (re)declaration, with their output
+PROGRAMS = [
+    (LOOP, '10\n'),
+    # Redeclared in the global scope, between two runs of the same call
+    ('func f()\n  ret 1\nend\ni := 0\nwhile i < 2 do\n  println f()\n  func f()\n    ret 2\n  end\n  i := i + 1\nend',
+     '1\n2\n'),
+    # Declared again in an inner scope: the same call means one or the other
+    ('func f()\n  ret "outer"\nend\nfunc g(inner)\n  if inner then\n    func f()\n      ret "inner"\n    end\n'
+     '    ret f()\n  end\n  ret f()\nend\nprintln g(false)\nprintln g(true)\nprintln g(false)', 'outer\ninner\nouter\n'),
+    ('func f()\n  ret 1\nend\nfunc g()\n  println f()\nend\nfunc h()\n  func f()\n    ret 2\n  end\n  g()\nend\ng()\nh()\ng()',
+     '1\n1\n1\n'),
+    # Declared on each call, closing over that call's frame
+    ('func make(n)\n  func get()\n    ret n\n  end\n  ret get()\nend\nprintln make(1)\nprintln make(2)', '1\n2\n'),
+    # A redeclaration with another arity is checked again
+    ('func f(a)\n  ret a\nend\nprintln f(1)\nfunc f(a, b)\n  ret b\nend\nprintln f(1)', '1\n'),
+    ('i := 0\nwhile i < 2 do\n  if i == 1 then\n    func f()\n      ret 1\n    end\n  end\n  println f()\n  i := i + 1\nend', ''),
+]
+
+
+class TestInterpreterCallSites(unittest.TestCase):
+    interpreter_class = Interpreter
+
+    def test_programs(self):
+        for source, expected in PROGRAMS:
+            for flat in [False, True]:
+                with self.subTest(source=source, flat=flat):
+                    output, interpreter, result = run_backend(self.interpreter_class, source, flat)
+                    self.assertTrue(output.startswith(expected))
+
+    def test_errors(self):
+        output, interpreter, result = run_backend(self.interpreter_class, PROGRAMS[5][0])
+        self.assertIn('expects 2 arguments, but got 1', output)
+        output, interpreter, result = run_backend(self.interpreter_class, PROGRAMS[6][0])
+        self.assertIn('Function f not declared', output)
+
+    def test_stats(self):
+        output, interpreter, result = run_backend(self.interpreter_class, LOOP)
+        stats = call_site_stats(interpreter.call_sites)
+        self.assertEqual(stats, {'hits': 9, 'misses': 1, 'sites': [
+            {'name': 'f', 'line': 6, 'global': True, 'hits': 9, 'misses': 1}]})
+
+    def test_redeclaration_misses(self):
+        output, interpreter, result = run_backend(self.interpreter_class, PROGRAMS[1][0])
+        self.assertEqual(call_site_stats(interpreter.call_sites)['misses'], 2)
+        # Only the call in the block that declares the inner f depends on its scope
+        output, interpreter, result = run_backend(self.interpreter_class, PROGRAMS[2][0])
+        self.assertEqual([site['global'] for site in call_site_stats(interpreter.call_sites)['sites']], [False, True, True, True, True])
+
+    def test_other_declarations_hit(self):
+        # A helper declared on each run of the loop body leaves the call of f cached
+        source = ('func f(n)\n  ret n + 1\nend\ni := 0\nwhile i < 10 do\n  func helper()\n    ret 0\n  end\n'
+                  '  i := f(i) + helper()\nend\nprintln i')
+        output, interpreter, result = run_backend(self.interpreter_class, source)
+        self.assertEqual(output, '10\n')
+        stats = {site['name']: (site['hits'], site['misses']) for site in call_site_stats(interpreter.call_sites)['sites']}
+        self.assertEqual(stats['f'], (9, 1))
+        self.assertEqual(stats['helper'], (0, 10))
+
+
+class TestClosureCallSites(TestInterpreterCallSites):
+    interpreter_class = ClosureInterpreter
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import unittest
+from lexer import *
+from parser import *
+from interpreter import *
+from closures import *
+from flatast import *
+from testhelpers import *
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+# Small programs covering every node type, the operator type rules and the
+# runtime errors. Each one must print the same with both back ends.
+PROGRAMS = [
+    'println 1 + 2 * 3 - 4 / 8 % 3 ^ 2',
+    'println "a" + 1 + true\nprintln 1 + "b"\nprintln false + "c"',
+    'println "abc" < "abd"\nprintln "b" >= "a"\nprintln 2 > 1\nprintln 2 <= 1',
+    'println true == true\nprintln true ~= false\nprintln "x" == "x"\nprintln 1 == 1.0',
+    'println 1 or 2\nprintln 0 or "x"\nprintln false and 1\nprintln 1 and "y"',
+    'println -(2) + +3\nprintln ~true\nprintln ~(1 > 2)',
+    'x := 10\nprintln x / 4\nprintln 2 ^ 0.5\nprintln 7 % 2.5',
+    'println 1 / 0',
+    'println 1 / false',
+    'x := 0\nprintln 1 / x',
+    'println true + 1',
+    'println "a" - 1',
+    'println true < false',
+    'println 1 == "1"',
+    'println -"a"',
+    'println ~1',
+    'println +true',
+    'println y',
+    'f(1)',
+    'func f(a)\n  ret a\nend\nf(1, 2)',
+    'if 1 then\n  println 1\nend',
+    'while "a" do\nend',
+    'x := 1\nif x > 0 then\n  x := x + 1\n  y := 5\nelse\n  x := 0\nend\nprintln x\nprintln y',
+    'i := 0\nwhile i < 5 do\n  i := i + 1\n  if i == 3 then\n    println "three"\n  end\nend\nprintln i',
+    'for i := 1, 5 do\n  println i\nend',
+    'for i := 5, 1 do\n  println i\nend',
+    'for i := 1, 10, 3 do\n  println i\nend\nfor i := 10, 1, -4 do\n  println i\nend',
+    'for i := 2, 2 do\n  println i\nend\nprintln i',
+    'total := 0\nfor i := 1, 3 do\n  for j := 1, i do\n    total := total + i * j\n  end\nend\nprintln total',
+    'func fact(n)\n  if n <= 1 then\n    ret 1\n  end\n  ret n * fact(n - 1)\nend\nprintln fact(10)',
+    'func noret()\n  x := 1\nend\nprintln noret()',
+    'func early(n)\n  i := 0\n  while true do\n    for j := 1, 10 do\n      if j == n then\n        ret j * 100\n      end\n    end\n  end\nend\nprintln early(4)',
+    'x := 1\nfunc setx()\n  x := 2\n  local y := 3\n  println y\nend\nsetx()\nprintln x',
+    'local x := 1\nfunc f()\n  local x := 5\n  ret x\nend\nprintln f()\nprintln x',
+    'func outer()\n  func inner(a)\n    ret a + 1\n  end\n  ret inner(41)\nend\nprintln outer()',
+    'func f()\n  ret 1\nend\nfunc g()\n  func f()\n    ret 2\n  end\n  ret f()\nend\nprintln g()\nprintln f()',
+    'func f(a, b)\n  ret a + b\nend\nprintln f("x", 1)\nprintln f(1, 2)',
+    'println "tab\\there"\nprint "no newline"\nprintln ""',
+    'x := (((1 + 2)))\nprintln x\nprintln (x)',
+    'println 2 ^ 3 ^ 2\nprintln -2 ^ 2\nprintln 10 - 2 - 3',
+]
+
+# Variables set to the result of a bare 'ret' (the 'ret 0' of f becomes one,
+# since the parser only makes them before a ';', which cannot end a statement)
+BARE_RETURN_PROGRAMS = [
+    'func f()\n  ret 0\nend\nx := f()\nprintln x',
+    'func f()\n  ret 0\nend\nlocal x := f()\nprintln x',
+    'func f()\n  ret 0\nend\nfunc g(a)\n  println a\nend\ng(f())',
+    'x := 1\nfunc f()\n  ret 0\nend\nfunc g()\n  local x := f()\n  println x\nend\ng()',
+    'func f()\n  ret 0\nend\nfunc g()\n  println y\nend\ng()',
+]
+
+
+def bare_return(source):
+    '''
+    The tree of source with the value of its first function's ret removed,
+    which the parser never produces
+    '''
+    ast = parse(source)
+    ast.stmts[1 if source.startswith('x :=') else 0].body_stmts.stmts[0].value = None
+    return ast
+
+
+class TestClosureInterpreter(unittest.TestCase):
+    def test_programs(self):
+        for source in PROGRAMS:
+            with self.subTest(source=source):
+                self.assertEqual(run(ClosureInterpreter, source), run(Interpreter, source))
+
+    def test_uninitialized_variables(self):
+        for source in BARE_RETURN_PROGRAMS:
+            with self.subTest(source=source):
+                expected = run(Interpreter, bare_return(source))
+                self.assertEqual(run(ClosureInterpreter, bare_return(source)), expected)
+                self.assertIn('Uninitialized variable' if 'y' not in source else 'Undefined variable', expected)
+
+    def test_scripts(self):
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            with self.subTest(script=name):
+                with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                    source = file.read()
+                # The full dragon takes minutes in the tree-walking interpreter
+                source = source.replace('dragon(60, 12, 1)', 'dragon(60, 3, 1)')
+                self.assertEqual(run(ClosureInterpreter, source), run(Interpreter, source))
+
+    def test_flat_views(self):
+        for source in PROGRAMS[-12:]:
+            with self.subTest(source=source):
+                self.assertEqual(run(ClosureInterpreter, source, flat=True), run(Interpreter, source))
+
+
+if __name__ == "__main__":
+    unittest.main()
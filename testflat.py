@@ -0,0 +1,113 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+from tokens import *
+from lexer import *
+from parser import *
+from model import *
+from flatast import *
+from compiler import *
+from interpreter import *
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+SCRIPTS = ['algol.scredu', 'dragon.scredu', 'functions.scredu', 'locals.scredu',
+           'localvar.scredu', 'myscript.scredu', 'myscript2.scredu', 'stress.scredu']
+
+
+def read_script(name):
+    with open(os.path.join(SCRIPTS_DIR, name)) as file:
+        return file.read()
+
+
+def parse(source):
+    return Parser(Lexer(source).tokenize()).parse()
+
+
+def lines(node):
+    # The line of every node, parents before children
+    result = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        result.append((type(node).__name__, getattr(node, 'line', None)))
+        stack.extend(reversed(list(iter_child_nodes(node))))
+    return result
+
+
+class TestFlatAST(unittest.TestCase):
+    def test_round_trip(self):
+        for name in SCRIPTS:
+            with self.subTest(script=name):
+                tree = parse(read_script(name))
+                back = flatten(tree).to_tree()
+                self.assertEqual(repr(back), repr(tree))
+                self.assertEqual(lines(back), lines(tree))
+                verify_ast(back)
+
+    def test_parse_flat(self):
+        for name in SCRIPTS:
+            with self.subTest(script=name):
+                source = read_script(name)
+                expected = flatten(parse(source))
+                flat = parse_flat(Parser(Lexer(source).iter_tokens()))
+                self.assertEqual(repr(flat.to_tree()), repr(expected.to_tree()))
+                self.assertEqual(flat.kinds, expected.kinds)
+                self.assertEqual(flat.children, expected.children)
+
+    def test_children_before_parents(self):
+        flat = flatten(parse(read_script('algol.scredu')))
+        self.assertEqual(flat.root, len(flat) - 1)
+        for index in range(len(flat)):
+            for child in flat.child_list(index):
+                self.assertTrue(child == NO_NODE or child < index)
+
+    def test_literals_are_shared(self):
+        flat = flatten(parse('x := 1\ny := 1.0\nz := true\nw := 1\n'))
+        self.assertEqual(sorted(map(repr, flat.values)), ["'w'", "'x'", "'y'", "'z'", '1', '1.0', 'True'])
+
+    def test_walk(self):
+        tree = parse(read_script('functions.scredu'))
+        flat = flatten(tree)
+        kinds = [node_classes[flat.kinds[index]].__name__ for index in flat.walk()]
+        self.assertEqual(kinds[0], 'Stmts')
+        self.assertEqual(sorted(kinds), sorted(kind for kind, line in lines(tree)))
+
+    def test_views(self):
+        flat = flatten(parse('if x > 1 then\n  println -x\nelse\n  f(1, "a")\nend\n'))
+        stmt = flat.node().stmts[0]
+        self.assertIsInstance(stmt, IfStmt)
+        self.assertIsInstance(stmt.test, BinOp)
+        self.assertEqual(stmt.test.op.token_type, TOK_GT)
+        self.assertEqual(stmt.test.left.name, 'x')
+        self.assertEqual(stmt.then_stmts.stmts[0].value.op.lexeme, '-')
+        call = stmt.else_stmts.stmts[0].expr
+        self.assertIsInstance(call, FuncCall)
+        self.assertEqual([arg.value for arg in call.args], [1, 'a'])
+        self.assertEqual(call.line, 4)
+        self.assertIsNone(flatten(parse('for i := 1, 2 do\nend\n')).node().stmts[0].step)
+
+    def test_compiler_walks_views(self):
+        # myscript2.scredu uses a variable the compiler does not see declared
+        for name in [name for name in SCRIPTS if name != 'myscript2.scredu']:
+            with self.subTest(script=name):
+                tree = parse(read_script(name))
+                expected = Compiler().generate_code(tree)
+                self.assertEqual(Compiler().generate_code(flatten(tree).node()), expected)
+
+    def test_interpreter_walks_views(self):
+        # dragon.scredu runs for a long time in the tree-walking interpreter
+        for name in ['algol.scredu', 'functions.scredu', 'locals.scredu', 'localvar.scredu', 'myscript2.scredu']:
+            with self.subTest(script=name):
+                outputs = []
+                tree = parse(read_script(name))
+                for ast in (tree, flatten(tree).node()):
+                    output = io.StringIO()
+                    with redirect_stdout(output):
+                        Interpreter().interpret_ast(ast)
+                    outputs.append(output.getvalue())
+                self.assertEqual(outputs[1], outputs[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
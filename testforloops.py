@@ -0,0 +1,96 @@
+import unittest
+from lexer import *
+from parser import *
+from interpreter import *
+from closures import *
+from compiler import *
+from vm import *
+from testhelpers import *
+
+# Numeric for loops, counted or run step by step, with their output
+PROGRAMS = [
+    ('for i := 1, 5 do\n  print i\nend\nprintln ""', '12345\n'),
+    ('for i := 5, 1 do\n  print i\nend\nprintln ""', '54321\n'),
+    ('for i := 1, 10, 4 do\n  print i\nend\nprintln ""\nfor i := 10, 1, -4 do\n  print i\nend\nprintln ""',
+     '159\n1062\n'),
+    ('for i := 3, 3 do\n  println i\nend', '3\n'),
+    # Ends that are not integers
+    ('for i := 1, 3.5 do\n  print i\nend\nprintln ""\nfor i := 3, 0.5 do\n  print i\nend\nprintln ""\n'
+     'for i := -1, -3.5 do\n  print i\nend\nprintln ""', '123\n321\n-1-2-3\n'),
+    # Steps and starts that are not integers
+    ('for i := 0, 1, 0.25 do\n  println i\nend', '0\n0.25\n0.5\n0.75\n1\n'),
+    ('for i := 0.5, 3 do\n  println i\nend', '0.5\n1.5\n2.5\n'),
+    ('for i := 0, 0.3, 0.1 do\n  println i\nend', '0\n0.1\n0.2\n'),
+    # The bounds and the step are evaluated once
+    ('n := 3\nfor i := 1, n do\n  n := n + 1\n  print i\nend\nprintln ""\nprintln n', '123\n6\n'),
+    # Assigning the loop variable does not change the iterations
+    ('for i := 1, 3 do\n  println i\n  i := i * 10\n  println i\nend', '1\n10\n2\n20\n3\n30\n'),
+    # A loop variable that is already set is updated where it is
+    ('i := 100\nfor i := 1, 3 do\nend\nprintln i', '3\n'),
+    ('func f()\n  for i := 1, 2 do\n    g()\n  end\nend\nfunc g()\n  println i\nend\ni := 0\nf()\nprintln i', '1\n2\n2\n'),
+    ('for i := 1, 3 do\n  local i := 7\n  print i\nend\nprintln ""', '777\n'),
+    ('func f(n)\n  total := 0\n  for i := 1, n do\n    for j := i, 1 do\n      total := total + j\n    end\n  end\n  ret total\nend\n'
+     'println f(10)', '220\n'),
+    ('func f()\n  for i := 1, 1000 do\n    if i * i > 50 then\n      ret i\n    end\n  end\nend\nprintln f()', '8\n'),
+    ('func factorial(n)\n  res := 1.0\n  for i := 1, n do\n    res := res * i\n  end\n  ret res\nend\nprintln factorial(20)',
+     '2432902008176640000\n'),
+]
+
+
+class TestCountedRange(unittest.TestCase):
+    def test_counted(self):
+        self.assertEqual(counted_range(1.0, 5.0, 1.0), range(1, 6))
+        self.assertEqual(counted_range(5.0, 1.0, -1.0), range(5, 0, -1))
+        self.assertEqual(list(counted_range(1.0, 3.5, 2.0)), [1, 3])
+        self.assertEqual(list(counted_range(-1.0, -3.5, -1.0)), [-1, -2, -3])
+        self.assertEqual(list(counted_range(2.0, 2.0, -1.0)), [2])
+
+    def test_step_by_step(self):
+        self.assertIsNone(counted_range(0.5, 3.0, 1.0))
+        self.assertIsNone(counted_range(0.0, 1.0, 0.25))
+        self.assertIsNone(counted_range(0.0, float(2 ** 60), 1.0))
+        self.assertIsNone(counted_range(0.0, float('nan'), 1.0))
+        self.assertIsNone(counted_range("a", "b", 1.0))
+        # Loops that never end are left as they are
+        self.assertIsNone(counted_range(1.0, 5.0, -1.0))
+        self.assertIsNone(counted_range(1.0, 5.0, 0.0))
+        self.assertIsNone(counted_range(2.0, 2.0, 1.0))
+
+
+class TestInterpreterForLoops(unittest.TestCase):
+    interpreter_class = Interpreter
+
+    def test_programs(self):
+        for source, expected in PROGRAMS:
+            with self.subTest(source=source):
+                self.assertEqual(run(self.interpreter_class, source), expected)
+
+
+class TestClosureForLoops(TestInterpreterForLoops):
+    interpreter_class = ClosureInterpreter
+
+
+class TestVMForLoops(unittest.TestCase):
+    def test_programs(self):
+        for source, expected in PROGRAMS:
+            # The compiler resolves names where they are written, so g() cannot see f's loop variable
+            if 'g()' in source:
+                continue
+            with self.subTest(source=source):
+                self.assertEqual(run(VM, source), expected)
+
+    def test_fused_opcodes(self):
+        code = Compiler().generate_code(Parser(Lexer('for i := 1, 3 do\n  print i\nend').tokenize()).parse())
+        opcodes = [instruction[0] for instruction in code]
+        self.assertEqual(opcodes.count('FOR_PREP'), 1)
+        self.assertEqual(opcodes.count('FOR_LOOP'), 1)
+        # The body is only the print: no compare, add or jump per iteration
+        body = opcodes[opcodes.index('FOR_PREP') + 1:opcodes.index('FOR_LOOP')]
+        self.assertEqual(body, ['LABEL', 'LOAD_LOCAL', 'PRINT'])
+
+    def test_bad_bounds(self):
+        self.assertIn('Error on FOR_PREP', run(VM, 'for i := "a", 3 do\nend'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import io
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from strings import *
+from flatast import *
+from optimizer import *
+from compiler import *
+from vm import *
+
+###############################################################################
+# Helpers shared by the back end tests: run a program on a back end and
+# capture what it prints
+###############################################################################
+
+
+def parse(source, strings=None):
+    return Parser(Lexer(source, strings=strings).tokenize(), strings).parse()
+
+
+def run_backend(backend_class, source, flat=False, memoize=True, budget=None, level=OPT_NONE):
+    '''
+    Run source, or an already parsed tree, on a back end: an interpreter class
+    or VM, after the AST optimizer at the given level. Returns what it printed,
+    the back end and the result of its run.
+
+    The SystemExit of a reported error ends the run like in scripty.py, and a
+    Python ArithmeticError, which the back ends do not catch, is printed by
+    name so that it is compared too.
+    '''
+    output = io.StringIO()
+    backend = backend_class(memoize)
+    result = None
+    with redirect_stdout(output):
+        try:
+            if isinstance(source, str):
+                strings = StringTable()
+                ast = optimize(parse(source, strings), strings, level)[0]
+            else:
+                ast = source
+            if flat:
+                ast = flatten(ast).node()
+            if backend_class is VM:
+                result = backend.run(Compiler().generate_code(ast), budget)
+            else:
+                result = backend.interpret_ast(ast, budget)
+        except SystemExit:
+            pass
+        except ArithmeticError as e:
+            print(type(e).__name__)
+    return output.getvalue(), backend, result
+
+
+def run(backend_class, source, flat=False, memoize=True, budget=None, level=OPT_NONE):
+    '''
+    What source prints when run on a back end, see run_backend()
+    '''
+    return run_backend(backend_class, source, flat, memoize, budget, level)[0]
@@ -0,0 +1,214 @@
+import os
+import copy
+import pickle
+import random
+import unittest
+from unittest import mock
+import lexer
+import parser
+from tokens import *
+from lexer import *
+from parser import *
+from model import *
+from flatast import *
+from incremental import *
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+
+class FrontEndError(Exception):
+    pass
+
+
+def raise_error(message, lineno):
+    raise FrontEndError(message, lineno)
+
+
+def dump(node):
+    '''
+    repr of the tree plus the line of every node, so line numbers are compared too
+    '''
+    root = node
+    lines = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        lines.append((type(node), getattr(node, 'line', None)))
+        for field in node.__slots__:
+            value = getattr(node, field)
+            if isinstance(value, Node):
+                stack.append(value)
+            elif isinstance(value, Token):
+                lines.append((value.lexeme, value.line))
+            elif isinstance(value, list):
+                stack.extend(child for child in value if isinstance(child, Node))
+    return repr(root), lines
+
+
+def full_parse(source):
+    try:
+        return dump(Parser(Lexer(source).tokenize()).parse())
+    except (FrontEndError, IndexError, AssertionError) as e:
+        return ('error', type(e).__name__)
+
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        patches = [mock.patch.object(lexer, 'lexing_error', raise_error),
+                   mock.patch.object(parser, 'parse_error', raise_error)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def check_edits(self, source, edits):
+        '''
+        Apply the edits one by one and return how many of them parsed, so that
+        callers can check the comparisons did not all end in the error path
+        '''
+        compared = 0
+        incremental = IncrementalParser()
+        incremental.parse(source)
+        for start, end, text in edits:
+            new_source = source[:start] + text + source[end:]
+            expected = full_parse(new_source)
+            try:
+                result = dump(incremental.edit(start, end, text))
+            except (FrontEndError, IndexError, AssertionError) as e:
+                result = ('error', type(e).__name__)
+                incremental = IncrementalParser()
+                try:
+                    incremental.parse(new_source)
+                except (FrontEndError, IndexError, AssertionError):
+                    incremental = IncrementalParser()
+                    incremental.parse('x := 0')
+                    new_source = 'x := 0'
+            self.assertEqual(result, expected, (source, start, end, text))
+            source = new_source
+            if result[0] != 'error':
+                compared += 1
+                # The parser tracks the edited source
+                self.assertEqual(incremental.source, source)
+        return compared
+
+    def test_simple_edits(self):
+        source = 'x := 1\ny := 2\nprintln x + y\n'
+        compared = self.check_edits(source, [
+            (5, 6, '42'),           # change a literal
+            (0, 0, 'z := 3\n'),     # insert a statement in front
+            (0, 0, '\n\n'),         # add lines, later statements move down
+            (2, 2, 'a'),            # extend an identifier
+        ])
+        self.assertEqual(compared, 4)
+
+    def test_structure_changes(self):
+        source = 'func f(a)\n  ret a\nend\nx := f(1)\nprintln x\n'
+        compared = self.check_edits(source, [
+            (16, 19, ''),                    # remove 'end', the function swallows the rest
+            (16, 16, 'end'),                 # put it back
+            (0, 0, '/* comment\n'),          # open a block comment
+            (0, 11, ''),                     # and remove it again
+            (len(source), len(source), 'println 1'),  # append at the end
+        ])
+        # Removing 'end' and opening the comment leave broken programs
+        self.assertGreaterEqual(compared, 2)
+
+    def test_random_edits(self):
+        rnd = random.Random(1234)
+        pieces = ['1', 'x', ' ', '\n', '+', '(', ')', 'end', 'println ', ':= ', '"s"', '--c\n', '/*', '*/', 'if ', ' then ']
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                source = file.read()
+            if full_parse(source)[0] == 'error':
+                continue
+            with self.subTest(script=name):
+                edits = []
+                length = len(source)
+                for _ in range(40):
+                    start = rnd.randrange(length + 1)
+                    end = min(length, start + rnd.choice([0, 0, 1, 2, 5]))
+                    text = rnd.choice(pieces) if rnd.random() < 0.7 else ''
+                    edits.append((start, end, text))
+                    length += len(text) - (end - start)
+                self.assertGreater(self.check_edits(source, edits), len(edits) // 4)
+
+    def test_line_edits(self):
+        # Whole-line edits keep most programs valid, so more of them are compared
+        rnd = random.Random(99)
+        new_lines = ['x := 7\n', 'println "hi"\n', '\n', '-- note\n', 'if x > 1 then println x end\n',
+                     'func g() ret 2 end\n', '/* a\nb */\n']
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                source = file.read()
+            if full_parse(source)[0] == 'error':
+                continue
+            with self.subTest(script=name):
+                edits = []
+                current = source
+                for _ in range(40):
+                    starts = [0] + [i + 1 for i, ch in enumerate(current) if ch == '\n']
+                    start = rnd.choice(starts)
+                    end = current.find('\n', start) + 1 or len(current)
+                    choice = rnd.random()
+                    if choice < 0.4:
+                        edit = (start, start, rnd.choice(new_lines))
+                    elif choice < 0.6:
+                        edit = (start, end, '')
+                    else:
+                        digits = [i for i in range(start, end) if current[i].isdigit()]
+                        if not digits:
+                            continue
+                        i = rnd.choice(digits)
+                        edit = (i, i + 1, str(rnd.randrange(100)))
+                    edits.append(edit)
+                    current = current[:edit[0]] + edit[2] + current[edit[1]:]
+                self.assertGreater(self.check_edits(source, edits), len(edits) // 2)
+
+    def test_edit_touches_only_damaged_statements(self):
+        source = ''.join(f'x{i} := {i} + y\nif x{i} > 1 then\n  println x{i}\nend\n' for i in range(200))
+        incremental = IncrementalParser()
+        incremental.parse(source)
+        stmts = list(incremental.ast.stmts)
+        before = [dump(stmt) for stmt in stmts]
+        middle = source.index('x100 :=')
+
+        # An edit within a line re-parses the statement around it and leaves
+        # the lines of the others alone
+        ast = incremental.edit(middle + 1, middle + 4, '999')
+        self.assertEqual(dump(ast), full_parse(incremental.source))
+        self.assertLess([stmt is old for stmt, old in zip(ast.stmts, stmts)].count(False), 3)
+        self.assertEqual([dump(stmt) for stmt in ast.stmts[201:]], before[201:])
+        stmts = list(ast.stmts)
+        before = [dump(stmt) for stmt in stmts]
+
+        # Adding lines re-parses only around the edit, and the statements below
+        # are the same objects, moved down
+        ast = incremental.edit(middle, middle, 'z := 0\n\n')
+        self.assertEqual(dump(ast), full_parse(incremental.source))
+        after = ast.stmts
+        self.assertEqual(len(after), len(stmts) + 1)
+        self.assertLess([stmt is old for stmt, old in zip(after, stmts)][:200].count(False), 3)
+        for old, old_dump, new in zip(stmts[201:], before[201:], after[202:]):
+            self.assertIs(new, old)
+            self.assertNotEqual(dump(new), old_dump)
+        self.assertEqual([stmt.line for stmt in after[199:203]], [400, 401, 403, 406])
+
+    def test_tree_is_a_model_tree(self):
+        source = 'func f(a)\n  ret a * 2\nend\nx := f(1)\nif x > 1 then\n  println x\nend\n'
+        incremental = IncrementalParser()
+        incremental.parse(source)
+        ast = incremental.edit(0, 0, 'y := "s"\n\n')
+        expected = full_parse(incremental.source)
+        self.assertEqual(dump(flatten(ast).to_tree()), expected)
+        self.assertEqual(dump(pickle.loads(pickle.dumps(ast))), expected)
+        self.assertEqual(dump(copy.deepcopy(ast)), expected)
+
+    def test_update_diffs_the_source(self):
+        source = 'x := 1\ny := 2\nprintln x + y\n'
+        incremental = IncrementalParser()
+        incremental.parse(source)
+        new_source = source.replace('y := 2', 'y := 2 + x * 3')
+        self.assertEqual(dump(incremental.update(new_source)), full_parse(new_source))
+
+
+if __name__ == "__main__":
+    unittest.main()
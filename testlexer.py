@@ -0,0 +1,120 @@
+import os
+import unittest
+from unittest import mock
+import lexer
+from tokens import *
+from lexer import *
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+
+class LexingError(Exception):
+    pass
+
+
+def raise_lexing_error(message, lineno):
+    raise LexingError(message, lineno)
+
+
+def run_lexer(source, engine):
+    '''
+    Returns the token stream as plain tuples, or the lexing_error arguments
+    '''
+    with mock.patch.object(lexer, 'lexing_error', raise_lexing_error):
+        try:
+            tokens = Lexer(source, engine=engine).tokenize()
+        except LexingError as e:
+            return ('error', e.args)
+    return [(token.token_type, token.lexeme, token.line) for token in tokens]
+
+
+class TestLexerParity(unittest.TestCase):
+    def assertSameTokens(self, source):
+        expected = run_lexer(source, ENGINE_SCAN)
+        result = run_lexer(source, ENGINE_REGEX)
+        self.assertEqual(result, expected)
+
+    def test_scripts(self):
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            with self.subTest(script=name):
+                with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                    self.assertSameTokens(file.read())
+
+    def test_operators(self):
+        self.assertSameTokens('a:=b==c~=d<=e>=f<g>h~i=j:k(){}[].,+-*/^;?%')
+
+    def test_numbers(self):
+        self.assertSameTokens('1 12.5 3. 4.x 5.6.7 8..9 10abc')
+
+    def test_comments(self):
+        self.assertSameTokens('x := 1 -- trailing\n/* multi\nline */ y := 2 /**/ z / 3\n--')
+
+    def test_strings(self):
+        self.assertSameTokens('"double" \'single\' "multi\nline" x "it\'s"')
+
+    def test_unicode(self):
+        self.assertSameTokens('café := 1²\nx٣ := 2\néa')
+
+    def test_unexpected_character(self):
+        self.assertEqual(run_lexer('x := 1\ny := $', ENGINE_REGEX), ('error', ("Unexpected character '$'", 2)))
+        self.assertSameTokens('x := 1\n\x1b')
+
+    def test_unterminated(self):
+        self.assertEqual(run_lexer('x := "abc', ENGINE_REGEX), ('error', ('Unterminated string', 1)))
+        self.assertSameTokens('x := "abc')
+        self.assertSameTokens('x := 1 /* never\nclosed *')
+
+
+class TestTokenArray(unittest.TestCase):
+    def test_scripts(self):
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            with self.subTest(script=name):
+                with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                    source = file.read()
+                tokens = Lexer(source).tokenize()
+                array = Lexer(source).tokenize_array()
+                self.assertEqual(len(array), len(tokens))
+                self.assertEqual([(t.token_type, t.lexeme, t.line) for t in array],
+                                 [(t.token_type, t.lexeme, t.line) for t in tokens])
+                self.assertEqual([array.lexeme(i) for i in range(len(array))], [t.lexeme for t in tokens])
+
+    def test_token_names(self):
+        self.assertEqual(token_names[TOK_IDENTIFIER], 'TOK_IDENTIFIER')
+        self.assertEqual(repr(Token(TOK_ASSIGN, ':=', 3)), "Token(TOK_ASSIGN, ':=, 3)")
+
+
+class TestInterning(unittest.TestCase):
+    def test_shared_strings(self):
+        from parser import Parser
+        from strings import StringTable
+        strings = StringTable()
+        source = 'abc := "s"\nabc := abc + "s"'
+        tokens = Lexer(source, strings=strings).tokenize()
+        self.assertIs(tokens[0].lexeme, tokens[3].lexeme)
+        ast = Parser(tokens, strings).parse()
+        first, second = ast.stmts
+        self.assertEqual(first.left.sid, second.right.left.sid)
+        self.assertEqual(first.right.sid, second.right.right.sid)
+        self.assertIs(first.right.value, second.right.right.value)
+        self.assertEqual(strings[first.left.sid], 'abc')
+
+    def test_token_array(self):
+        from parser import Parser
+        from strings import StringTable
+        source = 'abc := "s"\nabc := abc + "s"'
+        for engine in (ENGINE_REGEX, ENGINE_SCAN):
+            with self.subTest(engine=engine):
+                strings = StringTable()
+                tokens = Lexer(source, engine=engine, strings=strings).tokenize_array()
+                # Names are in the table as soon as they are lexed
+                self.assertEqual(strings.strings, ['abc'])
+                self.assertIs(tokens.lexeme(0), strings[0])
+                self.assertIs(tokens[3].lexeme, strings[0])
+                self.assertEqual([array_token.lexeme for array_token in tokens],
+                                 [token.lexeme for token in Lexer(source).tokenize()])
+                ast = Parser(tokens, strings).parse()
+                self.assertEqual(ast.stmts[0].left.sid, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
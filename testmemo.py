@@ -0,0 +1,125 @@
+import unittest
+from lexer import *
+from parser import *
+from interpreter import *
+from closures import *
+from compiler import *
+from vm import *
+from memo import *
+from testhelpers import *
+
+FIB = 'func fib(n)\n  if n < 2 then\n    ret n\n  end\n  ret fib(n - 1) + fib(n - 2)\nend\n'
+
+# Programs with pure and impure functions. Each one must print the same with
+# and without memoization, on every back end.
+PROGRAMS = [
+    FIB + 'println fib(15)',
+    # Reads a global that changes between calls
+    'k := 1\nfunc f(n)\n  ret n + k\nend\nprintln f(1)\nk := 10\nprintln f(1)',
+    # Updates a global, or prints
+    'count := 0\nfunc f(n)\n  count := count + 1\n  ret n\nend\nf(1)\nf(1)\nprintln count',
+    'func f(n)\n  println "called"\n  ret n\nend\nprintln f(1) + f(1)',
+    # Calls a function that prints
+    'func g(n)\n  println n\n  ret n\nend\nfunc f(n)\n  ret g(n) * 2\nend\nprintln f(3)\nprintln f(3)',
+    # Arguments that compare equal in Python, but not in Scripty
+    'func f(v)\n  ret v == true\nend\nprintln f(true)\nprintln f(1)\nprintln f(1)\nprintln f(true)',
+    'func f(v)\n  ret v + ""\nend\nprintln f(1)\nprintln f("1")\nprintln f(false)',
+    # Locals that only the function has, and a param it assigns
+    'func f(a)\n  a := a * 2\n  total := 0\n  for i := 1, a do\n    total := total + i\n  end\n  ret total\nend\nprintln f(3)\nprintln f(3)',
+    # No 'ret' at all
+    'func g(n)\n  x := n\nend\nprintln g(1)\nprintln g(1)',
+    # Tail calls between pure functions
+    'func even(n)\n  if n == 0 then\n    ret true\n  end\n  ret odd(n - 1)\nend\n'
+    'func odd(n)\n  if n == 0 then\n    ret false\n  end\n  ret even(n - 1)\nend\nprintln even(10)\nprintln odd(10)\nprintln even(10)',
+    # An error is reported on every call, never cached
+    'func f(n)\n  ret n - "a"\nend\nprintln f(1)',
+    'func f(a, b)\n  ret a\nend\nprintln f(1, 2)\nprintln f(1)',
+]
+
+
+def pure(source):
+    return pure_functions(parse(source))
+
+
+class TestPurity(unittest.TestCase):
+    def test_pure(self):
+        self.assertEqual(pure(FIB), {'fib'})
+        self.assertEqual(pure(PROGRAMS[7]), {'f'})
+        self.assertEqual(pure(PROGRAMS[9]), {'even', 'odd'})
+        # Its locals are not names of the scopes around it
+        self.assertEqual(pure('x := 1\nfunc f(n)\n  y := n\n  ret y\nend\nfunc g(x)\n  x := x + 1\n  ret x\nend'), {'f', 'g'})
+
+    def test_impure(self):
+        for source in [
+            'x := 1\nfunc f(n)\n  ret n + x\nend',
+            'x := 1\nfunc f(n)\n  x := n\n  ret n\nend',
+            'func f(n)\n  x := n\n  ret n\nend\nx := 1',
+            'i := 1\nfunc f(n)\n  for i := 1, n do\n  end\n  ret n\nend',
+            'func f(n)\n  print n\nend',
+            'func f(n)\n  func g()\n    print 1\n  end\n  ret n\nend',
+            'func g(n)\n  println n\nend\nfunc f(n)\n  ret g(n)\nend',
+            'func f(n)\n  ret h(n)\nend',
+            # Which f a call means depends on where it runs
+            'func f(n)\n  ret n\nend\nif true then\n  func f(n)\n    ret 2\n  end\nend',
+            # The local is not declared yet when the global may be read
+            'x := 1\nfunc f(n)\n  local x := n\n  ret x\nend',
+        ]:
+            with self.subTest(source=source):
+                self.assertEqual(pure(source), set())
+
+    def test_inner_functions(self):
+        # Declared inside another function: its locals are outer names
+        source = 'func outer(n)\n  local k := 2\n  func inner(v)\n    ret v * k\n  end\n  func twice(v)\n    ret v * 2\n  end\n  ret inner(n)\nend'
+        self.assertEqual(pure(source), {'twice'})
+
+
+class TestMemoCache(unittest.TestCase):
+    def test_lru(self):
+        cache = MemoCache(maxsize=2)
+        cache.put((1,), 'a')
+        cache.put((2,), 'b')
+        self.assertEqual(cache.get((1,)), 'a')
+        cache.put((3,), 'c')
+        # (2,) was used least recently
+        self.assertIs(cache.get((2,)), MISSING)
+        self.assertEqual((cache.get((1,)), cache.get((3,))), ('a', 'c'))
+        self.assertEqual(memo_stats({'f': cache})['f'], {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2, 'enabled': True})
+
+    def test_none_is_a_result(self):
+        cache = MemoCache()
+        cache.put((), None)
+        self.assertIsNone(cache.get(()))
+
+
+class TestMemoization(unittest.TestCase):
+    backends = [Interpreter, ClosureInterpreter, VM]
+
+    def test_same_output(self):
+        for backend in self.backends:
+            for source in PROGRAMS:
+                with self.subTest(backend=backend.__name__, source=source):
+                    self.assertEqual(run(backend, source), run(backend, source, memoize=False))
+
+    def test_stats(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.__name__):
+                # Out of reach without memoization
+                output, instance, result = run_backend(backend, FIB + 'println fib(60)')
+                self.assertEqual(output, '1548008755920\n')
+                # Every n from 60 down to 0 is computed once, fib(n - 2) is then known from n = 3 on
+                self.assertEqual(memo_stats(instance.memo), {'fib': {'hits': 58, 'misses': 61, 'evictions': 0, 'size': 61, 'enabled': True}})
+
+    def test_opt_out(self):
+        for backend in self.backends:
+            with self.subTest(backend=backend.__name__):
+                output, instance, result = run_backend(backend, 'func f(n)\n  ret n\nend\nprintln f(1)', memoize=False)
+                self.assertEqual((output, instance.memo), ('1\n', {}))
+
+    def test_memo_jsr(self):
+        code = Compiler().generate_code(parse(FIB + 'println fib(10)'))
+        calls = [instruction for instruction in code if instruction[0] in ('JSR', 'MEMO_JSR')]
+        self.assertEqual(calls, [('MEMO_JSR', 'fib')] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import unittest
+from lexer import *
+from parser import *
+from strings import *
+from interpreter import *
+from closures import *
+from compiler import *
+from vm import *
+from flatast import *
+from optimizer import *
+from testclosures import PROGRAMS, SCRIPTS_DIR
+from testhelpers import *
+
+# Programs with something to rewrite, next to the ones of testclosures
+OPTIMIZABLE = [
+    'println 2 + 3 * 4 - 10 / 4 % 3\nprintln "n=" + 1 + 1\nprintln 1 + 1 + "n"\nprintln 2 ^ 0.5',
+    'println 1 < 2 and 2 < 3\nprintln ~(1 == 1) or false\nprintln "a" ~= "b"\nprintln -(-(4))',
+    'x := 3\nprintln x * 2 + 0\nprintln 1 * (x - 1)\nprintln (x + 1) / 1 ^ 1\nprintln -(-(x * 1))',
+    'x := "s"\nprintln x + 0\nprintln 0 + x\nb := true\nprintln true and (x == "s")\nprintln (b == b) or false',
+    'x := 5\nprintln x * 2 / 4\nprintln x / 2 / 5\nprintln x * 3.141592 / 180\nprintln x * 3 * 0',
+    'println 1 / 0',
+    'println 0 % 0',
+    'println "a" - 1',
+    'x := true\nprintln x + 0',
+    'c := 2\nprintln (c * 1) * true',
+    'c := 2\nprintln false + (c - false)',
+    'println 10 ^ 400',
+    'if 1 > 2 then\n  println "no"\nelse\n  println "yes"\nend\nif 1 < 2 then\n  println "also"\nend',
+    'if true then\n  y := 1\nend\nprintln y',
+    'x := 1\nif 2 > 1 then\n  local x := 2\n  println x\nelse\n  println "dead"\nend\nprintln x',
+    'if false then\n  func f()\n    ret 1\n  end\nend\nprintln f()',
+    'i := 0\nwhile 1 > 2 do\n  i := i + 1\nend\nwhile false and true do\nend\nprintln i',
+    'func f(n)\n  if 1 == 1 then\n    ret n * 2 + 0\n  end\n  ret 0\nend\nprintln f(21)',
+    'for i := 1 + 1, 2 * 3, 4 / 2 do\n  if false then\n    println "never"\n  end\n  println i\nend',
+]
+
+
+def optimized(source, level=OPT_SAFE):
+    strings = StringTable()
+    return optimize(parse(source, strings), strings, level)
+
+
+class TestOptimizer(unittest.TestCase):
+    def value(self, source, level=OPT_SAFE):
+        ast, rewrites = optimized(source, level)
+        return ast.stmts[-1].value
+
+    def test_folding(self):
+        self.assertEqual((type(self.value('println 2 + 3 * 4')), self.value('println 2 + 3 * 4').value), (Float, 14.0))
+        self.assertEqual(self.value('println -(2 ^ 3)').value, -8.0)
+        self.assertIs(self.value('println ~(1 < 2) or "a" == "a"').value, True)
+        value = self.value('println "n=" + (1 + 1) + true')
+        self.assertEqual((type(value), value.value), (String, 'n=2true'))
+        self.assertIsNotNone(value.sid)
+
+    def test_errors_are_not_folded(self):
+        for source in ['println 1 / 0', 'println 1 % 0', 'println "a" - 1', 'println 1 < "a"',
+                       'println true == 1', 'println -"a"', 'println 10 ^ 400', 'println (-8) ^ (1 / 3)']:
+            with self.subTest(source=source):
+                self.assertIsInstance(self.value(source), (BinOp, UnOp))
+
+    def test_identities(self):
+        value = self.value('x := 1\nprintln (x * 2 + 0) * 1')
+        self.assertEqual((type(value), value.op.lexeme), (BinOp, '*'))
+        self.assertIsInstance(value.left, Identifier)
+        value = self.value('x := 1\nprintln -(-(x * 2 / 1))')
+        self.assertEqual((type(value), value.op.lexeme), (BinOp, '*'))
+        self.assertIsInstance(self.value('x := 1\nprintln true and (x > 0)'), BinOp)
+        # x may be a string, and "s" + 0 is "s0"
+        self.assertIsInstance(self.value('x := 1\nprintln x + 0'), BinOp)
+        self.assertIsInstance(self.value('x := true\nprintln x or false'), LogicalOp)
+        # true == 1 and false == 0 in Python, but a bool operand is an error
+        for source in ['x * true', 'x / true', 'x ^ true', 'x + false', 'x - false', 'true * x', 'false + x']:
+            with self.subTest(source=source):
+                value = self.value('c := 2\nprintln ' + source.replace('x', '(c * 2)'))
+                self.assertEqual(value.op.lexeme, source.split()[1])
+                self.assertIsInstance(value.left if source[0] == 'x' else value.right, BinOp)
+
+    def test_constant_factors(self):
+        source = 'x := 1\nprintln x * 3.141592 / 180'
+        self.assertIsInstance(self.value(source).right, Integer)
+        value = self.value(source, OPT_FAST_MATH)
+        self.assertEqual((value.op.lexeme, value.right.value), ('*', 3.141592 / 180))
+        value = self.value('x := 1\nprintln x / 2 / 5', OPT_FAST_MATH)
+        self.assertEqual((value.op.lexeme, value.right.value), ('/', 10.0))
+        self.assertIsInstance(self.value('x := 1\nprintln x * 2 / 0', OPT_FAST_MATH).left, BinOp)
+
+    def test_dead_branches(self):
+        ast, rewrites = optimized('if 1 > 2 then\n  println 1\nend\nwhile false do\n  println 2\nend\nprintln 3')
+        self.assertEqual(len(ast.stmts), 1)
+        ast, rewrites = optimized('if 1 < 2 then\n  println 1\nelse\n  println 2\nend')
+        self.assertIsInstance(ast.stmts[0], PrintStmt)
+        # The branch declares y, so it keeps its own scope
+        ast, rewrites = optimized('if false then\n  println 1\nelse\n  y := 1\nend')
+        self.assertEqual((type(ast.stmts[0]), ast.stmts[0].else_stmts), (IfStmt, None))
+        # Functions are known to the compiler wherever they are declared
+        ast, rewrites = optimized('if false then\n  func f()\n  end\nend')
+        self.assertIsInstance(ast.stmts[0].then_stmts.stmts[0], FuncDecl)
+        ast, rewrites = optimized('while 1 do\nend')
+        self.assertIsInstance(ast.stmts[0], WhileStmt)
+
+    def test_rewrites(self):
+        ast, rewrites = optimized('x := 1\nprintln 1 + 2\nif false then\n  println x * 1\nend')
+        self.assertEqual(rewrites, [(2, "folded '1' + '2'"), (3, "removed an 'if false' without else")])
+        self.assertEqual(optimized('x := 1\nprintln x', OPT_NONE)[1], [])
+
+    def test_input_is_unchanged(self):
+        source = 'x := 1\nprintln (x * 2 + 0) * 1\nif true then\n  println 1 + 1\nend'
+        strings = StringTable()
+        ast = parse(source, strings)
+        before = str(ast)
+        optimize(ast, strings, OPT_FAST_MATH)
+        self.assertEqual(str(ast), before)
+
+    def test_same_output(self):
+        for backend in [Interpreter, ClosureInterpreter]:
+            for source in OPTIMIZABLE + PROGRAMS:
+                with self.subTest(backend=backend.__name__, source=source):
+                    expected = run(backend, source)
+                    self.assertEqual(run(backend, source, level=OPT_SAFE), expected)
+                    self.assertEqual(run(backend, source, flat=True, level=OPT_SAFE), expected)
+
+    def test_same_output_vm(self):
+        for source in OPTIMIZABLE:
+            with self.subTest(source=source):
+                self.assertEqual(run(VM, source, level=OPT_SAFE), run(VM, source))
+
+    def test_scripts(self):
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            with self.subTest(script=name):
+                with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                    source = file.read()
+                source = source.replace('dragon(60, 12, 1)', 'dragon(60, 3, 1)')
+                self.assertEqual(run(ClosureInterpreter, source, level=OPT_SAFE), run(ClosureInterpreter, source))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import unittest
+import subprocess
+from unittest import mock
+import parser
+from tokens import *
+from lexer import *
+from parser import *
+from model import *
+
+###############################################################################
+# Golden AST tests: the tree of every script in scripts/ (and of a list of
+# tricky expressions) is compared with the dump stored in golden/. Run
+# "python testparser.py --update" to rewrite the golden files after an
+# intended change to the AST.
+###############################################################################
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(ROOT_DIR, 'scripts')
+GOLDEN_DIR = os.path.join(ROOT_DIR, 'golden')
+
+EXPRESSIONS = [
+    '1', '-1', '~true', '- -x', '+x', '~~a',
+    '1 + 2 + 3', '1 - 2 - 3', '1 - 2 + 3', '2 * 3 + 4', '2 + 3 * 4',
+    '8 / 4 / 2', '8 / 4 * 2', '7 % 3 % 2', '2 * 7 % 3', '7 % 3 * 2',
+    '2 ^ 3 ^ 2', '-2 ^ 2', '2 ^ -2', '2 ^ 3 * 4', '4 * 2 ^ 3', '2 ^ 3 % 2',
+    '1 < 2 == 3 > 4', '1 <= 2 ~= 3 >= 4', '1 + 2 < 3 * 4',
+    'a or b and c', 'a and b or c', 'a or b or c', 'a and b and c',
+    'a == b and c ~= d or ~e', '(1 + 2) * 3', '((x))', '-(1 + 2) ^ 2',
+    'f()', 'f(1, 2 + 3, g(x) * 4)', 'f(a or b) + -f(1) ^ 2',
+    '"a" + "b" * 2', '1.5 * x - y / 2.0',
+]
+
+# Each one is parsed on its own, to pin down the error messages
+BAD_EXPRESSIONS = ['x := 1 +', 'x := (1 + 2', 'x := 1 + * 2', 'x := f(1,', 'x := )', 'x := 1 2', 'x := -']
+
+
+class ParseError(Exception):
+    pass
+
+
+def raise_error(message, lineno):
+    raise ParseError(f'line {lineno}: {message}')
+
+
+def dump(node):
+    '''
+    One line per node, indented by depth, with its line number, operator and literals
+    '''
+    out = []
+    pending = [(node, 0)]
+    while pending:
+        node, depth = pending.pop()
+        if node is None:
+            out.append('  ' * depth + 'None')
+            continue
+        fields = [type(node).__name__, f'@{getattr(node, "line", "-")}']
+        children = []
+        for field in node.__slots__:
+            value = getattr(node, field)
+            if isinstance(value, Token):
+                fields.append(f'{field}={value.lexeme!r}@{value.line}')
+            elif isinstance(value, Node) or (value is None and field != 'sid'):
+                children.append(value)
+            elif isinstance(value, list):
+                children.extend(value)
+            elif field not in ('line', 'sid'):
+                fields.append(f'{field}={value!r}')
+        out.append('  ' * depth + ' '.join(fields))
+        pending.extend((child, depth + 1) for child in reversed(children))
+    return out
+
+
+def dump_source(source):
+    try:
+        return dump(Parser(Lexer(source).tokenize()).parse())
+    except ParseError as e:
+        return [f'error {e}']
+
+
+def golden_cases():
+    # (golden file name, list of sources)
+    cases = []
+    for name in sorted(os.listdir(SCRIPTS_DIR)):
+        with open(os.path.join(SCRIPTS_DIR, name)) as file:
+            cases.append((name + '.ast', [file.read()]))
+    cases.append(('expressions.ast', [''.join(f'x := {expr}\n' for expr in EXPRESSIONS)]))
+    cases.append(('errors.ast', BAD_EXPRESSIONS))
+    return cases
+
+
+class TestGoldenAST(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(parser, 'parse_error', raise_error)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_golden(self):
+        for name, sources in golden_cases():
+            with self.subTest(golden=name):
+                with open(os.path.join(GOLDEN_DIR, name)) as file:
+                    expected = file.read().splitlines()
+                self.assertEqual([line for source in sources for line in dump_source(source)], expected)
+    def test_golden_trees_verify(self):
+        for name, sources in golden_cases():
+            for source in sources:
+                try:
+                    ast = Parser(Lexer(source).tokenize()).parse()
+                except ParseError:
+                    continue
+                with self.subTest(golden=name):
+                    self.assertIs(verify_ast(ast), ast)
+
+
+class TestVerify(unittest.TestCase):
+    def test_malformed_trees(self):
+        cases = [
+            (Stmts([Integer(3, 1)], 1), 'Stmts.stmts[0] at line 1'),
+            (Stmts([PrintStmt(Integer('3', 2), '\n', 2)], 1), 'Integer.value at line 2'),
+            (Stmts([IfStmt(Bool(True, 4), Stmts([], 4), [], 4)], 1), 'IfStmt.else_stmts at line 4'),
+            (FuncDecl('f', ['a'], Stmts([], 5), 5), 'FuncDecl.params[0] at line 5'),
+            (FuncCallStmt(Identifier('f', 6)), 'FuncCallStmt.expr at line ?'),
+        ]
+        for ast, message in cases:
+            with self.subTest(message=message):
+                with self.assertRaises(VerifyError) as context:
+                    verify_ast(ast)
+                self.assertIn(message, str(context.exception))
+
+    def test_checks_run_without_assertions(self):
+        # The verifier must not be made of assert statements, which python -O drops
+        result = subprocess.run([sys.executable, '-O', '-c',
+                                 'from model import *\nverify_ast(Stmts([Integer(3, 1)], 1))'],
+                                cwd=ROOT_DIR, capture_output=True, text=True)
+        self.assertIn('VerifyError', result.stderr)
+
+
+def update_golden():
+    with mock.patch.object(parser, 'parse_error', raise_error):
+        for name, sources in golden_cases():
+            with open(os.path.join(GOLDEN_DIR, name), 'w') as file:
+                for source in sources:
+                    file.write('\n'.join(dump_source(source)) + '\n')
+
+
+if __name__ == "__main__":
+    if '--update' in sys.argv:
+        update_golden()
+    else:
+        unittest.main()
@@ -0,0 +1,131 @@
+import io
+import os
+import re
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from compiler import *
+from vm import *
+from peephole import *
+from testclosures import SCRIPTS_DIR
+from testoptimizer import OPTIMIZABLE
+from testforloops import PROGRAMS as FOR_PROGRAMS
+
+# Programs made of the patterns the peephole optimizer rewrites
+PATTERNS = [
+    'x := true\nprintln ~x\nprintln ~(1 > 2)\nprintln ~~x',
+    'println ~1',
+    'x := 1\nx := x + 1\ny := x * 2\nprintln y',
+    'func f(a)\n  b := a + 1\n  c := b * 2\n  ret c\nend\nprintln f(1)',
+    'func f(a)\n  if a > 1 then\n    ret 1\n  else\n    ret 2\n  end\nend\nprintln f(1) + f(2)',
+    'func f(a)\n  local b := 2\n  while a > 0 do\n    a := a - 1\n    if a == 2 then\n      ret b\n    end\n  end\n  ret 0\nend\n'
+    'println f(5)\nprintln f(1)',
+    'if true then\nend\nwhile false do\nend\nprintln "ok"',
+]
+
+
+def compile_source(source):
+    return Compiler().generate_code(Parser(Lexer(source).tokenize()).parse())
+
+
+def run(code):
+    '''
+    What the code prints. The program counter of an error is left out, since
+    the optimized code is shorter.
+    '''
+    output = io.StringIO()
+    with redirect_stdout(output):
+        try:
+            VM().run(code)
+        except SystemExit:
+            pass
+        except ArithmeticError as e:
+            # Not caught by the VM, but must stay the same
+            print(type(e).__name__)
+    return re.sub(r'program counter \d+', 'program counter', output.getvalue())
+
+
+class TestPeephole(unittest.TestCase):
+    def optimize(self, source):
+        code, lines, rewrites = peephole(compile_source(source))
+        return code
+
+    def test_same_output(self):
+        sources = PATTERNS + OPTIMIZABLE + [source for source, expected in FOR_PROGRAMS if 'g()' not in source]
+        for source in sources:
+            # The compiler rejects names that are set in an inner block only
+            if source.endswith('println y'):
+                continue
+            with self.subTest(source=source):
+                code = compile_source(source)
+                optimized, lines, rewrites = peephole(code)
+                self.assertLessEqual(len(optimized), len(code))
+                self.assertEqual(run(optimized), run(code))
+
+    def test_scripts(self):
+        for name in ['functions.scredu', 'locals.scredu', 'localvar.scredu', 'stress.scredu']:
+            with self.subTest(script=name):
+                with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                    code = compile_source(file.read())
+                self.assertEqual(run(peephole(code)[0]), run(code))
+
+    def test_fixed_point(self):
+        for source in PATTERNS:
+            with self.subTest(source=source):
+                code = self.optimize(source)
+                self.assertEqual(peephole(code), (code, None, {}))
+
+    def test_not(self):
+        code = self.optimize('x := true\nprintln ~x')
+        self.assertIn(('NOT',), code)
+        self.assertNotIn(('XOR',), code)
+
+    def test_store_and_load(self):
+        code = self.optimize('x := 1\nx := x + 1\nprintln x')
+        self.assertIn(('TEE_GLOBAL', 0), code)
+        code = self.optimize('func f(a)\n  a := a + 1\n  ret a\nend\nprintln f(1)')
+        self.assertIn(('TEE_LOCAL', 0), code)
+
+    def test_no_labels_or_slots_left(self):
+        code = self.optimize('func f(a)\n  local b := a\n  if b then\n    ret 1\n  end\n  ret 2\nend\nprintln f(true)')
+        opcodes = [instruction[0] for instruction in code]
+        self.assertNotIn('SET_SLOT', opcodes)
+        self.assertNotIn('START', [instruction[1] for instruction in code if instruction[0] == 'LABEL'])
+        # Every label left is a jump target
+        labels = [instruction[1] for instruction in code if instruction[0] == 'LABEL']
+        self.assertEqual(set(labels), referenced_labels(code))
+
+    def test_unreachable_epilogue(self):
+        code = self.optimize('func f()\n  ret 1\nend\nprintln f()')
+        self.assertEqual(code, [
+            ('JMP', 'LBL1'),
+            ('LABEL', 'f'),
+            ('PUSH', (TYPE_NUMBER, 1.0)),
+            ('RTS',),
+            ('LABEL', 'LBL1'),
+            ('PUSH', (TYPE_NUMBER, 0)),
+            ('MEMO_JSR', 'f'),
+            ('PRINTLN',),
+            ('HALT',),
+        ])
+
+    def test_jump_to_next(self):
+        code = self.optimize('if true then\n  println 1\nend')
+        self.assertEqual(code, [
+            ('PUSH', (TYPE_BOOL, True)),
+            ('JMPZ', 'LBL2'),
+            ('PUSH', (TYPE_NUMBER, 1.0)),
+            ('PRINTLN',),
+            ('LABEL', 'LBL2'),
+            ('HALT',),
+        ])
+        code = self.optimize('if true then\nend')
+        self.assertEqual(code, [('PUSH', (TYPE_BOOL, True)), ('POP',), ('HALT',)])
+
+    def test_errors(self):
+        self.assertIn('Error on XOR', run(self.optimize('println ~1')))
+
+
+if __name__ == "__main__":
+    unittest.main()
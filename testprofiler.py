@@ -0,0 +1,97 @@
+import io
+import re
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from interpreter import *
+from flatast import *
+from profiler import *
+
+FIB = 'func fib(n)\n  if n < 2 then\n    ret n\n  end\n  ret fib(n - 1) + fib(n - 2)\nend\nprintln fib(10)'
+EVEN = ('func even(n)\n  if n == 0 then\n    ret true\n  end\n  ret odd(n - 1)\nend\n'
+        'func odd(n)\n  if n == 0 then\n    ret false\n  end\n  ret even(n - 1)\nend\nprintln even(10)')
+
+
+class Ticks:
+    '''
+    A clock that moves a second each time it is read
+    '''
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return float(self.now)
+
+
+def profile(source, flat=False, memoize=False):
+    output = io.StringIO()
+    interpreter = ProfilingInterpreter(memoize, clock=Ticks())
+    with redirect_stdout(output):
+        ast = Parser(Lexer(source).tokenize()).parse()
+        if flat:
+            ast = flatten(ast).node()
+        run_deep(interpreter.interpret_ast, ast)
+    return output.getvalue(), interpreter.profile
+
+
+def by_label(profile):
+    return {function.label: function for function in profile.functions.values()}
+
+
+class TestProfiler(unittest.TestCase):
+    def test_same_output(self):
+        for source in [FIB, EVEN]:
+            output = io.StringIO()
+            with redirect_stdout(output):
+                Interpreter(memoize=False).interpret_ast(Parser(Lexer(source).tokenize()).parse())
+            self.assertEqual(profile(source)[0], output.getvalue())
+
+    def test_calls(self):
+        for flat in [False, True]:
+            with self.subTest(flat=flat):
+                output, result = profile(FIB, flat)
+                functions = by_label(result)
+                self.assertEqual((functions[MAIN].calls, functions['fib'].calls), (1, 177))
+                # The recursion is timed once, in the outermost call
+                fib = functions['fib']
+                self.assertLess(fib.inclusive, functions[MAIN].inclusive)
+                self.assertEqual(fib.exclusive + functions[MAIN].exclusive, functions[MAIN].inclusive)
+
+    def test_lines(self):
+        output, result = profile('i := 0\nwhile i < 5 do\n  i := i + 1\nend\nif i > 1 then\n  println i\nend')
+        self.assertEqual(result.lines, {1: 1, 2: 6, 3: 5, 5: 1, 6: 1})
+        output, result = profile('for i := 1, 3 do\n  print i\nend')
+        self.assertEqual(result.lines, {1: 1, 2: 3})
+
+    def test_collapsed(self):
+        output, result = profile(FIB)
+        lines = result.collapsed()
+        for line in lines:
+            self.assertRegex(line, r'^<main>(;fib)* \d+$')
+        # fib(10) down to fib(1)
+        self.assertEqual(len(lines), 11)
+        # All the time of the run is in some stack
+        total = sum(int(line.split()[-1]) for line in lines)
+        self.assertEqual(total, round(by_label(result)[MAIN].inclusive * 1e6))
+
+    def test_tail_calls(self):
+        # A call in tail position takes the place of its caller
+        output, result = profile(EVEN)
+        self.assertEqual([line.split()[0] for line in result.collapsed()], ['<main>', '<main>;even', '<main>;odd'])
+        self.assertEqual((by_label(result)['even'].calls, by_label(result)['odd'].calls), (6, 5))
+
+    def test_labels(self):
+        output, result = profile('func f()\n  ret 1\nend\nprintln f()\nfunc f()\n  ret 2\nend\nprintln f()\nfunc g()\nend')
+        self.assertEqual(sorted(by_label(result)), ['<main>', 'f@3', 'f@7', 'g'])
+
+    def test_report(self):
+        output, result = profile(FIB)
+        report = result.report(FIB.splitlines())
+        self.assertRegex(report, r'fib +177 ')
+        self.assertIn('ret fib(n - 1) + fib(n - 2)', report)
+
+
+if __name__ == "__main__":
+    unittest.main()
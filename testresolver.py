@@ -0,0 +1,79 @@
+import unittest
+from lexer import *
+from parser import *
+from interpreter import *
+from resolver import *
+from flatast import *
+from utils import *
+from testhelpers import *
+
+
+def error(line, message):
+    return f'{Colors.RED}Error at line {line}: {message}{Colors.WHITE}\n'
+
+
+# Programs where the dynamic scoping rules matter, with their output
+PROGRAMS = [
+    # A global read until the local is declared
+    ('x := 5\nfunc f()\n  println x\n  local x := 1\n  println x\nend\nf()\nprintln x',
+     '5\n1\n5\n'),
+    # Declared later in the loop body, read on the next iteration
+    ('i := 0\nwhile i < 3 do\n  if i > 0 then\n    println y\n  end\n  y := i\n  i := i + 1\nend\nprintln y',
+     '0\n1\n' + error(9, "Undefined variable 'y'.")),
+    # The same assignment creates a local on the first call and updates the global on the second
+    ('func f()\n  x := 2\nend\nf()\nx := 1\nprintln x\nf()\nprintln x',
+     '1\n2\n'),
+    # The loop variable updates a variable that is already set
+    ('i := 10\nfor i := 1, 3 do\nend\nprintln i\nfor j := 1, 2 do\n  for j := 5, 6 do\n  end\n  println j\nend',
+     '3\n6\n6\n'),
+    ('if true then\n  z := 1\nend\nprintln z',
+     error(4, "Undefined variable 'z'.")),
+    ('f()\nfunc f()\nend',
+     error(1, 'Function f not declared.')),
+    ('if true then\n  func f()\n    ret 1\n  end\n  println f()\nend\nf()',
+     '1\n' + error(7, 'Function f not declared.')),
+    # Functions see their declaring frame as it is when they are called
+    ('func outer()\n  local n := 1\n  func inner()\n    ret n\n  end\n  n := 2\n  ret inner()\nend\nprintln outer()',
+     '2\n'),
+    ('func fib(n)\n  if n < 2 then\n    ret n\n  end\n  ret fib(n - 1) + fib(n - 2)\nend\nprintln fib(15)',
+     '610\n'),
+    ('func f(a, a)\n  ret a\nend\nprintln f(1, 2)',
+     '2\n'),
+    # g updates the global until f declares its own x
+    ('x := 1\nfunc f()\n  func g()\n    x := x + 1\n  end\n  g()\n  local x := 10\n  g()\n  ret x\nend\nprintln f()\nprintln x',
+     '11\n2\n'),
+]
+
+
+class TestResolver(unittest.TestCase):
+    def test_programs(self):
+        for source, expected in PROGRAMS:
+            with self.subTest(source=source):
+                self.assertEqual(run(Interpreter, source), expected)
+
+    def test_flat_views(self):
+        for source, expected in PROGRAMS:
+            with self.subTest(source=source):
+                self.assertEqual(run(Interpreter, source, flat=True), expected)
+
+    def test_blocks_without_declarations_get_no_frame(self):
+        ast = parse('x := 0\nfor i := 1, 10 do\n  if i > 5 then\n    x := x + i\n  end\n  while x < 0 do\n  end\nend')
+        accesses, frames = Resolver().resolve_ast(ast)
+        loop = ast.stmts[1]
+        self.assertEqual(frames, {ast: 1, loop: 1})
+        # x is set before the loop, so it is reached with a single candidate
+        assignment = loop.body_stmts.stmts[0].then_stmts.stmts[0]
+        self.assertEqual(accesses[assignment], ((1, 0),))
+        self.assertEqual(accesses[assignment.right.left], ((1, 0),))
+
+    def test_candidates_follow_shadowing(self):
+        ast = parse('func f()\n  x := 2\nend\nx := 1')
+        accesses, frames = Resolver().resolve_ast(ast)
+        func = ast.stmts[0]
+        self.assertEqual(frames, {ast: 2, func: 1})
+        # Either the local of f or the global, whichever is set first
+        self.assertEqual(accesses[func.body_stmts.stmts[0]], ((0, 0), (1, 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from lexer import *
+from parser import *
+from interpreter import *
+from closures import *
+from testhelpers import *
+
+# Programs built around 'ret', with their output
+PROGRAMS = [
+    ('func f()\n  ret 1\n  println "unreachable"\nend\nprintln f()',
+     '1\n'),
+    ('func f(n)\n  if n > 0 then\n    ret "positive"\n  else\n    if n < 0 then\n      ret "negative"\n    end\n  end\n  ret "zero"\nend\n'
+     'println f(1)\nprintln f(-1)\nprintln f(0)',
+     'positive\nnegative\nzero\n'),
+    # Out of nested loops, and the loops of the caller keep going
+    ('func find(n)\n  i := 0\n  while true do\n    for j := 1, 10 do\n      for k := 1, 10 do\n        if j * k == n then\n          ret j * 100 + k\n'
+     '        end\n      end\n    end\n    i := i + 1\n  end\nend\nfor n := 14, 16 do\n  println find(n)\nend',
+     '207\n305\n208\n'),
+    ('func f()\n  for i := 10, 1 do\n    if i == 7 then\n      ret i\n    end\n  end\nend\nprintln f()',
+     '7\n'),
+    # Values that are false or zero still end the function
+    ('func f(v)\n  ret v\n  println "unreachable"\nend\nprintln f(false)\nprintln f(0)\nprintln f("")\nprintln f(0 == 0)',
+     'false\n0\n\ntrue\n'),
+    ('func noret()\n  x := 1\nend\nprintln noret()',
+     '0\n'),
+    # The value of a call statement is dropped and does not end the caller
+    ('func g()\n  ret 5\nend\nfunc f()\n  g()\n  println "after g"\n  ret 6\nend\nprintln f()',
+     'after g\n6\n'),
+    ('func fact(n)\n  if n <= 1 then\n    ret 1\n  end\n  ret n * fact(n - 1)\nend\nprintln fact(20)',
+     '2432902008176640000\n'),
+    ('func count(n)\n  if n == 0 then\n    ret 0\n  end\n  ret 1 + count(n - 1)\nend\nprintln count(100)',
+     '100\n'),
+]
+
+
+class TestReturns(unittest.TestCase):
+    interpreter_class = Interpreter
+
+    def test_programs(self):
+        for source, expected in PROGRAMS:
+            with self.subTest(source=source):
+                self.assertEqual(run(self.interpreter_class, source), expected)
+
+
+class TestClosureReturns(TestReturns):
+    interpreter_class = ClosureInterpreter
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import io
+import os
+import mmap
+import tempfile
+import unittest
+from tokens import *
+from lexer import *
+from parser import *
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts')
+
+
+def as_tuples(tokens):
+    return [(token.token_type, token.lexeme, token.line) for token in tokens]
+
+
+class CountingReader(io.StringIO):
+    '''
+    A text file that remembers how much of it has been read
+    '''
+    def __init__(self, text):
+        super().__init__(text)
+        self.chars_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.chars_read += len(chunk)
+        return chunk
+
+
+class TestStreaming(unittest.TestCase):
+    def scripts(self):
+        for name in sorted(os.listdir(SCRIPTS_DIR)):
+            if name == 'myscript1.scredu':
+                continue  # does not parse
+            with open(os.path.join(SCRIPTS_DIR, name)) as file:
+                yield name, file.read()
+
+    def test_chunk_boundaries(self):
+        # Every chunk size must give the same tokens as lexing the whole string
+        for name, source in self.scripts():
+            expected = as_tuples(Lexer(source).tokenize())
+            for chunk_size in (1, 2, 3, 7, 64, CHUNK_SIZE):
+                with self.subTest(script=name, chunk_size=chunk_size):
+                    tokens = Lexer(io.StringIO(source)).iter_tokens(chunk_size)
+                    self.assertEqual(as_tuples(tokens), expected)
+
+    def test_tricky_boundaries(self):
+        source = 'x := 12.5 -- c\n/* a\nb */ s := "q\nr" y := 1.x z:=a~=b café²\n'
+        expected = as_tuples(Lexer(source).tokenize())
+        for chunk_size in range(1, len(source) + 1):
+            tokens = Lexer(io.StringIO(source)).iter_tokens(chunk_size)
+            self.assertEqual(as_tuples(tokens), expected)
+
+    def test_mmap(self):
+        with tempfile.TemporaryFile() as file:
+            file.write('café := "ü"\nprintln café\n'.encode('utf-8'))
+            file.flush()
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                tokens = as_tuples(Lexer(mapped).iter_tokens(3))
+        self.assertEqual(tokens, as_tuples(Lexer('café := "ü"\nprintln café\n').tokenize()))
+
+    def test_stream_parser(self):
+        for name, source in self.scripts():
+            with self.subTest(script=name):
+                expected = Parser(Lexer(source).tokenize()).parse()
+                result = Parser(Lexer(io.StringIO(source)).iter_tokens(16)).parse()
+                self.assertEqual(repr(result), repr(expected))
+                self.assertEqual(result.line, expected.line)
+
+    def test_first_statement_before_end_of_file(self):
+        source = 'x := 1\n' + 'println x + 1\n' * 10000
+        reader = CountingReader(source)
+        stmts = Parser(Lexer(reader).iter_tokens(1024)).iter_stmts()
+        first = next(stmts)
+        self.assertEqual(repr(first), 'Assignment(Identifier(x), Integer[1])')
+        self.assertLess(reader.chars_read, len(source) // 10)
+        self.assertEqual(sum(1 for stmt in stmts), 10000)
+
+
+if __name__ == "__main__":
+    unittest.main()
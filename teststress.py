@@ -0,0 +1,192 @@
+import io
+import os
+import sys
+import time
+import threading
+import tempfile
+import subprocess
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from model import *
+from compiler import *
+from peephole import *
+from assembler import *
+from interpreter import *
+from vm import *
+from utils import *
+
+###############################################################################
+# Deep nesting stress tests: machine-generated programs nested DEPTH levels
+# deep must parse, compile and run with the right output on both back ends,
+# and the time must grow roughly linearly with the depth. The VM runs them
+# through the peephole optimizer and the assembler, as scripty.py does.
+###############################################################################
+DEPTH = 10000
+
+
+def parens(n):
+    return 'x := ' + '(' * n + '1' + ')' * n + '\nprintln x\n', '1\n'
+
+
+def unary_minus(n):
+    return 'x := ' + '- ' * n + '1\nprintln x\n', ('-1\n' if n % 2 else '1\n')
+
+
+def exponent_chain(n):
+    # '^' is right associative, so this nests to the right
+    return 'x := ' + '1 ^ ' * n + '1\nprintln x\n', '1\n'
+
+
+def nested_calls(n):
+    return 'func f(a)\n  ret a + 1\nend\nx := ' + 'f(' * n + '0' + ')' * n + '\nprintln x\n', f'{n}\n'
+
+
+def nested_ifs(n):
+    return ('x := 0\n' + 'if true then\n' * n + 'x := x + 1\n' + 'end\n' * n + 'println x\n'), '1\n'
+
+
+def nested_if_else(n):
+    return ('x := 0\n' + 'if false then\nx := 2\nelse\n' * n + 'x := x + 1\n' + 'end\n' * n + 'println x\n'), '1\n'
+
+
+def nested_whiles(n):
+    return ('w := 0\n' + 'while w < 1 do\n' * n + 'w := 1\n' + 'end\n' * n + 'println w\n'), '1\n'
+
+
+def nested_fors(n):
+    return ('x := 0\n' + 'for i := 1, 1 do\n' * n + 'x := x + 1\n' + 'end\n' * n + 'println x\n'), '1\n'
+
+
+# Recursion without a base case must end with an error, not exhaust memory or crash
+RUNAWAY = 'func f(n)\n  ret 1 + f(n)\nend\nprintln f(1)\n'
+SCRIPTY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripty.py')
+
+CASES = [parens, unary_minus, exponent_chain, nested_calls, nested_ifs, nested_if_else, nested_whiles, nested_fors]
+
+
+def parse(source):
+    return Parser(Lexer(source).tokenize()).parse()
+
+
+def interpret(source):
+    output = io.StringIO()
+    with redirect_stdout(output):
+        Interpreter().interpret_ast(parse(source))
+    return output.getvalue()
+
+
+def compile_and_run(source):
+    output = io.StringIO()
+    compiler = Compiler()
+    code = compiler.generate_code(parse(source))
+    code = assemble(*peephole(code, compiler.lines)[:2])
+    with redirect_stdout(output):
+        VM().run(code)
+    return output.getvalue()
+
+
+def timed(fn, source):
+    # Best of two runs, to keep the ratios below steady
+    best = None
+    for _ in range(2):
+        start = time.perf_counter()
+        fn(source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class TestDeepNesting(unittest.TestCase):
+    def check(self, backend, cases):
+        for case in cases:
+            with self.subTest(case=case.__name__):
+                source, expected = case(DEPTH)
+                self.assertEqual(run_deep(backend, source), expected)
+
+    def test_interpreter(self):
+        self.check(interpret, CASES)
+
+    def test_vm(self):
+        self.check(compile_and_run, CASES)
+
+    def test_deep_tree_walks(self):
+        # Walks that recurse through C (repr) or that were written with an explicit stack
+        ast = run_deep(parse, parens(DEPTH)[0])
+        verify_ast(ast)
+        self.assertEqual(run_deep(repr, ast).count('Grouping('), DEPTH)
+
+    def test_entry_points_run_deep(self):
+        # Called straight from a library user, not through run_deep()
+        for case in CASES:
+            with self.subTest(case=case.__name__):
+                source, expected = case(DEPTH)
+                self.assertEqual(interpret(source), expected)
+                self.assertEqual(compile_and_run(source), expected)
+
+    def test_linear_time(self):
+        for backend in (interpret, compile_and_run):
+            for case in CASES:
+                with self.subTest(backend=backend.__name__, case=case.__name__):
+                    small = run_deep(timed, backend, case(DEPTH)[0])
+                    large = run_deep(timed, backend, case(4 * DEPTH)[0])
+                    # Linear growth gives a ratio of 4 and quadratic growth 16
+                    self.assertLess(large / small, 9, f'{small:.3f}s -> {large:.3f}s')
+
+    def test_concurrent_runs(self):
+        # The first run ends while the second is still in its deep run: the
+        # recursion limit must hold until the second one ends too
+        def rec(n):
+            return 0 if n == 0 else rec(n - 1) + 1
+
+        old_limit = sys.getrecursionlimit()
+        second_started = threading.Event()
+        first_done = threading.Event()
+        results = {}
+
+        def first():
+            second_started.wait(10)
+            return 'first'
+
+        def second():
+            second_started.set()
+            first_done.wait(10)
+            return rec(20000)
+
+        def call(name, fn, done=None):
+            try:
+                results[name] = run_deep(fn)
+            except BaseException as e:
+                results[name] = e
+            if done is not None:
+                done.set()
+
+        threads = [threading.Thread(target=call, args=('first', first, first_done)),
+                   threading.Thread(target=call, args=('second', second))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(60)
+        self.assertEqual(results, {'first': 'first', 'second': 20000})
+        self.assertEqual(sys.getrecursionlimit(), old_limit)
+
+
+class TestRunawayRecursion(unittest.TestCase):
+    def test_stack_overflow(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'runaway.scredu')
+            with open(path, 'w') as file:
+                file.write(RUNAWAY)
+            for backend in ('interpreter', 'closures', 'vm'):
+                with self.subTest(backend=backend):
+                    # In a process of its own, so a crash is a failure and not the end of the tests
+                    result = subprocess.run([sys.executable, SCRIPTY, path, '--backend', backend, '--no-cache'],
+                                            capture_output=True, text=True, timeout=120)
+                    self.assertEqual(result.returncode, 1, result.stderr[-2000:])
+                    self.assertIn('Stack overflow, too many nested function calls.', result.stdout)
+                    self.assertEqual(result.stderr, '')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import io
+import time
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from compiler import *
+from assembler import *
+from vm import *
+
+
+def compile_source(source):
+    compiler = Compiler()
+    code = compiler.generate_code(Parser(Lexer(source).tokenize()).parse())
+    return compiler, code
+
+
+def run_ast(ast):
+    # Run a tree built by hand, without the parser and so without StringTable ids
+    compiler = Compiler()
+    code = assemble(compiler.generate_code(ast), compiler.lines)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        VM().run(code)
+    return output.getvalue()
+
+
+def slots(code, opcodes=('LOAD_LOCAL', 'STORE_LOCAL', 'LOAD_GLOBAL', 'STORE_GLOBAL')):
+    return [instruction for instruction in code if instruction[0] in opcodes]
+
+
+class TestSymbols(unittest.TestCase):
+    def test_globals(self):
+        compiler, code = compile_source('a := 1\nb := 2\na := b\nprintln a')
+        self.assertEqual(slots(code), [('STORE_GLOBAL', 0), ('STORE_GLOBAL', 1), ('LOAD_GLOBAL', 1),
+                                       ('STORE_GLOBAL', 0), ('LOAD_GLOBAL', 0)])
+        self.assertEqual([symbol.name for symbol in compiler.globals], ['a', 'b'])
+
+    def test_shadowing(self):
+        source = ('x := 1\nif true then\n  local x := 2\n  if true then\n    local x := 3\n    println x\n  end\n'
+                  '  println x\nend\nprintln x')
+        compiler, code = compile_source(source)
+        self.assertEqual(slots(code), [('STORE_GLOBAL', 0), ('LOAD_LOCAL', 1), ('LOAD_LOCAL', 0), ('LOAD_GLOBAL', 0)])
+        # Leaving the blocks drops their names
+        self.assertEqual(compiler.locals, [])
+        self.assertEqual(compiler.local_slots, {})
+
+    def test_slots_reused_after_scope_exit(self):
+        source = 'if true then\n  local a := 1\n  println a\nend\nif true then\n  local b := 2\n  println b\nend'
+        compiler, code = compile_source(source)
+        self.assertEqual(slots(code), [('LOAD_LOCAL', 0), ('LOAD_LOCAL', 0)])
+
+    def test_params_and_locals(self):
+        source = 'x := 0\nfunc f(a, b)\n  c := a + b\n  x := c\n  ret c\nend\nprintln f(1, 2)'
+        compiler, code = compile_source(source)
+        self.assertEqual(slots(code), [('STORE_GLOBAL', 0), ('LOAD_LOCAL', 0), ('LOAD_LOCAL', 1),
+                                       ('LOAD_LOCAL', 2), ('STORE_GLOBAL', 0), ('LOAD_LOCAL', 2)])
+
+    def test_for_loop_variable(self):
+        compiler, code = compile_source('for i := 1, 3 do\n  local j := i\n  println j\nend')
+        # Slot 0 is the loop's state
+        self.assertIn(('FOR_PREP', False, True, 1, False, 'LBL2'), code)
+        self.assertEqual(slots(code), [('LOAD_LOCAL', 1), ('LOAD_LOCAL', 2)])
+
+    def test_functions(self):
+        compiler, code = compile_source('func f()\n  ret 1\nend\nfunc g()\n  ret f()\nend\nprintln g()')
+        self.assertEqual([symbol.name for symbol in compiler.functions], ['f', 'g'])
+        self.assertIs(compiler.get_func_symbol(compiler.functions[0].sid), compiler.functions[0])
+        with redirect_stdout(io.StringIO()):
+            self.assertRaises(SystemExit, compile_source, 'func f()\nend\nfunc f()\nend')
+            self.assertRaises(SystemExit, compile_source, 'f := 1\nfunc f()\nend')
+
+    def test_strings_without_ids(self):
+        ast = Stmts([PrintStmt(String('a', 1), '\n', 1), PrintStmt(String('b', 2), '\n', 2),
+                     PrintStmt(String('a', 3), '\n', 3)], 1)
+        self.assertEqual(run_ast(ast), 'a\nb\na\n')
+
+    def test_names_without_ids(self):
+        ast = Stmts([Assignment(Identifier('a', 1), Integer(1, 1), 1),
+                     Assignment(Identifier('b', 2), Integer(2, 2), 2),
+                     FuncDecl('f', [Param('x', 3)], Stmts([RetStmt(Identifier('x', 4), 4)], 4), 5),
+                     FuncDecl('g', [], Stmts([RetStmt(Identifier('b', 6), 6)], 6), 7),
+                     PrintStmt(Identifier('a', 8), '\n', 8),
+                     PrintStmt(FuncCall('f', [Identifier('b', 9)], 9), '\n', 9),
+                     PrintStmt(FuncCall('g', [], 10), '\n', 10)], 1)
+        self.assertEqual(run_ast(ast), '1\n2\n2\n')
+
+    def test_linear_time(self):
+        def compile_time(n):
+            source = ''.join(f'x{i} := {i}\n' for i in range(n)) + 'func f()\n'
+            source += ''.join(f'  local y{i} := x{i}\n' for i in range(n)) + 'end\n'
+            ast = Parser(Lexer(source).tokenize()).parse()
+            best = None
+            for _ in range(2):
+                start = time.perf_counter()
+                Compiler().generate_code(ast)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+        small, large = compile_time(5000), compile_time(20000)
+        # Linear growth gives a ratio of 4 and quadratic growth 16
+        self.assertLess(large / small, 9, f'{small:.3f}s -> {large:.3f}s')
+
+
+if __name__ == "__main__":
+    unittest.main()
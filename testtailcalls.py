@@ -0,0 +1,100 @@
+import io
+import unittest
+from contextlib import redirect_stdout
+from lexer import *
+from parser import *
+from compiler import *
+from interpreter import *
+from closures import *
+from vm import *
+from testhelpers import *
+
+# Far deeper than the Python stack allows without tail calls
+ITERATIONS = 100000
+
+LOOP = ('func loop(n, acc)\n  if n == 0 then\n    ret acc\n  end\n  ret loop(n - 1, acc + n)\nend\n'
+        f'println loop({ITERATIONS}, 0)\n')
+LOOP_OUTPUT = f'{ITERATIONS * (ITERATIONS + 1) // 2}\n'
+
+# Programs with calls in tail position, with their output
+PROGRAMS = [
+    (LOOP, LOOP_OUTPUT),
+    ('func even(n)\n  if n == 0 then\n    ret true\n  end\n  ret odd(n - 1)\nend\n'
+     'func odd(n)\n  if n == 0 then\n    ret false\n  end\n  ret even(n - 1)\nend\n'
+     f'println even({ITERATIONS})\nprintln odd({ITERATIONS})',
+     'true\nfalse\n'),
+    # From inside loops, which are left for good
+    ('func count(n)\n  while true do\n    for i := 1, 3 do\n      if n > 0 then\n        ret count(n - 1)\n      end\n'
+     '      ret "done"\n    end\n  end\nend\n'
+     f'println count({ITERATIONS})',
+     'done\n'),
+    # The caller's locals are gone, the callee sees its own
+    ('func g(a)\n  ret a + 1\nend\nfunc f(a)\n  local b := 10\n  ret g(a + b)\nend\nprintln f(1)',
+     '12\n'),
+    ('func f()\n  println "called"\nend\nret f()\nprintln "unreachable"',
+     'called\n'),
+    ('func g(a, b)\n  ret a\nend\nfunc f()\n  ret g(1)\nend\nf()',
+     f'{Colors.RED}Error at line 5: Function g expects 2 arguments, but got 1.{Colors.WHITE}\n'),
+]
+
+
+class PeakVM(VM):
+    '''
+    Records the most frames and stack values seen at a call
+    '''
+    def __init__(self):
+        super().__init__()
+        self.peak_frames = 0
+        self.peak_stack = 0
+
+    def record(self):
+        self.peak_frames = max(self.peak_frames, len(self.frames))
+        self.peak_stack = max(self.peak_stack, len(self.stack))
+
+    def JSR(self, target, label):
+        super().JSR(target, label)
+        self.record()
+
+    def TAIL_JSR(self, target, label):
+        super().TAIL_JSR(target, label)
+        self.record()
+
+
+class TestInterpreterTailCalls(unittest.TestCase):
+    interpreter_class = Interpreter
+
+    def test_programs(self):
+        # No run_deep(): these must fit in the default recursion limit
+        for source, expected in PROGRAMS:
+            with self.subTest(source=source):
+                self.assertEqual(run(self.interpreter_class, source), expected)
+
+
+class TestClosureTailCalls(TestInterpreterTailCalls):
+    interpreter_class = ClosureInterpreter
+
+
+class TestVMTailCalls(unittest.TestCase):
+    def compile(self, source):
+        return Compiler().generate_code(parse(source))
+
+    def test_tail_position(self):
+        code = self.compile('func f(n)\n  ret n\nend\nfunc g(n)\n  x := f(n)\n  ret f(n) + 1\nend\n'
+                            'func h(n)\n  ret g(n)\nend\nprintln h(1)')
+        calls = [instruction for instruction in code if instruction[0] in ('JSR', 'MEMO_JSR', 'TAIL_JSR')]
+        # The functions are pure, so their other calls go through the memo cache
+        self.assertEqual(calls, [('MEMO_JSR', 'f'), ('MEMO_JSR', 'f'), ('TAIL_JSR', 'g'), ('MEMO_JSR', 'h')])
+
+    def test_constant_memory(self):
+        vm = PeakVM()
+        output = io.StringIO()
+        with redirect_stdout(output):
+            vm.run(self.compile(LOOP))
+        self.assertEqual(output.getvalue(), LOOP_OUTPUT)
+        self.assertEqual(vm.peak_frames, 1)
+        self.assertLessEqual(vm.peak_stack, 2)
+        self.assertEqual((vm.frames, vm.stack), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
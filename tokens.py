@@ -1,60 +1,68 @@
 
+from array import array
+
 ###############################################################################
 # Constants for different token types
+#
+# Token types are small integers so the parser compares ints, not strings.
+# Use token_names to get the readable name back (e.g. for error messages).
 ###############################################################################
 # Single-char tokens
-TOK_LPAREN     = 'TOK_LPAREN'     #  (
-TOK_RPAREN     = 'TOK_RPAREN'     #  )
-TOK_LCURLY     = 'TOK_LCURLY'     #  {
-TOK_RCURLY     = 'TOK_RCURLY'     #  }
-TOK_LSQUAR     = 'TOK_LSQUAR'     #  [
-TOK_RSQUAR     = 'TOK_RSQUAR'     #  ]
-TOK_COMMA      = 'TOK_COMMA'      #  ,
-TOK_DOT        = 'TOK_DOT'        #  .
-TOK_PLUS       = 'TOK_PLUS'       #  +
-TOK_MINUS      = 'TOK_MINUS'      #  -
-TOK_STAR       = 'TOK_STAR'       #  *
-TOK_SLASH      = 'TOK_SLASH'      #  /
-TOK_CARET      = 'TOK_CARET'      #  ^
-TOK_MOD        = 'TOK_MOD'        #  %
-TOK_COLON      = 'TOK_COLON'      #  :
-TOK_SEMICOLON  = 'TOK_SEMICOLON'  #  ;
-TOK_QUESTION   = 'TOK_QUESTION'   #  ?
-TOK_NOT        = 'TOK_NOT'        #  ~
-TOK_GT         = 'TOK_GT'         #  >
-TOK_LT         = 'TOK_LT'         #  <
-TOK_EQ         = 'TOK_EQ'         #  =
+TOK_LPAREN     = 0   #  (
+TOK_RPAREN     = 1   #  )
+TOK_LCURLY     = 2   #  {
+TOK_RCURLY     = 3   #  }
+TOK_LSQUAR     = 4   #  [
+TOK_RSQUAR     = 5   #  ]
+TOK_COMMA      = 6   #  ,
+TOK_DOT        = 7   #  .
+TOK_PLUS       = 8   #  +
+TOK_MINUS      = 9   #  -
+TOK_STAR       = 10  #  *
+TOK_SLASH      = 11  #  /
+TOK_CARET      = 12  #  ^
+TOK_MOD        = 13  #  %
+TOK_COLON      = 14  #  :
+TOK_SEMICOLON  = 15  #  ;
+TOK_QUESTION   = 16  #  ?
+TOK_NOT        = 17  #  ~
+TOK_GT         = 18  #  >
+TOK_LT         = 19  #  <
+TOK_EQ         = 20  #  =
 # Two-char tokens
-TOK_GE         = 'TOK_GE'         #  >=
-TOK_LE         = 'TOK_LE'         #  <=
-TOK_NE         = 'TOK_NE'         #  ~=
-TOK_EQEQ         = 'TOK_EQEQ'         #  ==
-TOK_ASSIGN     = 'TOK_ASSIGN'     #  :=
-TOK_GTGT       = 'TOK_GTGT'       #  >>
-TOK_LTLT       = 'TOK_LTLT'       #  <<
+TOK_GE         = 21  #  >=
+TOK_LE         = 22  #  <=
+TOK_NE         = 23  #  ~=
+TOK_EQEQ       = 24  #  ==
+TOK_ASSIGN     = 25  #  :=
+TOK_GTGT       = 26  #  >>
+TOK_LTLT       = 27  #  <<
 # Literals
-TOK_IDENTIFIER = 'TOK_IDENTIFIER'
-TOK_STRING     = 'TOK_STRING'
-TOK_INTEGER    = 'TOK_INTEGER'
-TOK_FLOAT      = 'TOK_FLOAT'
+TOK_IDENTIFIER = 28
+TOK_STRING     = 29
+TOK_INTEGER    = 30
+TOK_FLOAT      = 31
 # Keywords
-TOK_IF         = 'TOK_IF'
-TOK_THEN       = 'TOK_THEN'
-TOK_ELSE       = 'TOK_ELSE'
-TOK_TRUE       = 'TOK_TRUE'
-TOK_FALSE      = 'TOK_FALSE'
-TOK_AND        = 'TOK_AND'
-TOK_OR         = 'TOK_OR'
-TOK_LOCAL      = 'TOK_LOCAL'
-TOK_WHILE      = 'TOK_WHILE'
-TOK_DO         = 'TOK_DO'
-TOK_FOR        = 'TOK_FOR'
-TOK_FUNC       = 'TOK_FUNC'
-TOK_NULL       = 'TOK_NULL'
-TOK_END        = 'TOK_END'
-TOK_PRINT      = 'TOK_PRINT'
-TOK_PRINTLN    = 'TOK_PRINTLN'
-TOK_RET        = 'TOK_RET'
+TOK_IF         = 32
+TOK_THEN       = 33
+TOK_ELSE       = 34
+TOK_TRUE       = 35
+TOK_FALSE      = 36
+TOK_AND        = 37
+TOK_OR         = 38
+TOK_LOCAL      = 39
+TOK_WHILE      = 40
+TOK_DO         = 41
+TOK_FOR        = 42
+TOK_FUNC       = 43
+TOK_NULL       = 44
+TOK_END        = 45
+TOK_PRINT      = 46
+TOK_PRINTLN    = 47
+TOK_RET        = 48
+
+# Readable name of every token type, e.g. token_names[TOK_IF] == 'TOK_IF'
+token_names = {value: name for name, value in list(globals().items()) if name.startswith('TOK_')}
 
 ###############################################################################
 # Dictionary mapping keywords and their token types
@@ -80,6 +88,8 @@ keywords = {
 }
 
 class Token:
+    __slots__ = ('token_type', 'lexeme', 'line')
+
     def __init__(self, token_type, lexeme, line):
         # lexeme is a raw string representing the token's value
         self.token_type = token_type
@@ -87,4 +97,59 @@ class Token:
         self.line = line
 
     def __repr__(self):
-        return f"Token({self.token_type}, '{self.lexeme}, {self.line})"
\ No newline at end of file
+        return f"Token({token_names[self.token_type]}, '{self.lexeme}, {self.line})"
+
+
+class TokenArray:
+    '''
+    Columnar token storage: parallel arrays of token type, start offset, end
+    offset and line. Lexemes are sliced from the source only when a token is
+    read back, so a token costs 13 bytes instead of a Token and a string (17
+    with a StringTable, which adds the id of each name).
+    '''
+    def __init__(self, source, strings=None):
+        self.source = source
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.lines = array('I')
+        # With a StringTable, names are interned as they are lexed, like Lexer
+        # does for Token lists, and read back as the interned strings
+        self.strings = strings
+        if strings is not None:
+            self.sids = array('i')  # StringTable id of each name, -1 for other tokens
+            self.append = self.append_interned
+        # The parser reads the same one or two tokens over and over, so keep
+        # the last Token built for an even and for an odd index
+        self.cached_index = [None, None]
+        self.cached_token = [None, None]
+
+    def append(self, token_type, start, end, line):
+        self.kinds.append(token_type)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+
+    def append_interned(self, token_type, start, end, line):
+        TokenArray.append(self, token_type, start, end, line)
+        self.sids.append(self.strings.intern(self.source[start:end]) if token_type == TOK_IDENTIFIER else -1)
+
+    def lexeme(self, index):
+        if self.strings is not None and self.sids[index] >= 0:
+            return self.strings[self.sids[index]]
+        return self.source[self.starts[index]:self.ends[index]]
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        # Build the Token on demand, so the parser can index a TokenArray like a list
+        slot = index & 1
+        if self.cached_index[slot] != index:
+            self.cached_token[slot] = Token(self.kinds[index], self.lexeme(index), self.lines[index])
+            self.cached_index[slot] = index
+        return self.cached_token[slot]
+
+    def __iter__(self):
+        for index in range(len(self.kinds)):
+            yield self[index]
\ No newline at end of file
@@ -1,4 +1,6 @@
 import sys
+import functools
+import threading
 def print_pretty_ast(ast_text):
     i = 0
     newline = False
@@ -51,6 +53,112 @@ def compile_error(message, lineno):
     print(f"{Colors.RED}Error at program counter {lineno}: {message}{Colors.WHITE}")
     sys.exit(1)
 
+# The parser, the compiler and the interpreters recurse once per nesting level
+# of the program. Python-to-Python calls mostly cost heap memory, but calls that
+# go through C (f(*args), the repr of a deep tree) also use the C stack,
+# up to about 400 bytes per Python frame. So the work runs on a thread with a
+# large stack (only the pages touched are used), under a recursion limit that
+# leaves over 1 KB of that stack per frame. That limit is what bounds how deep
+# a program can nest: it is a few frames per level, so a program nested about
+# 100,000 levels deep still runs, and a runaway recursion ends with a
+# RecursionError instead of exhausting memory or crashing the process.
+DEEP_RECURSION_LIMIT = 500_000
+DEEP_STACK_SIZE = 512 * 1024 * 1024
+
+deep_thread = threading.local()  # .active is set on the threads run_deep() starts
+
+# The recursion limit and the stack size of new threads are process-wide, and
+# several threads may run_deep() at once, as when scripts run side by side. The
+# limit is raised by the first run that starts and restored by the last one
+# that ends, and a thread is started with the large stack under the lock.
+deep_lock = threading.Lock()
+deep_runs = 0          # run_deep() threads running, under deep_lock
+deep_old_limit = None  # the recursion limit before the first of them
+
+
+def run_deep(fn, *args, **kwargs):
+    '''
+    Call fn(*args, **kwargs) so that deeply nested programs do not hit the
+    recursion limit or overflow the C stack. Exceptions (including the
+    SystemExit of the *_error functions) are re-raised in the calling thread.
+    Called from fn, it just makes the call.
+    '''
+    global deep_runs, deep_old_limit
+    if getattr(deep_thread, 'active', False):
+        return fn(*args, **kwargs)
+    outcome = []
+
+    def target():
+        deep_thread.active = True
+        try:
+            outcome.append((True, fn(*args, **kwargs)))
+        except BaseException as e:
+            outcome.append((False, e))
+
+    with deep_lock:
+        try:
+            old_size = threading.stack_size(DEEP_STACK_SIZE)
+        except (ValueError, RuntimeError):
+            old_size = None
+        else:
+            try:
+                thread = threading.Thread(target=target, daemon=True)
+                if deep_runs == 0:
+                    deep_old_limit = sys.getrecursionlimit()
+                    sys.setrecursionlimit(max(deep_old_limit, DEEP_RECURSION_LIMIT))
+                deep_runs += 1
+                try:
+                    thread.start()
+                except BaseException:
+                    end_deep_run()
+                    raise
+            finally:
+                threading.stack_size(old_size)
+    if old_size is None:
+        # No large thread stacks on this platform: the current thread, with
+        # the recursion limit its stack was given
+        target()
+        deep_thread.active = False
+    else:
+        try:
+            thread.join()
+        finally:
+            with deep_lock:
+                end_deep_run()
+    ok, value = outcome[0]
+    if not ok:
+        raise value
+    return value
+
+def end_deep_run():
+    '''
+    Count a run_deep() thread as ended, restoring the recursion limit after
+    the last one. Called with deep_lock held.
+    '''
+    global deep_runs
+    deep_runs -= 1
+    if deep_runs == 0:
+        sys.setrecursionlimit(deep_old_limit)
+
+def deep(fn):
+    '''
+    Decorator for the entry points of the front and back ends, which always
+    run through run_deep(), whoever calls them
+    '''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return run_deep(fn, *args, **kwargs)
+    return wrapper
+
+class StackOverflow(Exception):
+    '''
+    Raised from the innermost function call when the interpreters hit the
+    recursion limit, with the line of that call
+    '''
+    def __init__(self, line):
+        super().__init__(line)
+        self.line = line
+
 class Colors:
     WHITE = '\033[0m'
     BLUE = '\033[94m'
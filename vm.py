@@ -23,6 +23,7 @@
 #      ('AND',)              # Bitwise AND
 #      ('XOR',)              # Bitwise XOR
 #      ('NEG',)              # Negate
+#      ('NOT',)              # Logical not, the PUSH true; XOR of ~x fused by the peephole optimizer
 #      ('EXP',)              # Exponent
 #      ('MOD',)              # Modulo
 #      ('EQ',)               # Compare ==
@@ -46,6 +47,10 @@
 #      ('STORE_GLOBAL, slot) # Save top of the stack into global variable (identified by an index/slot)
 #      ('LOAD_LOCAL', slot)  # Push a local variable from a stack slot/index to the top of the stack
 #      ('STORE_LOCAL, slot)  # Save top of the stack to local variable by slot/index
+#      ('TEE_GLOBAL', slot)  # Save top of the stack into a global variable, leaving it on the stack
+#      ('TEE_LOCAL', slot)   # Save top of the stack to a local variable, leaving it on the stack
+#
+# NOT and the TEE instructions are only made by the peephole optimizer (peephole.py)
 #
 # Instructions to manage control-flow (if-else, while, etc.)
 #
@@ -53,53 +58,106 @@
 #      ('JMP', name)         # Unconditionally jump to label name
 #      ('JMPZ', name)        # Jump to label name if top of stack is zero (or false)
 #      ('JSR', name)         # Jump to subroutine/function and keep track of the returning PC
+#      ('TAIL_JSR', name)    # Jump to subroutine/function in tail position, reusing the current frame
+#      ('MEMO_JSR', name)    # JSR to a pure function, whose result may be in the memo cache (memo.py)
 #      ('RTS',)              # Return from subroutine/function
+#
+# Instructions of numeric for loops, each taking the place of a load/add/store/compare/jump sequence
+#
+#      ('FOR_PREP', has_step, new_var, var_slot, var_global, exit_label)
+#                            # Pop start, end and the step (if has_step) and push the loop's state. Set the
+#                            # loop variable to start, pushing it when it is a new local, or jump to exit_label
+#                            # if the loop does not run at all
+#      ('FOR_LOOP', state_slot, var_slot, var_global, body_label)
+#                            # Step the loop whose state is in local state_slot: set the loop variable to the
+#                            # next value and jump back to body_label, or fall through once it is past the end
 #      ('HALT',)             # Halt/stops the execution
+#
+# The VM runs the code as the assembler leaves it (assembler.py): opcodes are numbers, the LABEL
+# instructions are gone and every label operand is the pc it stands for. So the handlers below get
+# JMP target_pc, JSR target_pc name, FOR_PREP ... exit_pc, and so on.
 
 from definitions import *
 from utils import *
+from memo import *
+from budget import *
+from assembler import *
 import codecs
 
 
+# Frames are plain objects in a list, so nothing but memory bounds the call
+# depth. Like the interpreters under run_deep(), a runaway recursion stops with
+# a stack overflow error long before that.
+MAX_FRAMES = 100_000
+
+
 class Frame:
     def __init__(self, name, ret_pc, fp):
         self.name = name
         self.ret_pc = ret_pc
         # fp - frame pointer
         self.fp = fp
+        # (cache, args) of a MEMO_JSR call, whose result RTS stores
+        self.memo = None
 
 
 class VM:
-    def __init__(self):
+    def __init__(self, memoize=True):
+        self.memoize = memoize
+        self.memo = {}  # function name -> MemoCache
         self.stack = []
         self.frames = []
-        self.labels = {}
         self.globals = {}
+        self.code = None
         self.pc = 0
         self.sp = 0
         self.is_running = False
-
-    def create_label_table(self, instructions):
-        self.labels = {}
-        pc = 0
-        for instruction in instructions:
-            opcode, *args = instruction
-            if opcode == 'LABEL':
-                self.labels.update({args[0]: pc})
-            pc += 1
-
-    def run(self, instructions):
+        # The method of each opcode number
+        self.handlers = [getattr(self, name) for name in OPCODES]
+
+    def run(self, code, budget=None):
+        '''
+        Run a program from the start, within the budget if one is given (see
+        budget.py). Returns a RunResult. The code is a Code, or the compiler's
+        instructions, which are assembled first.
+        '''
+        if not isinstance(code, Code):
+            code = assemble(code)
+        self.code = code
         self.pc = 0
         self.sp = 0
         self.is_running = True
-
-        # Generate a dict with label names and their corresponding PC positions/addresses in the code
-        self.create_label_table(instructions)
-
+        return self.resume(budget)
+
+    def resume(self, budget=None):
+        '''
+        Go on with the program from where the last budget stopped it
+        '''
+        ops = self.code.ops
+        args = self.code.args
+        handlers = self.handlers
+        if budget is None:
+            while self.is_running:
+                pc = self.pc
+                self.pc = pc + 1
+                handlers[ops[pc]](*args[pc])  # --> invoke the method of the opcode
+            return RunResult(RUN_DONE)
+
+        budget.start()
         while self.is_running:
-            opcode, *args = instructions[self.pc]
-            self.pc = self.pc + 1
-            getattr(self, opcode)(*args)  # --> invoke the method that matches the opcode name
+            # The instructions up to the next check of the budget
+            left = budget.left
+            while left and self.is_running:
+                pc = self.pc
+                self.pc = pc + 1
+                handlers[ops[pc]](*args[pc])
+                left -= 1
+            budget.left = left
+            if self.is_running:
+                status = budget.check()
+                if status is not None:
+                    return budget.result(status, resumable=True)
+        return budget.result(RUN_DONE)
 
     def PUSH(self, value):
         self.stack.append(value)
@@ -196,6 +254,14 @@ class VM:
         else:
             vm_error(f'Error on NEG between {operandtype}', self.pc - 1)
 
+    def NOT(self):
+        operandtype, operand = self.POP()
+        if operandtype == TYPE_BOOL:
+            self.PUSH((TYPE_BOOL, not operand))
+        else:
+            # Same error as the XOR it replaces
+            vm_error(f'Error on XOR between {operandtype} and {TYPE_BOOL}', self.pc - 1)
+
     def LT(self):
         righttype, rightval = self.POP()
         lefttype, leftval = self.POP()
@@ -268,30 +334,66 @@ class VM:
         valtype, val = self.POP()
         print(codecs.escape_decode(bytes(stringify(val), "utf-8"))[0].decode("utf-8"), end='\n')
 
-    def LABEL(self, name):
-        pass
-
-    def JMP(self, label):
-        self.pc = self.labels[label]
+    def JMP(self, target):
+        self.pc = target
 
-    def JMPZ(self, label):
+    def JMPZ(self, target):
         valtype, val = self.POP()
         if val == 0 or val == False:
-            self.pc = self.labels[label]
+            self.pc = target
 
-    def JSR(self, label):
+    def JSR(self, target, label):
+        if len(self.frames) >= MAX_FRAMES:
+            vm_error('Stack overflow, too many nested function calls.', self.pc - 1)
         _, numargs = self.POP() # we don't need the type
         base_pointer = self.sp - numargs
         new_frame = Frame(name=label, ret_pc=self.pc, fp=base_pointer)
         self.frames.append(new_frame)
-        self.pc = self.labels[label]  # <- JumptoSubRoutine
+        self.pc = target  # <- JumptoSubRoutine
+
+    def TAIL_JSR(self, target, label):
+        # Replace the current frame's values with the args, which are on top of
+        # the stack, so the callee's RTS returns straight to our caller
+        _, numargs = self.POP()
+        frame = self.frames[-1]
+        args = self.stack[self.sp - numargs:self.sp]
+        del self.stack[frame.fp:]
+        self.stack.extend(args)
+        self.sp = frame.fp + numargs
+        frame.name = label
+        self.pc = target
+
+    def MEMO_JSR(self, target, label):
+        if not self.memoize:
+            return self.JSR(target, label)
+        cache = self.memo.get(label)
+        if cache is None:
+            cache = self.memo[label] = MemoCache()
+        elif not cache.enabled:
+            return self.JSR(target, label)
+        _, numargs = self.stack[self.sp - 1]
+        base_pointer = self.sp - 1 - numargs
+        key = tuple(self.stack[base_pointer:self.sp - 1])
+        result = cache.get(key)
+        if result is MISSING:
+            self.JSR(target, label)
+            self.frames[-1].memo = (cache, key)
+        else:
+            # Known result: drop the args and numargs, as RTS would
+            del self.stack[base_pointer:]
+            self.sp = base_pointer
+            self.PUSH(result)
 
     def RTS(self):
         result = self.stack[self.sp - 1]
         while self.sp > self.frames[-1].fp:
             self.POP()
         self.PUSH(result)
-        self.pc = self.frames.pop().ret_pc
+        frame = self.frames.pop()
+        if frame.memo is not None:
+            cache, key = frame.memo
+            cache.put(key, result)
+        self.pc = frame.ret_pc
 
     def LOAD_GLOBAL(self, slot):
         self.PUSH(self.globals[slot])
@@ -309,8 +411,51 @@ class VM:
             slot += self.frames[-1].fp
         self.stack[slot] = self.POP()
 
+    def TEE_GLOBAL(self, slot):
+        self.globals[slot] = self.stack[self.sp - 1]
+
+    def TEE_LOCAL(self, slot):
+        if len(self.frames) > 0:
+            slot += self.frames[-1].fp
+        self.stack[slot] = self.stack[self.sp - 1]
+
     def SET_SLOT(self, slot):
         pass
 
+    def FOR_PREP(self, has_step, new_var, var_slot, var_global, exit_pc):
+        # Same as the Interpreter: the direction is set by the bounds, and the
+        # step only defaults to it
+        steptype, step = self.POP() if has_step else (TYPE_NUMBER, None)
+        endtype, end = self.POP()
+        starttype, start = self.POP()
+        if starttype != TYPE_NUMBER or endtype != TYPE_NUMBER or steptype != TYPE_NUMBER:
+            vm_error(f'Error on FOR_PREP with {starttype}, {endtype} and {steptype}.', self.pc - 1)
+        ascending = start < end
+        if step is None:
+            step = 1.0 if ascending else -1.0
+        # The state is [value, end, step, ascending], changed in place by FOR_LOOP
+        self.PUSH([start, end, step, ascending])
+        value = (TYPE_NUMBER, start)
+        if new_var:
+            self.PUSH(value)
+        elif var_global:
+            self.globals[var_slot] = value
+        else:
+            self.stack[var_slot + (self.frames[-1].fp if self.frames else 0)] = value
+        if not (start <= end if ascending else start >= end):
+            self.pc = exit_pc
+
+    def FOR_LOOP(self, state_slot, var_slot, var_global, body_pc):
+        fp = self.frames[-1].fp if self.frames else 0
+        state = self.stack[state_slot + fp]
+        value = state[0] + state[2]
+        if value <= state[1] if state[3] else value >= state[1]:
+            state[0] = value
+            if var_global:
+                self.globals[var_slot] = (TYPE_NUMBER, value)
+            else:
+                self.stack[var_slot + fp] = (TYPE_NUMBER, value)
+            self.pc = body_pc
+
     def HALT(self):
         self.is_running = False